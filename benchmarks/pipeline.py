@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""Benchmark of the per-request overhead of the OAuth filters
+
+Compares the stacked filter pipeline - AuthenticationFormMiddleware,
+Oauth2AuthorizationMiddleware, Oauth2ServerMiddleware and
+Oauth2ResourceServerMiddleware, each wrapping the next - with
+Oauth2PipelineMiddleware configured with the same options, both behind a
+Beaker session filter.  Reports the time per request for a check_token call,
+a request for a protected resource and a request passed through to the
+application.
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+from optparse import OptionParser
+import os
+import shutil
+import tempfile
+import timeit
+import uuid
+
+from beaker.middleware import SessionMiddleware
+
+from ndg.oauth.server.lib.register.access_token import AccessToken
+from ndg.oauth.server.lib.register.authorization_grant import \
+                                                        AuthorizationGrant
+from ndg.oauth.server.wsgi.authentication_filter import \
+    AuthenticationFormMiddleware
+from ndg.oauth.server.wsgi.authorization_filter import \
+    Oauth2AuthorizationMiddleware
+from ndg.oauth.server.wsgi.oauth2_server import Oauth2ServerMiddleware
+from ndg.oauth.server.wsgi.pipeline import Oauth2PipelineMiddleware
+from ndg.oauth.server.wsgi.resource_server import \
+    Oauth2ResourceServerMiddleware
+
+SESSION_KEY = 'beaker.session.oauth2server'
+SCOPE = 'https://localhost/resource'
+REGISTER = """[client_register]
+clients=
+
+[resource_register]
+resources=
+"""
+
+
+class _Request(object):
+    """The parts of an AuthorizeRequest that a grant is made from."""
+    client_id = 'client'
+    redirect_uri = None
+    scope = SCOPE
+
+
+def make_conf(data_dir):
+    """Returns the options of the filters, with the registers in data_dir."""
+    register_file = os.path.join(data_dir, 'register.ini')
+    with open(register_file, 'w') as register:
+        register.write(REGISTER)
+    return {
+        'authenticationForm.client_register': register_file,
+        'authenticationForm.session_key_name': SESSION_KEY,
+        'oauth2authorization.client_register': register_file,
+        'oauth2authorization.session_key_name': SESSION_KEY,
+        'oauth2server.client_register': register_file,
+        'oauth2server.resource_register': register_file,
+        'oauth2server.base_url_path': '/oauth',
+        'oauth2server.client_authentication_method': 'none',
+        'oauth2server.cache.accesstokenregister.type': 'memory',
+        'oauth2server.cache.authorizationgrantregister.type': 'memory',
+        'oauth2.resource_server.resource_uripaths': '^/resource',
+        'oauth2.resource_server.required_scope': SCOPE,
+    }
+
+
+def app(environ, start_response):
+    start_response('200 OK', [('Content-type', 'text/plain')])
+    return ['resource']
+
+
+def make_stacked(conf):
+    """Returns the filters wrapping each other, as in a Paste pipeline."""
+    resource_server = Oauth2ResourceServerMiddleware.filter_app_factory(
+                                                            app, {}, **conf)
+    server = Oauth2ServerMiddleware(resource_server, {}, **conf)
+    authorization = Oauth2AuthorizationMiddleware(server, {}, **conf)
+    authentication = AuthenticationFormMiddleware(authorization, {}, **conf)
+    return authentication, server._authorizationServer
+
+
+def make_fused(conf):
+    """Returns the filters combined in one."""
+    pipeline = Oauth2PipelineMiddleware(app, {}, **conf)
+    return pipeline, pipeline.oauth2_server._authorizationServer
+
+
+def add_token(authorization_server):
+    grant = AuthorizationGrant(uuid.uuid4().hex, _Request(), 600,
+                               additional_data={'user_identifier': 'user'})
+    token = AccessToken(uuid.uuid4().hex, None, grant, 'bearer', 86400)
+    authorization_server.access_token_register.add_token(token)
+    return token.token_id
+
+
+def make_environ(path, query='', token_id=None):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if token_id is not None:
+        environ['HTTP_AUTHORIZATION'] = 'Bearer ' + token_id
+    return environ
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def bench(wsgi_app, environ, number):
+    def call():
+        for _ in wsgi_app(dict(environ), start_response):
+            pass
+    call()
+    return min(timeit.repeat(call, number=number, repeat=3)) / number
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-n', '--number', type='int', default=2000,
+                      help='number of requests per measurement '
+                           '[default: %default]')
+    options = parser.parse_args()[0]
+
+    data_dir = tempfile.mkdtemp()
+    try:
+        conf = make_conf(data_dir)
+        session_conf = {'session.type': 'memory',
+                        'session.key': 'session',
+                        'session.auto': False}
+        pipelines = []
+        for name, factory in (('stacked', make_stacked),
+                              ('fused', make_fused)):
+            wsgi_app, authorization_server = factory(conf)
+            wsgi_app = SessionMiddleware(wsgi_app, environ_key=SESSION_KEY,
+                                         **session_conf)
+            pipelines.append((name, wsgi_app,
+                              add_token(authorization_server)))
+
+        print '%-14s %12s %12s' % ('request', 'stacked (us)', 'fused (us)')
+        for label, path, with_query, with_header in (
+                ('check_token', '/oauth/check_token', True, False),
+                ('resource', '/resource', False, True),
+                ('pass-through', '/static/page.html', False, False)):
+            times = []
+            for name, wsgi_app, token_id in pipelines:
+                environ = make_environ(
+                        path,
+                        query='access_token=%s&scope=%s' % (token_id, SCOPE)
+                              if with_query else '',
+                        token_id=token_id if with_header else None)
+                times.append(bench(wsgi_app, environ, options.number) * 1e6)
+            print '%-14s %12.1f %12.1f' % ((label,) + tuple(times))
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Benchmark of the size and serialisation cost of register records
+
+Reports the pickled size of an access token, with its grant, and the time
+taken to pickle and unpickle one, for the pickle protocols used by the
+register storage types, and for the compact serializer.
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import cPickle
+from optparse import OptionParser
+import timeit
+import uuid
+
+from ndg.oauth.server.lib.oauth.authorize import AuthorizeRequest
+from ndg.oauth.server.lib.register.access_token import AccessToken
+from ndg.oauth.server.lib.register.authorization_grant import \
+                                                        AuthorizationGrant
+from ndg.oauth.server.lib.register.serializer import CompactSerializer
+
+# Protocol 0 is used by Beaker's file storage, the highest protocol by the
+# sqlite storage type.
+PROTOCOLS = (0, cPickle.HIGHEST_PROTOCOL)
+
+
+def make_token():
+    """Creates an access token as issued by BearerTokenGenerator for a grant
+    made by AuthorizerStoringIdentifier.
+    """
+    request = AuthorizeRequest('code', 'client-22',
+                               'https://client.example.org/callback',
+                               'https://example.org/scope/a '
+                               'https://example.org/scope/b', None)
+    grant = AuthorizationGrant(uuid.uuid4().hex, request, 600,
+                               additional_data={
+                                'user_identifier':
+                                    'https://idp.example.org/openid/jbloggs'})
+    token = AccessToken(uuid.uuid4().hex, None, grant, 'bearer', 86400)
+    grant.granted = True
+    grant.token = token
+    return token
+
+
+def measure(dumps, loads, value, options):
+    """Returns the serialised size of a value and the time in microseconds
+    taken to serialise and deserialise it.
+    """
+    data = dumps(value)
+    dumps_time = min(timeit.repeat(lambda: dumps(value),
+                                   number=options.number,
+                                   repeat=options.repeat))
+    loads_time = min(timeit.repeat(lambda: loads(data),
+                                   number=options.number,
+                                   repeat=options.repeat))
+    return (len(data), dumps_time * 1e6 / options.number,
+            loads_time * 1e6 / options.number)
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('-n', '--number', type='int', default=100000,
+                      help="serialisations per measurement [%default]")
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help="measurements, of which the best is taken "
+                           "[%default]")
+    options = parser.parse_args()[0]
+
+    token = make_token()
+    print "%-10s %10s %14s %14s" % ('encoding', 'bytes', 'dumps (us)',
+                                    'loads (us)')
+    for protocol in PROTOCOLS:
+        print "%-10s %10d %14.2f %14.2f" % (
+            ('pickle %d' % protocol,) +
+            measure(lambda value: cPickle.dumps(value, protocol),
+                    cPickle.loads, token, options))
+
+    serializer = CompactSerializer(pickle_fallback=False)
+    print "%-10s %10d %14.2f %14.2f" % (
+        ('compact',) +
+        measure(serializer.dumps, serializer.loads, token, options))
+
+
+if __name__ == '__main__':
+    main()
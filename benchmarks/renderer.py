@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""Compatibility check and benchmark of CompiledRenderer against GenshiRenderer
+
+Renders each of the example templates with representative parameters - with
+and without the optional client details, and with values that need escaping -
+and checks that CompiledRenderer gives the same output as GenshiRenderer.
+Then reports the time per render of each renderer.
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+from optparse import OptionParser
+import os
+import sys
+import timeit
+
+import ndg.oauth.server.examples
+from ndg.oauth.server.lib.render.compiled_renderer import CompiledRenderer
+from ndg.oauth.server.lib.render.genshi_renderer import GenshiRenderer
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(ndg.oauth.server.examples.__file__),
+                            'bearer_tok', 'templates')
+TEMPLATES = ('login_form.html', 'auth_client_form.html',
+             'login_cancelled.html')
+
+# Layout parameters as set in the example configuration
+LAYOUT = {
+    'heading': 'OAuth Login',
+    'title': 'OAuth Login',
+    'message': '',
+    'leftLogo': '',
+    'leftAlt': '',
+    'leftImage': '',
+    'leftLink': '',
+    'rightLink': 'http://ceda.ac.uk/',
+    'rightImage': '/layout/CEDA_RightButton60.png',
+    'rightAlt': 'Centre for Environmental Data Archival',
+    'footerText': u'This site is for <em>test</em> purposes only.',
+    'helpIcon': '/layout/help.png',
+}
+
+PARAMETER_SETS = (
+    ('no client', {
+        'return_url': 'https://localhost:5000/oauth/authorize?a=1&b=2',
+        'return_url_param': 'returnurl',
+        'submit_url': 'https://localhost:5000/authentication/login',
+        'baseURL': 'https://localhost:5000',
+        'client_id': None,
+        'client_name': None,
+        'scope': None}),
+    ('client', {
+        'return_url': 'https://localhost:5000/oauth/authorize?a=1&b=2',
+        'return_url_param': 'returnurl',
+        'submit_url': 'https://localhost:5000/client_authorization/client_auth',
+        'baseURL': 'https://localhost:5000',
+        'client_id': '22',
+        'client_name': 'Test client',
+        'scope': 'https://localhost:5000/resource1.html'}),
+    ('escaping', {
+        'return_url': 'https://localhost/"><script>alert(1)</script>&x=\'y\'',
+        'return_url_param': 'returnurl',
+        'submit_url': 'https://localhost/login?x="1"&y=<2>',
+        'baseURL': 'https://localhost',
+        'client_id': u'cli\xebnt "<&>"',
+        'client_name': u'Na\xefve <b>client</b> & co',
+        'scope': '"scope" <a> & <b>'}),
+)
+
+
+def check(compiled_renderer, genshi_renderer):
+    """Returns the number of template and parameter combinations for which the
+    renderers give different output."""
+    failures = 0
+    for template in TEMPLATES:
+        filename = os.path.join(TEMPLATE_DIR, template)
+        for label, parameters in PARAMETER_SETS:
+            parameters = dict(LAYOUT, **parameters)
+            ok = compiled_renderer.check_template(filename, parameters)
+            # Render again from the compiled template, as for later requests.
+            ok = ok and (compiled_renderer.render(filename, parameters) ==
+                         genshi_renderer.render(filename, parameters))
+            print '%-22s %-10s %s' % (template, label, 'ok' if ok else 'DIFFERS')
+            if not ok:
+                failures += 1
+    return failures
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-n', '--number', type='int', default=2000,
+                      help='number of renders per measurement '
+                           '[default: %default]')
+    options = parser.parse_args()[0]
+
+    genshi_renderer = GenshiRenderer()
+    compiled_renderer = CompiledRenderer()
+    failures = check(compiled_renderer, genshi_renderer)
+    print
+
+    print '%-22s %12s %12s' % ('template', 'genshi (us)', 'compiled (us)')
+    parameters = dict(LAYOUT, **PARAMETER_SETS[1][1])
+    for template in TEMPLATES:
+        filename = os.path.join(TEMPLATE_DIR, template)
+        times = []
+        for renderer, number in ((genshi_renderer, options.number // 10),
+                                 (compiled_renderer, options.number)):
+            render = lambda: renderer.render(filename, parameters)
+            render()
+            times.append(min(timeit.repeat(render, number=number, repeat=3)) /
+                         number * 1e6)
+        print '%-22s %12.1f %12.1f' % ((template,) + tuple(times))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
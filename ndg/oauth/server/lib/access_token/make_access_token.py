@@ -7,10 +7,16 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 
-from datetime import datetime
+import logging
+import time
 
 from ndg.oauth.server.lib.oauth.oauth_exception import OauthException
 from ndg.oauth.server.lib.oauth.access_token import AccessTokenResponse
+from ndg.oauth.server.lib.register.mmap_token_store import \
+                                                        TokenTableFullError
+from ndg.oauth.server.lib.register.token_index import TokenIndexRegister
+
+log = logging.getLogger(__name__)
 
 AUTHORIZATION_CODE_GRANT_TYPE = 'authorization_code'
 
@@ -27,43 +33,76 @@ def make_access_token(token_request, client_id, access_token_register, access_to
     if token_request.grant_type != AUTHORIZATION_CODE_GRANT_TYPE:
         raise OauthException('invalid_request', 'Invalid grant_type')
 
-    try:
-        grant = authorization_grant_register.get_value(token_request.code)
-    except KeyError:
-        raise OauthException('invalid_grant', 'Invalid authorization code')
+    def check_grant(grant):
+        if (grant.redirect_uri is not None) and (token_request.redirect_uri != grant.redirect_uri):
+            raise OauthException('invalid_grant', 'Invalid redirect URI')
 
-    if (grant.redirect_uri is not None) and (token_request.redirect_uri != grant.redirect_uri):
-        raise OauthException('invalid_grant', 'Invalid redirect URI')
+        # Check whether expired.
+        if grant.expires <= time.time():
+            raise OauthException('invalid_grant', 'Authorization grant expired')
 
-    if grant.granted:
-        # Invalidate the associated token.
-        if grant.token:
-            grant.token.valid = False
-        raise OauthException('invalid_grant', 'Token already granted for authorization grant')
+        # Check that the grant is issued to the requesting client.
+        # This requires that the client has authenticated itself so that the
+        # client identity is known.
+        # client_id is None if client authentication is not configured - this
+        # signals that authentication is disabled for testing.
+        if client_id and (grant.client_id != client_id):
+            raise OauthException('invalid_grant', 'Token granted for different client')
 
-    # Check whether expired.
-    if grant.expires <= datetime.utcnow():
-        raise OauthException('invalid_grant', 'Authorization grant expired')
+    # The grant is checked and marked as granted in one register update, so
+    # that a code can only be exchanged once across all server processes.
+    grant, redeemed = authorization_grant_register.redeem_grant(
+                                                token_request.code, check_grant)
+    if grant is None:
+        raise OauthException('invalid_grant', 'Invalid authorization code')
 
-    # Check that the grant is issued to the requesting client.
-    # This requires that the client has authenticated itself so that the
-    # client identity is known.
-    # client_id is None if client authentication is not configured - this
-    # signals that authentication is disabled for testing.
-    if client_id and (grant.client_id != client_id):
-        raise OauthException('invalid_grant', 'Token granted for different client')
+    if not redeemed:
+        # The code has been used before - invalidate the tokens issued for it.
+        revoke_grant_tokens(grant, access_token_register)
+        raise OauthException('invalid_grant', 'Token already granted for authorization grant')
 
-    token = access_token_generator.get_access_token(token_request, grant, request)
-    if not token:
+    added = False
+    try:
+        token = access_token_generator.get_access_token(token_request, grant,
+                                                        request)
+        if token:
+            added = access_token_register.add_token(token)
+    except TokenTableFullError, exc:
+        log.error("Cannot register access token: %s", exc)
+        raise OauthException('server_error', 'Access token register is full')
+    finally:
+        if not added:
+            # No token was issued, so the client may present the code again
+            # without it being treated as reused.
+            authorization_grant_register.release_grant(grant.code)
+    if not added:
         return None
 
-    grant.granted = True
-    grant.token = token
+    # The grant was stored when it was redeemed, so the token is recorded in
+    # it separately, to be revoked if the code is presented again.
+    authorization_grant_register.set_grant_token(grant.code, token)
+    return AccessTokenResponse(token.token_id, token.token_type,
+                               token.lifetime, refresh_token=None)
 
-    response = AccessTokenResponse(token.token_id, token.token_type,
-                                   token.lifetime, refresh_token=None)
 
-    if access_token_register.add_token(token):
-        return response
+def revoke_grant_tokens(grant, access_token_register):
+    """
+    Revokes the access tokens issued from an authorization grant: the token
+    recorded in the grant, and any found from the register's grant index if
+    it is maintained.
+    """
+    token_ids = set()
+    if grant.token:
+        token_ids.add(grant.token.token_id)
+    try:
+        token_ids.update(access_token_register.get_token_ids(
+                                    TokenIndexRegister.GRANT_INDEX, grant.code))
+    except ValueError:
+        # The grant index is not maintained.
+        pass
+    if token_ids:
+        access_token_register.revoke_tokens(token_ids)
     else:
-        return None
+        # The token may still be being issued by another request.
+        log.warning("No tokens found to revoke for reused grant %s",
+                    grant.code)
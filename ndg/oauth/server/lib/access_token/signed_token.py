@@ -0,0 +1,196 @@
+"""OAuth 2.0 WSGI server middleware - self-contained access tokens signed with
+HMAC-SHA256
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+
+from ndg.oauth.server.lib.oauth.authorize import AuthorizeRequest
+from ndg.oauth.server.lib.register.access_token import AccessToken
+from ndg.oauth.server.lib.register.authorization_grant import \
+                                                        AuthorizationGrant
+
+log = logging.getLogger(__name__)
+
+
+def _constant_time_compare(value1, value2):
+    """Compares two strings in a time that does not depend on where they
+    differ. hmac.compare_digest is only available from Python 2.7.7.
+    """
+    if len(value1) != len(value2):
+        return False
+    result = 0
+    for char1, char2 in zip(value1, value2):
+        result |= ord(char1) ^ ord(char2)
+    return result == 0
+
+compare_digest = getattr(hmac, 'compare_digest', _constant_time_compare)
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class SigningKeys(object):
+    """
+    Keys for signing and validating self-contained access tokens, by key ID.
+
+    A signed token has the form <key ID>.<payload>.<signature>, where the
+    payload is the base64url encoded JSON of the token's ID, client ID, user
+    ID, scope, issue and expiry times, and the signature is the base64url
+    encoded HMAC-SHA256 of the key ID and payload. Tokens can be validated by
+    any process that holds the key, without reading the register.
+
+    New tokens are signed with the first key. The others are accepted when
+    validating, so that keys can be rotated: add the new key first, and remove
+    the old one once the tokens signed with it have expired.
+    """
+    SEPARATOR = '.'
+    USER_IDENTIFIER_GRANT_DATA_KEY = 'user_identifier'
+
+    def __init__(self, keys):
+        """
+        @type keys: list
+        @param keys: (key ID, secret) tuples - the first is used for signing
+        """
+        if not keys:
+            raise ValueError("At least one token signing key is required")
+        self._keys = {}
+        for key_id, secret in keys:
+            if not key_id or self.SEPARATOR in key_id:
+                raise ValueError("Invalid token signing key ID %r" % key_id)
+            if len(secret) < 16:
+                raise ValueError("Token signing key %r must be at least 16 "
+                                 "bytes long" % key_id)
+            # Keyed once so that signing only hashes the token.
+            self._keys[key_id] = hmac.new(secret, digestmod=hashlib.sha256)
+        self.current_key_id = keys[0][0]
+
+    @classmethod
+    def from_string(cls, value):
+        """Creates keys from configuration.
+        @type value: basestring
+        @param value: space separated key ID and base64 encoded secret pairs,
+        each separated by a colon
+        @rtype: SigningKeys
+        @return: signing keys
+        """
+        keys = []
+        for item in value.split():
+            key_id, sep, secret = item.partition(':')
+            if not sep:
+                raise ValueError("Token signing key %r is not of the form "
+                                 "<key ID>:<base64 secret>" % item)
+            try:
+                keys.append((key_id, base64.b64decode(secret)))
+            except (TypeError, binascii.Error):
+                raise ValueError("Token signing key %r is not base64 "
+                                 "encoded" % key_id)
+        return cls(keys)
+
+    def is_signed(self, token_id):
+        """Returns whether a token ID is of the form of a signed token.
+        @type token_id: basestring
+        @param token_id: access token ID as presented by a client
+        @rtype: bool
+        """
+        return token_id.count(self.SEPARATOR) == 2
+
+    def encode(self, token):
+        """Returns the signed form of an access token, to be used as its ID.
+        @type token: ndg.oauth.server.lib.register.access_token.AccessToken
+        @param token: access token - its ID is taken as the unique token ID
+        included in the payload
+        @rtype: str
+        @return: signed token
+        """
+        grant = token.grant
+        payload = {
+            'jti': token.token_id,
+            'cid': grant.client_id,
+            'sub': (grant.additional_data or {}).get(
+                                        self.USER_IDENTIFIER_GRANT_DATA_KEY),
+            'scp': grant.scope_str,
+            'iat': token.issued_at,
+            'exp': token.expires
+        }
+        signed = (self.current_key_id + self.SEPARATOR +
+                  _b64encode(json.dumps(payload, separators=(',', ':'))))
+        return signed + self.SEPARATOR + self._sign(self.current_key_id,
+                                                    signed)
+
+    def decode(self, token_id):
+        """Validates the signature of a signed token and returns its payload.
+        @type token_id: basestring
+        @param token_id: signed token
+        @rtype: dict or NoneType
+        @return: payload or None if the token is not signed with a current key
+        """
+        if isinstance(token_id, unicode):
+            try:
+                token_id = token_id.encode('ascii')
+            except UnicodeEncodeError:
+                return None
+        try:
+            key_id, payload, signature = token_id.split(self.SEPARATOR)
+        except ValueError:
+            return None
+        if key_id not in self._keys:
+            log.debug("Token signed with unknown key %r", key_id)
+            return None
+        signed = token_id[:len(key_id) + len(payload) + 1]
+        if not compare_digest(self._sign(key_id, signed), signature):
+            log.debug("Invalid token signature for key %r", key_id)
+            return None
+        try:
+            payload = json.loads(_b64decode(payload))
+        except (TypeError, ValueError):
+            return None
+        return payload if isinstance(payload, dict) else None
+
+    def make_token(self, token_id, payload):
+        """Returns the access token represented by a signed token, without
+        reading the register.
+        @type token_id: basestring
+        @param token_id: signed token
+        @type payload: dict
+        @param payload: payload of the token, as returned by decode
+        @rtype: ndg.oauth.server.lib.register.access_token.AccessToken or
+        NoneType
+        @return: access token, or None if the payload is incomplete
+        """
+        try:
+            user_id = payload['sub']
+            auth_request = AuthorizeRequest('code', payload['cid'], None,
+                                            payload['scp'], None)
+            grant = AuthorizationGrant(None, auth_request, 0,
+                                       additional_data=(
+                    {self.USER_IDENTIFIER_GRANT_DATA_KEY: user_id}
+                    if user_id is not None else {}))
+            grant.granted = True
+            token = AccessToken(token_id, None, grant, 'bearer',
+                                payload['exp'] - payload['iat'])
+            token.issued_at = payload['iat']
+            token.expires = payload['exp']
+        except (KeyError, TypeError):
+            log.debug("Signed token payload is incomplete: %r", payload)
+            return None
+        return token
+
+    def _sign(self, key_id, data):
+        mac = self._keys[key_id].copy()
+        mac.update(data)
+        return _b64encode(mac.digest())
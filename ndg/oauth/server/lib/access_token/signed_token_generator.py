@@ -0,0 +1,56 @@
+"""OAuth 2.0 WSGI server middleware providing self-contained signed bearer
+tokens as access tokens
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import uuid
+
+from ndg.oauth.server.lib.access_token.access_token_interface import AccessTokenInterface
+from ndg.oauth.server.lib.register.access_token import AccessToken
+
+class SignedTokenGenerator(AccessTokenInterface):
+    """Access token generator that returns bearer tokens carrying their own
+    client ID, user ID, scope and expiry time, signed so that they can be
+    validated without reading the access token register.
+    """
+    def __init__(self, lifetime, token_type, **kw):
+        """
+        @type lifetime: int
+        @param lifetime: lifetimes of generated tokens in seconds
+
+        @type token_type: str
+        @param token_type: token type name
+
+        @type kw:dict
+        @param kw: additional keywords - signing_keys is required and is an
+        ndg.oauth.server.lib.access_token.signed_token.SigningKeys
+        """
+        self.lifetime = lifetime
+        self.token_type = token_type
+        self.signing_keys = kw['signing_keys']
+
+    def get_access_token(self, token_request, grant, request):
+        """
+        Gets an access token whose ID is a signed token holding a random UUID
+        and the details of the grant.
+        @type token_request: ndg.oauth.server.lib.access_token.AccessTokenRequest
+        @param token_request: access token request
+
+        @type grant: ndg.oauth.server.lib.register.authorization_grant.AuthorizationGrant
+        @param grant: authorization grant
+
+        @type request: webob.Request
+        @param request: HTTP request object
+
+        @rtype: ndg.oauth.server.lib.register.access_token.AccessToken
+        @return: access token or None if an error occurs
+        """
+        token = AccessToken(uuid.uuid4().hex, token_request, grant,
+                            self.token_type, self.lifetime)
+        token.token_id = self.signing_keys.encode(token)
+        return token
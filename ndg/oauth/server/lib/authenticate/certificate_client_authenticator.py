@@ -40,7 +40,7 @@ class CertificateAuthenticator(AuthenticatorInterface):
         if not dn:
             raise OauthException('invalid_%s'%self.typ, 'No certificate DN found.')
 
-        for authorization in self._register.register.itervalues():
-            if authorization.authentication_data == dn:
-                return authorization.id
+        authorization = self._register.get_by_authentication_data(dn)
+        if authorization is not None:
+            return authorization.id
         raise OauthException('invalid_%s'%self.typ, ('Certificate DN does not match that for any registered %s: %s' % (self.typ, dn)))
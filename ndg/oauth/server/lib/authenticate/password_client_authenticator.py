@@ -47,7 +47,7 @@ class PasswordAuthenticator(AuthenticatorInterface):
         if not cid or not secret:
             raise OauthException('invalid_%s'%self.typ, 'No %s password authentication supplied'%self.typ)
 
-        for authorization in self._register.register.itervalues():
-            if authorization.id == cid and authorization.secret == secret:
-                return authorization.id
+        authorization = self._register.get_by_secret(cid, secret)
+        if authorization is not None:
+            return authorization.id
         raise OauthException('invalid_%s'%self.typ, ('%s access denied: %s' % (cid, self.typ)))
@@ -13,6 +13,7 @@ __revision__ = "$Id$"
 import json
 import logging
 import httplib
+import time
 import urllib
 
 from ndg.oauth.server.lib.access_token.make_access_token import \
@@ -24,6 +25,7 @@ from ndg.oauth.server.lib.oauth.oauth_exception import OauthException
 from ndg.oauth.server.lib.register.access_token import AccessTokenRegister
 from ndg.oauth.server.lib.register.authorization_grant import \
                                                     AuthorizationGrantRegister
+from ndg.oauth.server.lib.register.token_index import TokenIndexRegister
 
 log = logging.getLogger(__name__)
 
@@ -36,6 +38,15 @@ class AuthorizationServer(object):
     BEARER_TOK_ID = 'Bearer'
     MAC_TOK_ID = 'MAC'
     TOKEN_TYPES = (BEARER_TOK_ID, MAC_TOK_ID)
+    # Content type and maximum number of tokens of a batch token check
+    BATCH_CONTENT_TYPE = 'application/json'
+    MAX_BATCH_SIZE = 1000
+    # Parameters of a revocation request selecting tokens through an index
+    REVOKE_SELECTORS = {
+        'user': TokenIndexRegister.USER_INDEX,
+        'client': TokenIndexRegister.CLIENT_INDEX,
+        'grant': TokenIndexRegister.GRANT_INDEX
+    }
     
     def __init__(self, client_register, authorizer, client_authenticator,
                  resource_register, resource_authenticator,
@@ -46,7 +57,10 @@ class AuthorizationServer(object):
         self.resource_register = resource_register
         self.resource_authenticator = resource_authenticator
         self.access_token_generator = access_token_generator
-        self.access_token_register = AccessTokenRegister(config)
+        self.access_token_register = AccessTokenRegister(
+                config,
+                signing_keys=getattr(access_token_generator, 'signing_keys',
+                                     None))
         self.authorization_grant_register = AuthorizationGrantRegister(config)
 
     def authorize(self, request, client_authorized):
@@ -204,7 +218,7 @@ class AuthorizationServer(object):
         client = self.client_register.register[auth_request.client_id]
         redirect_uri = (
             auth_request.redirect_uri if auth_request.redirect_uri else \
-                client.redirect_uris[0]
+                client.default_redirect_uri
         )
         if not redirect_uri:
             return (
@@ -445,6 +459,16 @@ class AuthorizationServer(object):
         error
               error as described in
               http://tools.ietf.org/html/draft-ietf-oauth-v2-22#section-5.2
+        user_name
+              identifier of the user who granted the token, if it is valid
+        expires_at
+              time at which the token expires, in seconds since the epoch, if
+              it is valid
+
+        A number of tokens can be checked in one request by posting a JSON
+        array of objects with "token" and optional "scope" members, with
+        content type application/json. The response is then a JSON array of
+        responses as above, in the order of the request.
 
         @type request: webob.Request
         @param request: HTTP request object
@@ -452,15 +476,14 @@ class AuthorizationServer(object):
         @type scope: str
         @param scope: required scope
 
-        @rtype: tuple: (str, int, str)
+        @rtype: tuple: (str, int, str, int)
         @return: tuple (
                      OAuth JSON response
                      HTTP status
                      error description
+                     seconds until the token expires if it is valid, or None
                  )
         """
-        params = request.params
-
         # Check that the client is authenticated as a registered client.
         resource_id = self.resource_authenticator.authenticate(request)
         if resource_id is None:
@@ -468,9 +491,15 @@ class AuthorizationServer(object):
         else:
             log.debug("Resource id: %s", resource_id)
 
+        if (request.method == 'POST' and
+            request.content_type == self.BATCH_CONTENT_TYPE):
+            return self._check_tokens(request, scope)
+
+        params = request.params
+
         # Retrieve access token
         if 'access_token' not in params:
-            error = 'invalid_request'
+            token, error = None, 'invalid_request'
         else:
             access_token = params['access_token']
             if scope:
@@ -479,6 +508,64 @@ class AuthorizationServer(object):
                 required_scope = params.get('scope', None)
             token, error = self.access_token_register.get_token(access_token,
                                                                 required_scope)
+        content_dict = self._check_token_result(token, error)
+        content = json.dumps(content_dict)
+        expires_in = int(token.expires - time.time()) if token else None
+        return (content, content_dict['status'], error, expires_in)
+
+    def _check_tokens(self, request, scope=None):
+        """Checks a number of tokens posted as a JSON array, reading the
+        tokens that are not held in memory in a single register read.
+        @type request: webob.Request
+        @param request: HTTP request object
+        @type scope: str
+        @param scope: required scope, overriding the scopes in the request
+        @rtype: tuple: (str, int, str, NoneType)
+        @return: tuple (JSON response, HTTP status, error description, None)
+        """
+        try:
+            items = json.loads(request.body)
+        except ValueError:
+            items = None
+        if not isinstance(items, list) or len(items) > self.MAX_BATCH_SIZE:
+            error_description = ("Request must be a JSON array of at most %d "
+                                 "tokens" % self.MAX_BATCH_SIZE)
+            content_dict = {'status': httplib.BAD_REQUEST,
+                            'error': 'invalid_request',
+                            'error_description': error_description}
+            return (json.dumps(content_dict), httplib.BAD_REQUEST,
+                    error_description, None)
+
+        token_requests = []
+        for item in items:
+            if (isinstance(item, dict) and
+                isinstance(item.get('token'), basestring) and
+                isinstance(item.get('scope'), (basestring, type(None)))):
+                token_requests.append((item['token'],
+                                       scope or item.get('scope')))
+            else:
+                token_requests.append(None)
+
+        results = iter(self.access_token_register.get_tokens(
+                    [token_request for token_request in token_requests
+                     if token_request is not None]))
+        content_list = [
+            self._check_token_result(*(results.next() if token_request
+                                       else (None, 'invalid_request')))
+            for token_request in token_requests]
+        log.debug("Checked %d tokens", len(content_list))
+        return json.dumps(content_list), httplib.OK, None, None
+
+    @staticmethod
+    def _check_token_result(token, error):
+        """Returns the response to a check of one token.
+        @type token: ndg.oauth.server.lib.register.access_token.AccessToken
+        @param token: access token, or None if not valid
+        @type error: str
+        @param error: error, or None if the token is valid
+        @rtype: dict
+        @return: response content
+        """
         # Formulate response
         status = {'invalid_request': httplib.BAD_REQUEST,
                   'invalid_token': httplib.FORBIDDEN,
@@ -490,8 +577,100 @@ class AuthorizationServer(object):
         else:
             # TODO only get additional data when resource is allowed to
             content_dict['user_name'] = token.grant.additional_data.get('user_identifier')
-        content = json.dumps(content_dict)
-        return (content, status, error)
+            content_dict['expires_at'] = int(token.expires)
+        return content_dict
+
+    def revoke_tokens(self, request):
+        """
+        Revokes a number of access tokens in a single register update. It would
+        be called by a trusted resource service or administrative client. This
+        is not part of the OAuth specification.
+
+        Request parameters in post data:
+
+        access_token
+              OPTIONAL.  Space separated list of access tokens to revoke
+        user
+              OPTIONAL.  Revoke all tokens issued for this user
+        client
+              OPTIONAL.  Revoke all tokens issued to this client
+        grant
+              OPTIONAL.  Revoke all tokens issued from this authorization code
+
+        At least one of the parameters must be given; the tokens selected by
+        each are revoked.
+
+        Response:
+              application/json format:
+        status
+              HTTP status
+        revoked
+              number of tokens revoked, excluding any that were already
+              revoked or not registered
+        elapsed
+              time taken in seconds
+        error
+              error if the request failed
+
+        @type request: webob.Request
+        @param request: HTTP request object
+
+        @rtype: tuple: (str, int, str)
+        @return: tuple (
+                     OAuth JSON response
+                     HTTP status
+                     error description
+                 )
+        """
+        start_time = time.time()
+        try:
+            params = request.POST
+            self.check_request(request, params, post_only=True)
+
+            # Only a registered resource may revoke tokens, whether selected
+            # by ID or by user, client or grant.
+            resource_id = self.resource_authenticator.authenticate(request)
+            if resource_id is None:
+                raise OauthException('invalid_client',
+                                     'Resource authentication is required '
+                                     'to revoke tokens')
+            log.debug("Resource id: %s", resource_id)
+
+            token_ids = set(params.get('access_token', '').split())
+            selected = bool(token_ids)
+            for param, index in self.REVOKE_SELECTORS.iteritems():
+                value = params.get(param)
+                if not value:
+                    continue
+                selected = True
+                try:
+                    token_ids.update(self.access_token_register.get_token_ids(
+                                                                index, value))
+                except ValueError, exc:
+                    raise OauthException('invalid_request', str(exc))
+
+            if not selected:
+                raise OauthException('invalid_request',
+                                     'No tokens to revoke specified')
+
+        except OauthException, exc:
+            status = (httplib.BAD_REQUEST
+                      if exc.error == 'invalid_request'
+                      else httplib.UNAUTHORIZED)
+            content_dict = {'status': status,
+                            'error': exc.error,
+                            'error_description': exc.error_description}
+            return json.dumps(content_dict), status, exc.error_description
+
+        revoked = self.access_token_register.revoke_tokens(token_ids)
+        elapsed = time.time() - start_time
+        log.info("Revoked %d of %d tokens in %.3fs", revoked, len(token_ids),
+                 elapsed)
+
+        content_dict = {'status': httplib.OK,
+                        'revoked': revoked,
+                        'elapsed': round(elapsed, 6)}
+        return json.dumps(content_dict), httplib.OK, None
 
     def get_registered_token(self, request, scope=None):
         """
@@ -0,0 +1,121 @@
+"""OAuth 2.0 WSGI server middleware - circuit breaker for calls to a service
+that may fail or become slow
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class CircuitBreaker(object):
+    """
+    Stops calls to a service after a number of consecutive failures, so that
+    callers fail at once rather than wait for it. A call that takes longer
+    than the latency threshold counts as a failure, even if it succeeds.
+
+    The breaker is closed while calls are allowed. It opens when
+    failure_threshold consecutive calls have failed. After reset_timeout
+    seconds it is half open: a single trial call is allowed, which closes the
+    breaker if it succeeds and opens it again if it fails.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, failure_threshold, latency_threshold=None,
+                 reset_timeout=30):
+        """
+        @type name: str
+        @param name: name of the service, for logging
+        @type failure_threshold: int
+        @param failure_threshold: number of consecutive failures at which the
+        breaker opens - 0 disables it
+        @type latency_threshold: float
+        @param latency_threshold: time in seconds above which a call counts
+        as a failure, or None to count only errors
+        @type reset_timeout: float
+        @param reset_timeout: time in seconds for which the breaker stays open
+        before a trial call is allowed
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+        self.slow_calls = 0
+
+    def allow(self):
+        """Returns whether a call may be made. If it returns True, the outcome
+        of the call must be passed to record.
+        @rtype: bool
+        """
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN and
+                self._opened_at + self.reset_timeout <= time.time()):
+                self.state = self.HALF_OPEN
+                self._trial_in_progress = False
+            if self.state == self.HALF_OPEN and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success, elapsed):
+        """Records the outcome of a call.
+        @type success: bool
+        @param success: False if the call raised an error
+        @type elapsed: float
+        @param elapsed: time taken by the call in seconds
+        """
+        if self.failure_threshold <= 0:
+            return
+        if (success and self.latency_threshold is not None and
+            elapsed > self.latency_threshold):
+            success = False
+            self.slow_calls += 1
+        with self._lock:
+            self._trial_in_progress = False
+            if success:
+                if self.state != self.CLOSED:
+                    log.info("Closing circuit breaker for %s", self.name)
+                self.state = self.CLOSED
+                self._failures = 0
+                return
+            self._failures += 1
+            if (self.state == self.HALF_OPEN or
+                (self.state == self.CLOSED and
+                 self._failures >= self.failure_threshold)):
+                log.warning("Opening circuit breaker for %s for %ss after %d "
+                            "failed or slow calls", self.name,
+                            self.reset_timeout, self._failures)
+                self.state = self.OPEN
+                self._opened_at = time.time()
+                self.opened += 1
+
+    def stats(self):
+        """Returns the state of the breaker and counters.
+        @rtype: dict
+        @return: counter names and values
+        """
+        with self._lock:
+            return {'state': self.state,
+                    'consecutive_failures': self._failures,
+                    'opened': self.opened,
+                    'rejected': self.rejected,
+                    'slow_calls': self.slow_calls}
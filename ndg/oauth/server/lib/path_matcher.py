@@ -0,0 +1,198 @@
+"""OAuth 2.0 WSGI server middleware - matching of request paths against a
+table of regular expressions in few passes
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+
+class _Alternation(object):
+    """
+    Matches a path against a list of patterns in as few match calls as
+    possible, by combining the patterns into alternations with each pattern
+    in a group of its own, so that the group that matched identifies the
+    pattern.
+
+    The re module supports only a limited number of groups in an expression,
+    so a long list is split into several alternations. Patterns that cannot be
+    combined without changing their meaning - those with compile flags,
+    inline flags or backreferences - are matched on their own, in their place
+    in the list.
+    """
+    # The re module of Python 2 allows at most 100 groups in an expression.
+    MAX_GROUPS = 99
+
+    def __init__(self, items):
+        """
+        @type items: list
+        @param items: (position, entry) tuples in the order in which they are
+        to be tried, where entry is a (compiled pattern, value) tuple
+        """
+        # (regex, items by group index) tuples; items is None for a pattern
+        # matched on its own, for which the item is held instead
+        self._segments = []
+        chunk = []
+        chunk_groups = 0
+        for item in items:
+            regex = item[1][0]
+            if not PathMatcher.is_combinable(regex):
+                self._add_chunk(chunk)
+                chunk, chunk_groups = [], 0
+                self._segments.append((regex, None, item))
+                continue
+            if chunk_groups + regex.groups + 1 > self.MAX_GROUPS:
+                self._add_chunk(chunk)
+                chunk, chunk_groups = [], 0
+            chunk.append(item)
+            chunk_groups += regex.groups + 1
+        self._add_chunk(chunk)
+
+    def _add_chunk(self, chunk):
+        if not chunk:
+            return
+        if len(chunk) == 1:
+            self._segments.append((chunk[0][1][0], None, chunk[0]))
+            return
+        try:
+            regex = re.compile('|'.join('(%s)' % item[1][0].pattern
+                                        for item in chunk))
+        except re.error:
+            # For example, the same group name used in two patterns.
+            for item in chunk:
+                self._segments.append((item[1][0], None, item))
+            return
+        items = {}
+        group = 1
+        for item in chunk:
+            items[group] = item
+            group += item[1][0].groups + 1
+        self._segments.append((regex, items, None))
+
+    def __len__(self):
+        return len(self._segments)
+
+    def match(self, path):
+        """Returns the (position, entry) tuple of the first pattern that
+        matches, or None.
+        """
+        for regex, items, item in self._segments:
+            match = regex.match(path)
+            if match is not None:
+                if items is None:
+                    return item
+                return items[match.lastindex]
+        return None
+
+
+class PathMatcher(object):
+    """
+    Finds the first of a list of path patterns that matches a path, as
+    trying each pattern's match method in turn would, and returns the value
+    held for it.
+
+    Patterns are indexed by the literal text they start with, so that only
+    those whose literal prefix is at the start of a path are tried, and the
+    patterns with the same prefix are combined into alternations. The cost of
+    a match then depends on the number of distinct prefix lengths and the
+    number of patterns sharing a prefix, rather than on the length of the
+    list.
+    """
+    SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+    QUANTIFIER_CHARS = frozenset('*+?{')
+    UNCOMBINABLE_PAT = re.compile(r'\\[1-9]|\(\?P=|\(\?[iLmsux]+\)')
+
+    def __init__(self, entries):
+        """
+        @type entries: iterable
+        @param entries: (compiled pattern, value) tuples, in the order in
+        which they are to be tried
+        """
+        self.entries = list(entries)
+        items_by_prefix = {}
+        for item in enumerate(self.entries):
+            prefix = self.literal_prefix(item[1][0])
+            items_by_prefix.setdefault(prefix, []).append(item)
+        self._alternations = dict(
+                                (prefix, _Alternation(items))
+                                for prefix, items in items_by_prefix.items())
+        self._prefix_lengths = sorted(set(len(prefix)
+                                          for prefix in self._alternations))
+        log.debug("Indexed %d path patterns by %d literal prefixes",
+                  len(self.entries), len(self._alternations))
+
+    @classmethod
+    def is_combinable(cls, regex):
+        """Returns whether a pattern keeps its meaning when it is combined
+        with others.
+        @type regex: compiled pattern
+        @param regex: pattern
+        @rtype: bool
+        """
+        return (not regex.flags and
+                cls.UNCOMBINABLE_PAT.search(regex.pattern) is None)
+
+    @classmethod
+    def literal_prefix(cls, regex):
+        """Returns the literal text that a pattern requires at the start of
+        the string it matches.
+        @type regex: compiled pattern
+        @param regex: pattern
+        @rtype: basestring
+        @return: literal prefix, which may be empty
+        """
+        pattern = regex.pattern
+        if not cls.is_combinable(regex) or '|' in pattern:
+            return ''
+        if pattern.startswith('^'):
+            pattern = pattern[1:]
+        prefix = []
+        i = 0
+        while i < len(pattern):
+            char = pattern[i]
+            if char == '\\':
+                if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                    # A character class such as \d, or an escape sequence
+                    break
+                char = pattern[i + 1]
+                i += 2
+            elif char in cls.SPECIAL_CHARS:
+                break
+            else:
+                i += 1
+            if i < len(pattern) and pattern[i] in cls.QUANTIFIER_CHARS:
+                # The character may be repeated or left out.
+                break
+            prefix.append(char)
+        return ''.join(prefix)
+
+    def match(self, path):
+        """Finds the first pattern that matches the start of a path.
+        @type path: basestring
+        @param path: path
+        @rtype: tuple or NoneType
+        @return: (compiled pattern, value) tuple of the pattern, or None if
+        no pattern matches
+        """
+        first = None
+        path_len = len(path)
+        for prefix_len in self._prefix_lengths:
+            if prefix_len > path_len:
+                break
+            alternation = self._alternations.get(path[:prefix_len])
+            if alternation is None:
+                continue
+            item = alternation.match(path)
+            if item is not None and (first is None or item[0] < first[0]):
+                first = item
+        return first[1] if first is not None else None
+
+    def __len__(self):
+        return len(self.entries)
@@ -7,39 +7,187 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 
-from datetime import datetime, timedelta
 import logging
+import os
+import threading
+import time
 
+from ndg.oauth.server.lib.register.mmap_token_store import MmapTokenStore
+from ndg.oauth.server.lib.register.near_cache import (GenerationCounter,
+                                                      NearCache)
 from ndg.oauth.server.lib.register.register_base import RegisterBase
+from ndg.oauth.server.lib.register.revoked_tokens import RevokedTokenRegister
+from ndg.oauth.server.lib.register.token_filter import TokenFilter
+from ndg.oauth.server.lib.register.token_index import TokenIndexRegister
 import ndg.oauth.server.lib.register.scopeutil as scopeutil
 
 log = logging.getLogger(__name__)
 
 class AccessToken(object):
     """
-    Access token as stored in the reqister
+    Access token as stored in the reqister. Times are held as integer seconds
+    since the epoch.
     """
+    __slots__ = ('token_id', 'token_type', 'grant', 'scope', 'issued_at',
+                 'lifetime', 'expires', 'valid')
+
     def __init__(self, token_id, request, grant, token_type, lifetime):
         self.token_id = token_id
         self.token_type = token_type
         self.grant = grant
-        self.scope = scopeutil.scopeStringToList(grant.scope_str)
-        self.timestamp = datetime.now()
-        self.lifetime = lifetime
-        self.expires = self.timestamp + timedelta(days=0, seconds=lifetime)
+        self.scope = scopeutil.scopeStringToTuple(grant.scope_str)
+        self.issued_at = int(time.time())
+        self.lifetime = int(lifetime)
+        self.expires = self.issued_at + self.lifetime
         self.valid = True
 
+    def __reduce__(self):
+        # The grant is pickled as state, after the token, so that the grant's
+        # reference back to the token is pickled as a reference. The scope is
+        # derived from the grant when unpickling.
+        return (_restore_access_token,
+                (self.token_id, self.token_type, self.issued_at,
+                 self.lifetime, self.expires, self.valid),
+                self.grant)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Pickled by an earlier version, with times as local datetimes.
+            self.token_id = state['token_id']
+            self.token_type = state['token_type']
+            self.issued_at = int(time.mktime(state['timestamp'].timetuple()))
+            self.lifetime = state['lifetime']
+            self.expires = int(time.mktime(state['expires'].timetuple()))
+            self.valid = state['valid']
+            state = state['grant']
+        self.grant = state
+        self.scope = scopeutil.scopeStringToTuple(state.scope_str)
+
+def _restore_access_token(token_id, token_type, issued_at, lifetime, expires,
+                          valid):
+    """Creates an access token when unpickling - see AccessToken.__reduce__.
+    """
+    token = AccessToken.__new__(AccessToken)
+    token.token_id = token_id
+    token.token_type = token_type
+    token.issued_at = issued_at
+    token.lifetime = lifetime
+    token.expires = expires
+    token.valid = valid
+    return token
+
 class AccessTokenRegister(RegisterBase):
     """
     Access token reqister that holds access tokens as determined by the cache
     options
     """
     CACHE_NAME = 'accesstokenregister'
+    STORAGE_CLASSES = dict(RegisterBase.STORAGE_CLASSES, **{
+        MmapTokenStore.STORAGE_TYPE: MmapTokenStore
+    })
+    NEAR_CACHE_SIZE_OPTION = 'near_cache_size'
+    NEAR_CACHE_TTL_OPTION = 'near_cache_ttl'
+    DEFAULT_NEAR_CACHE_TTL = 60
+    INDEXES_OPTION = 'indexes'
+    # Number of validated signed tokens kept so that their signatures are not
+    # checked again
+    SIGNED_TOKEN_CACHE_SIZE = 4096
+    FILTER_CAPACITY_OPTION = 'filter_capacity'
+    FILTER_ERROR_RATE_OPTION = 'filter_error_rate'
+    FILTER_REBUILD_INTERVAL_OPTION = 'filter_rebuild_interval'
+    DEFAULT_FILTER_ERROR_RATE = 0.001
+    DEFAULT_FILTER_REBUILD_INTERVAL = 3600
+    # Minimum time in seconds between attempts to rebuild the filter
+    FILTER_REBUILD_RETRY_INTERVAL = 60
 
-    def __init__(self, config, prefix='cache'):
+    def __init__(self, config, prefix='cache', signing_keys=None):
+        """
+        @type config: dict
+        @param config: configuration options
+        @type prefix: basestring
+        @param prefix: prefix of the register options
+        @type signing_keys: ndg.oauth.server.lib.access_token.signed_token.SigningKeys
+        @param signing_keys: keys with which signed tokens are validated
+        without reading the register, or None if tokens are not signed
+        """
         cache_opts = self.parse_config(prefix, self.CACHE_NAME, config)
         super(AccessTokenRegister, self).__init__('AccessTokenRegister', cache_opts)
 
+        # Signed tokens are validated from their contents; only the small set
+        # of those revoked is kept apart from the register.
+        self.signing_keys = signing_keys
+        self._signed_tokens = {}
+        if signing_keys is not None:
+            if cache_opts['cache.type'] in self.IN_MEMORY_TYPES:
+                generation = None
+            else:
+                generation = GenerationCounter(os.path.join(
+                                        cache_opts['cache.data_dir'],
+                                        'revoked_tokens.generation'))
+            self.revoked_tokens = RevokedTokenRegister(
+                                        'RevokedAccessTokens',
+                                        self._index_config(cache_opts),
+                                        generation)
+        else:
+            self.revoked_tokens = None
+
+        # Optional in-process cache of valid tokens in front of the register.
+        base = ("%s.%s." % (prefix, self.CACHE_NAME))
+        near_cache_size = int(config.get(base + self.NEAR_CACHE_SIZE_OPTION, 0))
+        if near_cache_size > 0:
+            near_cache_ttl = int(config.get(base + self.NEAR_CACHE_TTL_OPTION,
+                                            self.DEFAULT_NEAR_CACHE_TTL))
+            generation = GenerationCounter(os.path.join(
+                                        cache_opts['cache.data_dir'],
+                                        'near_cache.generation'))
+            self.near_cache = NearCache(near_cache_size, near_cache_ttl,
+                                        generation)
+        else:
+            self.near_cache = None
+
+        # Secondary indexes, kept in a separate register alongside this one.
+        # They are only maintained if configured, as each adds to the cost of
+        # issuing a token.
+        indexes = config.get(base + self.INDEXES_OPTION, '').split()
+        if indexes:
+            index_opts = self._index_config(cache_opts)
+            # Entries expire with their last token, so are swept as the
+            # tokens are.
+            for option in ('sweep.interval', 'sweep.batch_size',
+                           'sweep.batch_pause', 'sweep.full_interval'):
+                index_opts[option] = cache_opts.get(option)
+            self.index = TokenIndexRegister('AccessTokenIndex', index_opts,
+                                            indexes)
+        else:
+            self.index = None
+
+        # Optional Bloom filter of registered token IDs, so that unknown tokens
+        # can be rejected without reading the register.
+        filter_capacity = int(config.get(base + self.FILTER_CAPACITY_OPTION, 0))
+        self.token_filter = None
+        self._filter_rebuilding = False
+        self._filter_rebuild_started = 0
+        if filter_capacity > 0:
+            self.filter_rebuild_interval = float(config.get(
+                                    base + self.FILTER_REBUILD_INTERVAL_OPTION,
+                                    self.DEFAULT_FILTER_REBUILD_INTERVAL))
+            if cache_opts['cache.type'] in self.IN_MEMORY_TYPES:
+                filter_filename = None
+            else:
+                filter_filename = os.path.join(cache_opts['cache.data_dir'],
+                                               'AccessTokenRegister.filter')
+            token_filter = TokenFilter(
+                        filter_capacity,
+                        float(config.get(base + self.FILTER_ERROR_RATE_OPTION,
+                                         self.DEFAULT_FILTER_ERROR_RATE)),
+                        filter_filename)
+            try:
+                token_filter.open(self.keys)
+                self.token_filter = token_filter
+            except NotImplementedError:
+                log.warning("Token filter disabled - %s storage cannot list "
+                            "its entries", cache_opts['cache.type'])
+
     def add_token(self, token):
         """Adds a token to the register.
         @type token: AccessToken
@@ -51,6 +199,11 @@ class AccessTokenRegister(RegisterBase):
             return False
 
         self.set_value(token.token_id, token)
+        self.schedule_removal(token.token_id, token.expires)
+        if self.token_filter:
+            self.token_filter.add(token.token_id)
+        if self.index:
+            self.index.add(token)
         log.debug("Added token of ID: %s", token.token_id)
         return True
 
@@ -61,26 +214,295 @@ class AccessTokenRegister(RegisterBase):
         @type scope: basestring
         @param scope: required scopes as space separated string
         """
-        try:
-            token = self.get_value(token_id)
-        except KeyError:
-            log.debug("Request for token of ID that is not registered: %s",
-                      token_id)
-            return None, 'invalid_token'
+        token, error = self._find_token(token_id)
+        if error:
+            return None, error
+        if token is None:
+            try:
+                token = self._get_and_cache_token(token_id)
+            except KeyError:
+                log.debug("Request for token of ID that is not registered: %s",
+                          token_id)
+                return None, 'invalid_token'
+        return self._check_token(token_id, token, scope)
+
+    def get_tokens(self, token_requests):
+        """Retrieves a number of registered tokens by token ID and required
+        scope. Tokens that must be read from the register are read in a single
+        operation.
+        @type token_requests: list
+        @param token_requests: (token ID, required scope) tuples
+        @rtype: list
+        @return: (token, error) tuples as returned by get_token, in the order
+        of the requests
+        """
+        found = {}
+        token_ids_to_read = []
+        for token_id, _ in token_requests:
+            if token_id in found:
+                continue
+            token, error = found[token_id] = self._find_token(token_id)
+            if token is None and error is None:
+                token_ids_to_read.append(token_id)
 
+        if token_ids_to_read:
+            tokens = self._get_and_cache_tokens(token_ids_to_read)
+            for token_id in token_ids_to_read:
+                token = tokens.get(token_id)
+                if token is None:
+                    log.debug("Request for token of ID that is not "
+                              "registered: %s", token_id)
+                    found[token_id] = None, 'invalid_token'
+                else:
+                    found[token_id] = token, None
+
+        results = []
+        for token_id, scope in token_requests:
+            token, error = found[token_id]
+            if error:
+                results.append((None, error))
+            else:
+                results.append(self._check_token(token_id, token, scope))
+        return results
+
+    def _find_token(self, token_id):
+        """Looks for a token without reading the register: validates a signed
+        token, or looks in the near cache and token filter.
+        @type token_id: basestring
+        @param token_id: token ID
+        @rtype: tuple
+        @return: (token, error) - both None if the register must be read
+        """
+        if self.signing_keys and self.signing_keys.is_signed(token_id):
+            token = self._get_signed_token(token_id)
+            if token is None:
+                return None, 'invalid_token'
+            return token, None
+        if self.near_cache:
+            token = self.near_cache.get(token_id)
+            if token is not None:
+                return token, None
+        if self.token_filter:
+            if self.token_filter.rebuild_due(self.filter_rebuild_interval):
+                self._start_filter_rebuild()
+            if token_id not in self.token_filter:
+                log.debug("Request for token of ID that is not registered: %s",
+                          token_id)
+                return None, 'invalid_token'
+        return None, None
+
+    def _check_token(self, token_id, token, scope):
+        """Checks that a token is valid, unexpired and granted a scope.
+        @rtype: tuple
+        @return: (token, error) as returned by get_token
+        """
         if not token.valid:
             log.debug("Request for invalid token of ID: %s", token_id)
             return None, 'invalid_token'
         
-        if token.expires <= datetime.utcnow():
+        if token.expires <= time.time():
             log.debug("Request for expired token of ID: %s", token_id)
             return None, 'invalid_token'
                     
         # Check scope
         if not scopeutil.isScopeGranted(token.scope,
-                                        scopeutil.scopeStringToList(scope)):
+                                        scopeutil.scopeStringToTuple(scope)):
             log.debug("Request for token of ID: %s - token was not granted "
                       "scope %s", token_id, scope)
             return None, 'insufficient_scope'
         
         return token, None
+
+    def revoke_token(self, token_id):
+        """Marks a registered token as invalid.
+        @type token_id: basestring
+        @param token_id: token ID
+        @rtype: bool
+        @return: True if the token was revoked, False if it is not registered
+        or was already revoked
+        """
+        return self.revoke_tokens([token_id]) == 1
+
+    def revoke_tokens(self, token_ids):
+        """Marks a number of registered tokens as invalid, in a single register
+        update.
+        @type token_ids: iterable
+        @param token_ids: token IDs
+        @rtype: int
+        @return: number of tokens revoked - tokens that are not registered or
+        were already revoked are not counted
+        """
+        revoked = []
+        def revoke(token):
+            if token is not None and token.valid:
+                token.valid = False
+                revoked.append(token)
+            return token
+
+        token_ids = list(token_ids)
+        self.update_values(dict((token_id, revoke) for token_id in token_ids))
+        if revoked:
+            if self.index:
+                self.index.remove(revoked)
+            if self.near_cache:
+                self.near_cache.invalidate()
+
+        revoked_ids = set(token.token_id for token in revoked)
+        if self.signing_keys:
+            revoked_ids.update(self._revoke_signed_tokens(token_ids))
+        log.debug("Revoked %d tokens", len(revoked_ids))
+        return len(revoked_ids)
+
+    def get_token_ids(self, index, value):
+        """Returns the IDs of the unexpired, unrevoked tokens issued to a user
+        or client, or from a grant.
+        @type index: basestring
+        @param index: index name - one of TokenIndexRegister.INDEXES
+        @type value: basestring
+        @param value: user ID, client ID or grant code
+        @rtype: list
+        @return: token IDs
+
+        Raises ValueError if the index is not maintained.
+        """
+        if not self.index:
+            raise ValueError("Token indexes are not enabled")
+        return self.index.get_token_ids(index, value)
+
+    def _start_filter_rebuild(self):
+        """Rebuilds the token filter in a background thread, unless this is
+        already being done.
+        """
+        with self._update_lock:
+            now = time.time()
+            if (self._filter_rebuilding or
+                now - self._filter_rebuild_started <
+                                        self.FILTER_REBUILD_RETRY_INTERVAL):
+                return
+            self._filter_rebuilding = True
+            self._filter_rebuild_started = now
+
+        def rebuild():
+            try:
+                self.token_filter.rebuild(self.keys,
+                                          self.filter_rebuild_interval)
+            except Exception, exc:
+                log.exception("Rebuilding token filter failed: %s", exc)
+            finally:
+                self._filter_rebuilding = False
+
+        thread = threading.Thread(target=rebuild, name='TokenFilterRebuild')
+        thread.daemon = True
+        thread.start()
+
+    def _get_signed_token(self, token_id):
+        """Validates a signed token from its contents and the revoked token
+        set.
+        @type token_id: basestring
+        @param token_id: signed token
+        @rtype: AccessToken or NoneType
+        @return: access token, or None if the token is not validly signed or
+        has been revoked
+        """
+        entry = self._signed_tokens.get(token_id)
+        if entry is None:
+            payload = self.signing_keys.decode(token_id)
+            token = (self.signing_keys.make_token(token_id, payload)
+                     if payload is not None else None)
+            if token is None:
+                log.debug("Request for token that is not validly signed: %s",
+                          token_id)
+                return None
+            entry = (token, payload.get('jti'))
+            # Bounded by discarding all entries, which is cheaper than keeping
+            # them in order of use.
+            if len(self._signed_tokens) >= self.SIGNED_TOKEN_CACHE_SIZE:
+                self._signed_tokens.clear()
+            self._signed_tokens[token_id] = entry
+
+        token, key = entry
+        if key in self.revoked_tokens:
+            log.debug("Request for revoked token: %s", token_id)
+            return None
+        return token
+
+    def _revoke_signed_tokens(self, token_ids):
+        """Adds signed tokens to the revoked token set.
+        @type token_ids: list
+        @param token_ids: token IDs, of which those that are not validly
+        signed are ignored
+        @rtype: list
+        @return: IDs of the tokens that had not already been revoked
+        """
+        token_ids_by_key = {}
+        expiry_times = {}
+        for token_id in token_ids:
+            if not self.signing_keys.is_signed(token_id):
+                continue
+            payload = self.signing_keys.decode(token_id)
+            if payload and payload.get('jti') and payload.get('exp'):
+                token_ids_by_key[payload['jti']] = token_id
+                expiry_times[payload['jti']] = payload['exp']
+        if not expiry_times:
+            return []
+        return [token_ids_by_key[key]
+                for key in self.revoked_tokens.add(expiry_times)]
+
+    def _index_config(self, cache_opts):
+        """Returns the options for the index and revoked token registers,
+        which use the same storage as this register where that can hold
+        arbitrary values.
+        """
+        if cache_opts['cache.type'] == MmapTokenStore.STORAGE_TYPE:
+            # The token table can only hold access tokens.
+            index_opts = {
+                'cache.type': 'file',
+                'cache.data_dir': cache_opts['cache.data_dir'],
+                'cache.lock_dir': cache_opts['cache.lock_dir'],
+                'serializer': cache_opts['serializer']
+                }
+        else:
+            index_opts = dict(cache_opts)
+        # Index entries hold tokens with differing expiry times, so are not
+        # expired after a fixed time.
+        index_opts['cache.expire'] = None
+        index_opts['sweep.interval'] = None
+        return index_opts
+
+    def _get_and_cache_token(self, token_id):
+        """Retrieves a token from the register, adding it to the near cache if
+        it is currently valid.
+        @type token_id: basestring
+        @param token_id: token ID
+        @rtype: AccessToken
+        @return: access token
+
+        Raises KeyError if the token is not registered.
+        """
+        if not self.near_cache:
+            return self.get_value(token_id)
+
+        generation = self.near_cache.snapshot()
+        token = self.get_value(token_id)
+        if token.valid and token.expires > time.time():
+            self.near_cache.put(token_id, token, token.expires, generation)
+        return token
+
+    def _get_and_cache_tokens(self, token_ids):
+        """Retrieves a number of tokens from the register in a single read,
+        adding those that are currently valid to the near cache.
+        @type token_ids: list
+        @param token_ids: token IDs
+        @rtype: dict
+        @return: registered tokens by ID
+        """
+        if not self.near_cache:
+            return self.get_values(token_ids)
+
+        generation = self.near_cache.snapshot()
+        tokens = self.get_values(token_ids)
+        now = time.time()
+        for token_id, token in tokens.iteritems():
+            if token.valid and token.expires > now:
+                self.near_cache.put(token_id, token, token.expires, generation)
+        return tokens
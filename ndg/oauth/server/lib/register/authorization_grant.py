@@ -7,8 +7,9 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 
-from datetime import datetime, timedelta
+import calendar
 import logging
+import time
 
 from ndg.oauth.server.lib.register.register_base import RegisterBase
 
@@ -16,8 +17,12 @@ log = logging.getLogger(__name__)
 
 class AuthorizationGrant(object):
     """
-    Authorization grant as stored in the reqister
+    Authorization grant as stored in the reqister. Times are held as integer
+    seconds since the epoch.
     """
+    __slots__ = ('code', 'client_id', 'redirect_uri', 'scope_str',
+                 'additional_data', 'issued_at', 'expires', 'granted', 'token')
+
     def __init__(self, code, request, lifetime, scope=None, additional_data=None):
         self.code = code
         self.client_id = request.client_id
@@ -25,9 +30,47 @@ class AuthorizationGrant(object):
         # Allow for authorized scope to be different from requested scope.
         self.scope_str = (scope if scope is not None else request.scope)
         self.additional_data = additional_data
-        self.timestamp = datetime.utcnow()
-        self.expires = self.timestamp + timedelta(days=0, seconds=lifetime)
+        self.issued_at = int(time.time())
+        self.expires = self.issued_at + int(lifetime)
         self.granted = False
+        self.token = None
+
+    def __reduce__(self):
+        # The token issued for the grant refers back to the grant, so is
+        # pickled as state, after the grant.
+        return (_restore_authorization_grant,
+                (self.code, self.client_id, self.redirect_uri, self.scope_str,
+                 self.additional_data, self.issued_at, self.expires,
+                 self.granted),
+                self.token)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Pickled by an earlier version, with times as UTC datetimes.
+            for name in ('code', 'client_id', 'redirect_uri', 'scope_str',
+                         'additional_data', 'granted'):
+                setattr(self, name, state[name])
+            self.issued_at = calendar.timegm(state['timestamp'].timetuple())
+            self.expires = calendar.timegm(state['expires'].timetuple())
+            state = state.get('token')
+        self.token = state
+
+def _restore_authorization_grant(code, client_id, redirect_uri, scope_str,
+                                 additional_data, issued_at, expires, granted):
+    """Creates an authorization grant when unpickling - see
+    AuthorizationGrant.__reduce__.
+    """
+    grant = AuthorizationGrant.__new__(AuthorizationGrant)
+    grant.code = code
+    grant.client_id = client_id
+    grant.redirect_uri = redirect_uri
+    grant.scope_str = scope_str
+    grant.additional_data = additional_data
+    grant.issued_at = issued_at
+    grant.expires = expires
+    grant.granted = granted
+    grant.token = None
+    return grant
 
 class AuthorizationGrantRegister(RegisterBase):
     """
@@ -47,4 +90,63 @@ class AuthorizationGrantRegister(RegisterBase):
             return False
 
         self.set_value(grant.code, grant)
+        self.schedule_removal(grant.code, grant.expires)
         return True
+
+    def redeem_grant(self, code, check=None):
+        """Marks a grant as used to issue an access token. The grant is read,
+        checked and marked in a single register update, so that it can be
+        redeemed only once by any of the processes sharing the register.
+        @type code: basestring
+        @param code: authorization code
+        @type check: callable
+        @param check: function called with a grant that has not been redeemed
+        before it is marked, which may raise an exception to leave the grant
+        unchanged
+        @rtype: tuple
+        @return: grant, or None if there is no grant with the code, and
+        whether it was redeemed by this call - False if it had already been
+        redeemed
+        """
+        redeemed = []
+        def redeem(grant):
+            if grant is None or grant.granted:
+                return grant
+            if check is not None:
+                check(grant)
+            grant.granted = True
+            redeemed.append(grant)
+            return grant
+
+        grant = self.update_value(code, redeem)
+        if grant is not None and not redeemed:
+            log.warning("Repeated attempt to redeem grant of code: %s", code)
+        return grant, bool(redeemed)
+
+    def set_grant_token(self, code, token):
+        """Records the access token issued for a redeemed grant, so that it
+        can be revoked if the code is presented again.
+        @type code: basestring
+        @param code: authorization code
+        @type token: ndg.oauth.server.lib.register.access_token.AccessToken
+        @param token: access token issued for the grant
+        """
+        def set_token(grant):
+            if grant is not None:
+                grant.token = token
+            return grant
+
+        self.update_value(code, set_token)
+
+    def release_grant(self, code):
+        """Marks a redeemed grant for which no access token could be issued as
+        not redeemed, so that the client may present the code again.
+        @type code: basestring
+        @param code: authorization code
+        """
+        def release(grant):
+            if grant is not None and grant.token is None:
+                grant.granted = False
+            return grant
+
+        self.update_value(code, release)
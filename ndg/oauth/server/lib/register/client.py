@@ -8,32 +8,43 @@ __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 import logging
 from ConfigParser import SafeConfigParser
+
+from ndg.oauth.server.lib.register.config_register import (ConfigRegister,
+                                                           RegistrationBase)
 log = logging.getLogger(__name__)
 
 
-class ClientRegistration(object):
+class ClientRegistration(RegistrationBase):
     """
-    An entry in the client register.
+    An immutable entry in the client register. The redirect URIs are held as
+    a frozenset, with the first listed as default_redirect_uri.
     """
+    __slots__ = ('name', 'id', 'secret', 'type', 'redirect_uris',
+                 'default_redirect_uri', 'authentication_data')
+
     def __init__(self, name, client_id, client_secret, client_type,
                  redirect_uris, authentication_data):
-        self.name = name
-        self.id = client_id
-        self.secret = client_secret
-        self.type = client_type
         if redirect_uris:
-            self.redirect_uris = [r.strip() for r in redirect_uris.split(',')]
+            redirect_uris = [r.strip() for r in redirect_uris.split(',')]
         else:
-            self.redirect_uris = []
-        self.authentication_data = authentication_data
+            redirect_uris = []
+        self._set(name=name,
+                  id=client_id,
+                  secret=client_secret,
+                  type=client_type,
+                  redirect_uris=frozenset(redirect_uris),
+                  default_redirect_uri=(redirect_uris[0] if redirect_uris
+                                        else None),
+                  authentication_data=authentication_data)
 
 
-class ClientRegister(object):
+class ClientRegister(ConfigRegister):
     """
-    Client reqister read from a configuration file
+    Client reqister read from a configuration file. Use get_shared to obtain
+    the register for a file shared in the process.
     """
-    register = {}
     def __init__(self, config_file):
+        super(ClientRegister, self).__init__()
         config = SafeConfigParser()
         config.read(config_file)
         client_keys = config.get('client_register', 'clients').strip()
@@ -54,7 +65,7 @@ class ClientRegister(object):
             config.get(client_section_name, 'type'),
             config.get(client_section_name, 'redirect_uris'),
             config.get(client_section_name, 'authentication_data'))
-        self.register[client_id] = client_registration
+        self._add(client_registration)
 
     def is_registered_client(self, client_id):
         """Determines if a client ID is in the client register.
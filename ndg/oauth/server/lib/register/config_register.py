@@ -0,0 +1,102 @@
+"""OAuth 2.0 WSGI server middleware - base class for the client and resource
+registers read from configuration files
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class RegistrationBase(object):
+    """
+    Base class for immutable register entries. Subclasses list their
+    attributes in __slots__ and set them with _set in __init__.
+    """
+    __slots__ = ()
+
+    def _set(self, **kw):
+        for name, value in kw.iteritems():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.id)
+
+
+class ConfigRegister(object):
+    """
+    Register of entries read from a configuration file, indexed by id, by
+    certificate DN (authentication_data) and by id and secret.
+
+    get_shared returns one instance per class and configuration file for the
+    process, so that the file is read once for all the middleware using it.
+    Entries are immutable and the register is not changed after it is read.
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        # Entries by id, by authentication data, and by (id, secret)
+        self.register = {}
+        self._by_authentication_data = {}
+        self._by_secret = {}
+
+    @classmethod
+    def get_shared(cls, config_file):
+        """Returns the register for a configuration file, reading the file
+        the first time it is requested in the process.
+        @type config_file: basestring
+        @param config_file: configuration file path
+        @rtype: ConfigRegister
+        @return: register shared by all callers for the file
+        """
+        key = (cls, os.path.abspath(config_file))
+        register = cls._shared.get(key)
+        if register is None:
+            with cls._shared_lock:
+                register = cls._shared.get(key)
+                if register is None:
+                    register = cls(config_file)
+                    cls._shared[key] = register
+                    log.debug("Read %s with %d entries from %s", cls.__name__,
+                              len(register.register), key[1])
+        return register
+
+    def _add(self, registration):
+        self.register[registration.id] = registration
+        # The first entry registered with given authentication data is the
+        # one matched
+        if registration.authentication_data:
+            self._by_authentication_data.setdefault(
+                                        registration.authentication_data,
+                                        registration)
+        if registration.secret:
+            self._by_secret[(registration.id, registration.secret)] = \
+                                                                registration
+
+    def get(self, registration_id):
+        """Returns the entry with an id, or None."""
+        return self.register.get(registration_id)
+
+    def get_by_authentication_data(self, authentication_data):
+        """Returns the entry registered with authentication data, such as a
+        certificate DN, or None.
+        """
+        return self._by_authentication_data.get(authentication_data)
+
+    def get_by_secret(self, registration_id, secret):
+        """Returns the entry with an id and secret, or None."""
+        return self._by_secret.get((registration_id, secret))
@@ -0,0 +1,241 @@
+"""OAuth 2.0 WSGI server middleware - background removal of expired register
+entries
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import atexit
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timer wheel indexing keys by expiry time. Level 0 has a slot
+    per tick; each slot of a higher level covers a whole rotation of the level
+    below, and its keys are moved down when that rotation starts. Adding a key
+    and collecting expired keys cost time proportional to the number of keys
+    involved, independent of the number of keys held.
+    """
+    LEVEL_BITS = (8, 6, 6, 6, 6)
+
+    def __init__(self, tick=1, now=None):
+        """
+        @type tick: float
+        @param tick: resolution in seconds
+        @type now: float
+        @param now: current time in seconds since the epoch
+        """
+        self.tick = tick
+        self.current = self._to_ticks(time.time() if now is None else now)
+        self._levels = [[[] for _ in xrange(1 << bits)]
+                        for bits in self.LEVEL_BITS]
+        self._shifts = []
+        shift = 0
+        for bits in self.LEVEL_BITS:
+            self._shifts.append(shift)
+            shift += bits
+        self._due = []
+        self.size = 0
+
+    def add(self, key, expires):
+        """Adds a key.
+        @type key: basestring
+        @param key: key
+        @type expires: float
+        @param expires: expiry time in seconds since the epoch
+        """
+        self._insert(key, self._to_ticks(expires))
+        self.size += 1
+
+    def advance(self, now):
+        """Advances the wheel to the given time.
+        @type now: float
+        @param now: current time in seconds since the epoch
+        @rtype: list
+        @return: keys that have expired
+        """
+        expired = []
+        target = self._to_ticks(now)
+        while self.current < target:
+            self.current += 1
+            self._cascade(1)
+            slots = self._levels[0]
+            index = self.current & (len(slots) - 1)
+            expired.extend(slots[index])
+            slots[index] = []
+        # Keys added already expired, or found to be due while cascading.
+        expired.extend(self._due)
+        self._due = []
+        self.size -= len(expired)
+        return expired
+
+    def _insert(self, key, due):
+        delta = due - self.current
+        if delta <= 0:
+            self._due.append((key, due))
+            return
+        top = len(self.LEVEL_BITS) - 1
+        for level, bits in enumerate(self.LEVEL_BITS):
+            # Keys beyond the range of the top level are re-inserted each time
+            # their slot comes round until they are in range.
+            if delta < (1 << (self._shifts[level] + bits)) or level == top:
+                slot = (due >> self._shifts[level]) & ((1 << bits) - 1)
+                self._levels[level][slot].append((key, due))
+                return
+
+    def _cascade(self, level):
+        """Moves the keys of the next slot of a level to lower levels at the
+        start of each rotation of the level below.
+        """
+        if level >= len(self.LEVEL_BITS):
+            return
+        shift = self._shifts[level]
+        if self.current & ((1 << shift) - 1):
+            return
+        # Cascade from higher levels first so that their keys are placed
+        # before this level's slot is emptied.
+        self._cascade(level + 1)
+        slots = self._levels[level]
+        index = (self.current >> shift) & (len(slots) - 1)
+        entries = slots[index]
+        slots[index] = []
+        for key, due in entries:
+            self._insert(key, due)
+
+    def _to_ticks(self, t):
+        return int(-(-t // self.tick))
+
+
+class ExpirySweeper(threading.Thread):
+    """
+    Background thread that removes entries from a register once they have
+    expired. Keys are indexed in a timer wheel when they are added, so that
+    entries added by this process are removed without reading the others.
+    Entries added by other processes, or before a restart, are removed by a
+    full sweep of the register every full_interval seconds, the first soon
+    after the sweeper starts. Removals are made in batches with a pause
+    between batches so that the sweeper does not compete with request threads
+    for the storage.
+    """
+    def __init__(self, register, interval, batch_size, batch_pause,
+                 full_interval=3600):
+        """
+        @type register: ndg.oauth.server.lib.register.register_base.RegisterBase
+        @param register: register from which to remove entries
+        @type interval: float
+        @param interval: seconds between sweeps
+        @type batch_size: int
+        @param batch_size: maximum number of entries removed in one operation
+        @type batch_pause: float
+        @param batch_pause: seconds to wait between batches
+        @type full_interval: float
+        @param full_interval: seconds between full sweeps, or 0 for none
+        """
+        super(ExpirySweeper, self).__init__(name='ExpirySweeper')
+        self.daemon = True
+        self.register = register
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.full_interval = full_interval
+        self._full_sweep_at = time.time() + min(interval, full_interval)
+        self.wheel = TimerWheel(tick=min(1, interval))
+        self.reclaimed = 0
+        self.last_reclaimed = 0
+        self.full_sweeps = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        # Stop before module globals are cleared at interpreter exit.
+        atexit.register(self.stop)
+
+    def schedule(self, key, expires):
+        """Schedules an entry for removal.
+        @type key: basestring
+        @param key: register key
+        @type expires: float
+        @param expires: expiry time in seconds since the epoch
+        """
+        with self._lock:
+            self.wheel.add(key, expires)
+
+    def sweep(self, now=None):
+        """Removes entries that have expired.
+        @type now: float
+        @param now: current time in seconds since the epoch
+        @rtype: int
+        @return: number of entries removed
+        """
+        with self._lock:
+            expired = self.wheel.advance(time.time() if now is None else now)
+        keys = [key for key, _ in expired]
+        for start in xrange(0, len(keys), self.batch_size):
+            if start:
+                time.sleep(self.batch_pause)
+            self.register.remove_values(keys[start:start + self.batch_size])
+
+        self.last_reclaimed = len(keys)
+        self.reclaimed += len(keys)
+        if keys:
+            log.info("Removed %d expired entries from %s (%d in total, %d "
+                     "pending)", len(keys), self.register.__class__.__name__,
+                     self.reclaimed, self.wheel.size)
+        return len(keys)
+
+    def sweep_all(self, now=None):
+        """Removes all entries in the register that have expired, including
+        those not scheduled by this process.
+        @type now: float
+        @param now: current time in seconds since the epoch
+        @rtype: int
+        @return: number of entries removed
+        """
+        removed = self.register.remove_expired(now, self.batch_size,
+                                               self.batch_pause)
+        self.reclaimed += removed
+        self.full_sweeps += 1
+        log.info("Full sweep removed %d expired entries from %s", removed,
+                 self.register.__class__.__name__)
+        return removed
+
+    def stats(self):
+        """Returns counters describing the sweeper's progress.
+        @rtype: dict
+        @return: counter names and values
+        """
+        return {'reclaimed': self.reclaimed,
+                'last_reclaimed': self.last_reclaimed,
+                'pending': self.wheel.size,
+                'full_sweeps': self.full_sweeps}
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception, exc:
+                log.exception("Removal of expired entries failed: %s", exc)
+            if not self.full_interval or self._full_sweep_at > time.time():
+                continue
+            self._full_sweep_at = time.time() + self.full_interval
+            try:
+                self.sweep_all()
+            except NotImplementedError:
+                log.warning("Full sweeps disabled - %s storage cannot list "
+                            "its entries", self.register.__class__.__name__)
+                self.full_interval = 0
+            except Exception, exc:
+                log.exception("Full sweep of expired entries failed: %s", exc)
+
+    def stop(self):
+        self._stopped.set()
+        # Wait for a sweep in progress to finish so that the thread does not
+        # outlive the interpreter.
+        if self.is_alive() and self is not threading.current_thread():
+            self.join()
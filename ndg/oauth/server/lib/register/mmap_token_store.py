@@ -0,0 +1,607 @@
+"""OAuth 2.0 WSGI server middleware - access token storage in a memory-mapped
+table shared by all processes on a host
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import binascii
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from ndg.oauth.server.lib.oauth.authorize import AuthorizeRequest
+from ndg.oauth.server.lib.register.authorization_grant import \
+                                                        AuthorizationGrant
+
+log = logging.getLogger(__name__)
+
+
+class TokenTableFullError(Exception):
+    """Raised when a token cannot be added because the table is full."""
+
+
+class MmapTokenStore(object):
+    """
+    Access token storage in a fixed-size open addressing hash table held in a
+    memory-mapped file. All processes that map the same file share the table.
+    Lookups read the mapping directly, without system calls or unpickling.
+    Writers are serialised by a file lock.
+
+    Only tokens with IDs of 32 hexadecimal characters, such as those issued by
+    BearerTokenGenerator, can be stored. Of the grant's additional data only
+    the user identifier is kept.
+
+    Each slot holds a sequence number that a writer makes odd while it
+    changes the slot, so that readers can detect and retry a torn read.
+
+    Removed tokens leave deleted slots behind, which lookups must probe past.
+    Expired tokens met while probing for an insert are removed, and the
+    numbers of used and deleted slots are kept in the header. Once together
+    they reach REBUILD_LOAD of the slots, the table is rebuilt without deleted
+    slots or expired tokens: the new table is written to a new file, which is
+    renamed over the old one, and the old one is marked as superseded so that
+    other processes map the new file. Tokens are not added once MAX_LOAD of
+    the slots are used, so that probes stay short; TokenTableFullError is
+    raised instead. remove_expired marks expired tokens as deleted in place,
+    and rebuilds the table only if that brings it to the rebuild limit.
+
+    A process forked from the one that opened the table opens it again
+    before taking the file lock, as the lock belongs to the open file and so
+    would not exclude the other processes sharing it.
+    """
+    STORAGE_TYPE = 'mmap'
+    DEFAULT_SLOTS = 65536
+    MIN_SLOTS = 16
+    MAX_READ_ATTEMPTS = 1000
+    USER_IDENTIFIER_GRANT_DATA_KEY = 'user_identifier'
+    REBUILD_LOAD = 0.75
+    MAX_LOAD = 0.7
+    # Minimum time in seconds between rebuilds of a table that is full
+    FULL_REBUILD_INTERVAL = 1
+
+    MAGIC = 'NDGOATOK'
+    VERSION = 2
+    # magic, version, record size, number of slots, superseded flag, number
+    # of used slots, number of deleted slots
+    HEADER_FORMAT = '<8sIIQB7xQQ'
+    HEADER_SIZE = 64
+    SUPERSEDED_OFFSET = 24
+    COUNTS_OFFSET = 32
+    COUNTS_FORMAT = '<QQ'
+    # sequence, state, valid, token ID, grant code, issue time, expiry time,
+    # lifetime, token type, client ID, user ID, scope
+    RECORD_FORMAT = '<IBB16s32sqqi16s64s128s256s'
+    RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+    SLOT_HEAD_FORMAT = '<IBB16s'
+    STATE_OFFSET = 4
+    EXPIRES_OFFSET = struct.calcsize('<IBB16s32sq')
+
+    EMPTY, USED, DELETED = range(3)
+
+    def __init__(self, name, config, serializer=None):
+        """
+        @type name: basestring
+        @param name: register name, used as the table file name
+        @type config: dict
+        @param config: cache options as returned by RegisterBase.parse_config
+        @type serializer: ndg.oauth.server.lib.register.serializer.CompactSerializer
+        @param serializer: ignored - tokens are held in the table's own format
+        """
+        # Imported here as the access token module refers to this class.
+        from ndg.oauth.server.lib.register.access_token import AccessToken
+        self._token_class = AccessToken
+
+        data_dir = config['cache.data_dir']
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+        self.filename = os.path.join(data_dir, name + '.mmap')
+        slots = int(config.get('cache.slots') or self.DEFAULT_SLOTS)
+        if slots < self.MIN_SLOTS:
+            raise ValueError("Token table must have at least %d slots" %
+                             self.MIN_SLOTS)
+
+        # The writer's file descriptor and mapping are only used with the
+        # thread lock held; readers use _map, which is replaced when the table
+        # is rebuilt.
+        self._thread_lock = threading.Lock()
+        self._map_lock = threading.Lock()
+        self._fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0600)
+        self._pid = os.getpid()
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            self.slots = self._init_file(slots)
+        finally:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._write_map = mmap.mmap(self._fd, self.size)
+        self._map = self._write_map
+        self.rebuild_limit = int(self.slots * self.REBUILD_LOAD)
+        self.max_used = int(self.slots * self.MAX_LOAD)
+        self._full_rebuild_at = 0
+        self.rebuilds = 0
+
+    @property
+    def size(self):
+        """Size of the table file in bytes"""
+        return self.HEADER_SIZE + self.slots * self.RECORD_SIZE
+
+    def _init_file(self, slots):
+        """Writes the header of a new table file, or reads that of an existing
+        one.
+        @rtype: int
+        @return: number of slots in the table
+        """
+        header_size = struct.calcsize(self.HEADER_FORMAT)
+        header = os.read(self._fd, header_size)
+        if len(header) == header_size:
+            file_slots = self._check_header(header)
+            if file_slots != slots:
+                log.warning("Using existing token table %s with %d slots "
+                            "instead of the configured %d", self.filename,
+                            file_slots, slots)
+            return file_slots
+
+        os.ftruncate(self._fd, self.HEADER_SIZE + slots * self.RECORD_SIZE)
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, struct.pack(self.HEADER_FORMAT, self.MAGIC,
+                                       self.VERSION, self.RECORD_SIZE, slots,
+                                       0, 0, 0))
+        log.debug("Created token table %s with %d slots", self.filename,
+                  slots)
+        return slots
+
+    def _check_header(self, header):
+        magic, version, record_size, file_slots = struct.unpack_from(
+                                            self.HEADER_FORMAT, header)[:4]
+        if (magic != self.MAGIC or version != self.VERSION or
+            record_size != self.RECORD_SIZE):
+            raise ValueError("%s is not a version %d token table" %
+                             (self.filename, self.VERSION))
+        return file_slots
+
+    def put(self, key, value):
+        self._lock()
+        try:
+            self._put(key, value)
+        finally:
+            self._unlock()
+
+    def get(self, key):
+        return self._get(key, self._get_map())
+
+    def _get(self, key, table_map):
+        bin_id = self._binary_id(key)
+        offset = self._find(bin_id, table_map) if bin_id else None
+        if offset is None:
+            raise KeyError(key)
+        fields = self._read(offset, table_map)
+        if fields is None or fields[3] != bin_id:
+            # Removed or replaced since the slot was found.
+            raise KeyError(key)
+        return self._unpack(key, fields)
+
+    def get_values(self, keys):
+        table_map = self._get_map()
+        results = {}
+        for key in keys:
+            try:
+                results[key] = self._get(key, table_map)
+            except KeyError:
+                pass
+        return results
+
+    def has_key(self, key):
+        bin_id = self._binary_id(key)
+        return (bin_id is not None and
+                self._find(bin_id, self._get_map()) is not None)
+
+    def keys(self):
+        table_map = self._get_map()
+        keys = []
+        for index in xrange(self.slots):
+            offset = self.HEADER_SIZE + index * self.RECORD_SIZE
+            state, slot_id = struct.unpack_from(self.SLOT_HEAD_FORMAT,
+                                                table_map, offset)[1:4:2]
+            if state == self.USED:
+                keys.append(binascii.hexlify(slot_id))
+        return keys
+
+    def remove_value(self, key):
+        self.remove_values([key])
+
+    def remove_values(self, keys):
+        self._lock()
+        try:
+            for key in keys:
+                self._remove(key)
+        finally:
+            self._unlock()
+
+    def update_values(self, updates):
+        results = {}
+        self._lock()
+        try:
+            for key, update in updates.iteritems():
+                try:
+                    value = self._get(key, self._write_map)
+                except KeyError:
+                    value = None
+                value = update(value)
+                if value is not None:
+                    self._put(key, value)
+                    results[key] = value
+                else:
+                    self._remove(key)
+        finally:
+            self._unlock()
+        return results
+
+    def remove_expired(self, now=None):
+        """Removes all tokens that have expired, marking their slots as
+        deleted, and rebuilds the table if the deleted slots bring it to the
+        rebuild limit.
+        @type now: int
+        @param now: current time in seconds since the epoch
+        @rtype: int
+        @return: number of tokens removed
+        """
+        if now is None:
+            now = int(time.time())
+        self._lock()
+        try:
+            table_map = self._write_map
+            removed = 0
+            for index in xrange(self.slots):
+                offset = self.HEADER_SIZE + index * self.RECORD_SIZE
+                if ord(table_map[offset + self.STATE_OFFSET]) != self.USED:
+                    continue
+                expires = struct.unpack_from('<q', table_map,
+                                             offset + self.EXPIRES_OFFSET)[0]
+                if expires <= now:
+                    self._set_state(table_map, offset, self.DELETED)
+                    removed += 1
+            used, deleted = self._get_counts()
+            if removed:
+                used, deleted = used - removed, deleted + removed
+                self._set_counts(used, deleted)
+            if used + deleted >= self.rebuild_limit:
+                self._rebuild(now)
+            return removed
+        finally:
+            self._unlock()
+
+    def stats(self):
+        """Returns counters that can be used to size the table.
+        @rtype: dict
+        @return: counter names and values
+        """
+        used, deleted = struct.unpack_from(self.COUNTS_FORMAT, self._get_map(),
+                                           self.COUNTS_OFFSET)
+        return {'slots': self.slots,
+                'used': used,
+                'deleted': deleted,
+                'max_used': self.max_used,
+                'rebuilds': self.rebuilds}
+
+    def _put(self, key, value):
+        bin_id = self._binary_id(key)
+        if bin_id is None:
+            raise ValueError("Token ID %r is not 32 hexadecimal characters "
+                             "as required for mmap storage" % key)
+        record = self._pack(bin_id, value)
+        rebuilt = False
+        while True:
+            used, deleted = self._get_counts()
+            if used + deleted >= self.rebuild_limit and not rebuilt:
+                self._rebuild()
+                rebuilt = True
+                continue
+            offset = self._find(bin_id, self._write_map, for_insert=True)
+            if offset is not None:
+                state = ord(self._write_map[offset + self.STATE_OFFSET])
+                if state == self.USED:
+                    break
+                # Expired tokens may have been removed while probing.
+                used, deleted = self._get_counts()
+                if used < self.max_used:
+                    break
+            if rebuilt or self._full_rebuild_at > time.time():
+                raise TokenTableFullError("Token table %s is full" %
+                                          self.filename)
+            # Make room by dropping expired tokens, but not for every token
+            # added while the table stays full.
+            self._full_rebuild_at = time.time() + self.FULL_REBUILD_INTERVAL
+            self._rebuild()
+            rebuilt = True
+
+        self._write(offset, record)
+        if state == self.EMPTY:
+            self._set_counts(used + 1, deleted)
+        elif state == self.DELETED:
+            self._set_counts(used + 1, deleted - 1)
+
+    def _remove(self, key):
+        bin_id = self._binary_id(key)
+        offset = self._find(bin_id, self._write_map) if bin_id else None
+        if offset is not None:
+            self._set_state(self._write_map, offset, self.DELETED)
+            used, deleted = self._get_counts()
+            self._set_counts(used - 1, deleted + 1)
+
+    def _rebuild(self, now=None):
+        """Writes a new table holding the unexpired tokens of the current one,
+        and replaces the current one with it. Must be called with the lock
+        held.
+        @rtype: int
+        @return: number of expired tokens dropped
+        """
+        if now is None:
+            now = int(time.time())
+        old_map = self._write_map
+        new_filename = "%s.%d" % (self.filename, os.getpid())
+        fd = os.open(new_filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0600)
+        try:
+            # Locked before it is visible to other processes, so that they
+            # wait for this one to finish writing.
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            os.ftruncate(fd, self.size)
+            new_map = mmap.mmap(fd, self.size)
+            struct.pack_into(self.HEADER_FORMAT, new_map, 0, self.MAGIC,
+                             self.VERSION, self.RECORD_SIZE, self.slots, 0,
+                             0, 0)
+            used = dropped = 0
+            for index in xrange(self.slots):
+                offset = self.HEADER_SIZE + index * self.RECORD_SIZE
+                if ord(old_map[offset + self.STATE_OFFSET]) != self.USED:
+                    continue
+                if struct.unpack_from('<q', old_map,
+                                      offset + self.EXPIRES_OFFSET)[0] <= now:
+                    dropped += 1
+                    continue
+                bin_id = old_map[offset + 6:offset + 22]
+                new_offset = self._find(bin_id, new_map, for_insert=True)
+                new_map[new_offset + 4:new_offset + self.RECORD_SIZE] = \
+                                old_map[offset + 4:offset + self.RECORD_SIZE]
+                used += 1
+            struct.pack_into(self.COUNTS_FORMAT, new_map, self.COUNTS_OFFSET,
+                             used, 0)
+            os.rename(new_filename, self.filename)
+        except:
+            os.close(fd)
+            if os.path.exists(new_filename):
+                os.unlink(new_filename)
+            raise
+
+        old_map[self.SUPERSEDED_OFFSET] = '\1'
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = fd
+        self._write_map = new_map
+        self._map = new_map
+        self.rebuilds += 1
+        log.info("Rebuilt token table %s with %d tokens, dropping %d expired",
+                 self.filename, used, dropped)
+        return dropped
+
+    @staticmethod
+    def _binary_id(key):
+        """Converts a token ID to the 16 byte form held in the table.
+        @rtype: str or NoneType
+        @return: binary ID or None if the ID cannot be held in the table, in
+        which case it is never present
+        """
+        if len(key) != 32:
+            return None
+        try:
+            return binascii.unhexlify(key)
+        except TypeError:
+            return None
+
+    def _find(self, bin_id, table_map, for_insert=False):
+        """Finds the slot holding a token ID by linear probing from the slot
+        given by the ID's hash.
+        @type bin_id: str
+        @param bin_id: binary token ID
+        @type table_map: mmap.mmap
+        @param table_map: mapping of the table
+        @type for_insert: bool
+        @param for_insert: if True and the ID is not present, return the first
+        slot in which it can be stored, removing expired tokens found on the
+        way - the lock must then be held
+        @rtype: int or NoneType
+        @return: byte offset of slot or None if not found
+        """
+        index = struct.unpack_from('<Q', bin_id)[0] % self.slots
+        first_free = None
+        now = None
+        for _ in xrange(self.slots):
+            offset = self.HEADER_SIZE + index * self.RECORD_SIZE
+            state, slot_id = struct.unpack_from(self.SLOT_HEAD_FORMAT,
+                                                table_map, offset)[1:4:2]
+            if state == self.EMPTY:
+                return (first_free or offset) if for_insert else None
+            if state == self.USED:
+                if slot_id == bin_id:
+                    return offset
+                if for_insert:
+                    if now is None:
+                        now = int(time.time())
+                    if struct.unpack_from('<q', table_map,
+                                    offset + self.EXPIRES_OFFSET)[0] <= now:
+                        self._set_state(table_map, offset, self.DELETED)
+                        used, deleted = struct.unpack_from(
+                                                self.COUNTS_FORMAT, table_map,
+                                                self.COUNTS_OFFSET)
+                        struct.pack_into(self.COUNTS_FORMAT, table_map,
+                                         self.COUNTS_OFFSET, used - 1,
+                                         deleted + 1)
+                        if first_free is None:
+                            first_free = offset
+            elif state == self.DELETED and first_free is None:
+                first_free = offset
+            index = (index + 1) % self.slots
+        return first_free if for_insert else None
+
+    def _read(self, offset, table_map):
+        """Reads a slot consistently with respect to concurrent writers.
+        @rtype: tuple or NoneType
+        @return: record fields or None if the slot is not in use
+        """
+        for _ in xrange(self.MAX_READ_ATTEMPTS):
+            fields = struct.unpack_from(self.RECORD_FORMAT, table_map, offset)
+            sequence = fields[0]
+            if (sequence % 2 == 0 and
+                struct.unpack_from('<I', table_map, offset)[0] == sequence):
+                return fields if fields[1] == self.USED else None
+            time.sleep(0)
+
+        # A writer has stopped part way through updating the slot.
+        log.error("Token table %s slot at offset %d is being written - "
+                  "treating as not in use", self.filename, offset)
+        return None
+
+    def _write(self, offset, record):
+        table_map = self._write_map
+        sequence = struct.unpack_from('<I', table_map, offset)[0]
+        struct.pack_into('<I', table_map, offset, sequence + 1)
+        table_map[offset + 4:offset + self.RECORD_SIZE] = record
+        struct.pack_into('<I', table_map, offset, sequence + 2)
+
+    @staticmethod
+    def _set_state(table_map, offset, state):
+        sequence = struct.unpack_from('<I', table_map, offset)[0]
+        struct.pack_into('<I', table_map, offset, sequence + 1)
+        struct.pack_into('<B', table_map, offset + 4, state)
+        struct.pack_into('<I', table_map, offset, sequence + 2)
+
+    def _get_counts(self):
+        return struct.unpack_from(self.COUNTS_FORMAT, self._write_map,
+                                  self.COUNTS_OFFSET)
+
+    def _set_counts(self, used, deleted):
+        struct.pack_into(self.COUNTS_FORMAT, self._write_map,
+                         self.COUNTS_OFFSET, used, deleted)
+
+    def _get_map(self):
+        """Returns the mapping of the current table for reading, mapping the
+        new file if the table has been rebuilt by another process.
+        """
+        table_map = self._map
+        if table_map[self.SUPERSEDED_OFFSET] == '\0':
+            return table_map
+        with self._map_lock:
+            if self._map[self.SUPERSEDED_OFFSET] != '\0':
+                fd, self._map = self._open_table()
+                os.close(fd)
+            return self._map
+
+    def _open_table(self):
+        """Opens and maps the current table file.
+        @rtype: tuple
+        @return: file descriptor and mapping
+        """
+        fd = os.open(self.filename, os.O_RDWR)
+        try:
+            table_map = mmap.mmap(fd, self.size)
+            self._check_header(table_map[:self.HEADER_SIZE])
+        except:
+            os.close(fd)
+            raise
+        return fd, table_map
+
+    def _pack(self, bin_id, token):
+        grant = token.grant
+        user_id = (grant.additional_data or {}).get(
+                                        self.USER_IDENTIFIER_GRANT_DATA_KEY)
+        record = struct.pack(self.RECORD_FORMAT, 0, self.USED,
+                             1 if token.valid else 0,
+                             bin_id,
+                             self._encode(grant.code, 32, 'grant code'),
+                             token.issued_at,
+                             token.expires,
+                             token.lifetime,
+                             self._encode(token.token_type, 16, 'token type'),
+                             self._encode(grant.client_id, 64, 'client ID'),
+                             self._encode(user_id, 128, 'user ID'),
+                             self._encode(grant.scope_str, 256, 'scope'))
+        # Omit the sequence number, which is maintained by _write.
+        return record[4:]
+
+    def _unpack(self, token_id, fields):
+        (_, _, valid, _, code, issued_at, expires, lifetime, token_type,
+         client_id, user_id, scope) = fields
+        user_id = self._decode(user_id)
+        additional_data = ({self.USER_IDENTIFIER_GRANT_DATA_KEY: user_id}
+                           if user_id is not None else {})
+        auth_request = AuthorizeRequest('code', self._decode(client_id), None,
+                                        self._decode(scope), None)
+        grant = AuthorizationGrant(self._decode(code), auth_request, 0,
+                                   additional_data=additional_data)
+        grant.granted = True
+        token = self._token_class(token_id, None, grant,
+                                  self._decode(token_type), lifetime)
+        token.issued_at = issued_at
+        token.expires = expires
+        token.valid = bool(valid)
+        return token
+
+    @staticmethod
+    def _encode(value, size, description):
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        if len(value) > size or '\0' in value:
+            raise ValueError("%s %r cannot be stored in a %d byte field" %
+                             (description, value, size))
+        return value
+
+    @staticmethod
+    def _decode(value):
+        value = value.rstrip('\0')
+        return value.decode('utf-8') if value else None
+
+    def _lock(self):
+        """Takes the thread lock and the lock of the current table file."""
+        self._thread_lock.acquire()
+        try:
+            while True:
+                if (self._write_map[self.SUPERSEDED_OFFSET] != '\0' or
+                    self._pid != os.getpid()):
+                    # Rebuilt by another process, or forked since the table
+                    # was opened
+                    fd, table_map = self._open_table()
+                    os.close(self._fd)
+                    self._fd, self._write_map = fd, table_map
+                    self._map = table_map
+                    self._pid = os.getpid()
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX)
+                if self._write_map[self.SUPERSEDED_OFFSET] == '\0':
+                    return
+                # Superseded while waiting for the lock.
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+        except:
+            self._thread_lock.release()
+            raise
+
+    def _unlock(self):
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
@@ -0,0 +1,218 @@
+"""OAuth 2.0 WSGI server middleware - bounded in-process cache of register
+entries with invalidation shared between worker processes
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+from collections import OrderedDict
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows - increments are then not serialised, which
+    # can only merge concurrent increments, not lose a change of value.
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+
+class GenerationCounter(object):
+    """
+    Counter held in a small memory-mapped file so that all processes on a host
+    that map the same file see its current value without a system call.
+    Writers increment the counter after changing an entry in the shared
+    storage; readers discard anything they cached under an older value.
+
+    A process forked from the one that opened the file reopens it before
+    taking the file lock, as the lock belongs to the open file and so would
+    not exclude the other processes sharing it.
+    """
+    COUNTER_FORMAT = '<Q'
+    COUNTER_SIZE = struct.calcsize(COUNTER_FORMAT)
+
+    def __init__(self, filename):
+        """
+        @type filename: basestring
+        @param filename: path of the file holding the counter - created if it
+        does not exist
+        """
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # Created concurrently by another process.
+                if not os.path.isdir(dirname):
+                    raise
+        self.filename = filename
+        self._fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0600)
+        self._pid = os.getpid()
+        self._lock()
+        try:
+            if os.fstat(self._fd).st_size < self.COUNTER_SIZE:
+                os.write(self._fd, '\0' * self.COUNTER_SIZE)
+        finally:
+            self._unlock()
+        self._map = mmap.mmap(self._fd, self.COUNTER_SIZE)
+
+    @property
+    def value(self):
+        return struct.unpack_from(self.COUNTER_FORMAT, self._map)[0]
+
+    def increment(self):
+        """Increments the counter.
+        @rtype: int
+        @return: new value
+        """
+        self._lock()
+        try:
+            value = self.value + 1
+            struct.pack_into(self.COUNTER_FORMAT, self._map, 0, value)
+        finally:
+            self._unlock()
+        return value
+
+    def _lock(self):
+        if self._pid != os.getpid():
+            # Forked since the file was opened; the mapping is still shared.
+            fd = os.open(self.filename, os.O_RDWR)
+            os.close(self._fd)
+            self._fd = fd
+            self._pid = os.getpid()
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class NearCache(object):
+    """
+    Bounded least recently used cache of values read from a register.
+    Each entry lives until the earlier of the cache TTL and the expiry time
+    given when it is stored. The whole cache is discarded whenever the shared
+    generation counter, if any, changes.
+    """
+    def __init__(self, max_size, ttl, generation):
+        """
+        @type max_size: int
+        @param max_size: maximum number of entries held
+        @type ttl: int
+        @param ttl: maximum time in seconds for which an entry is held
+        @type generation: GenerationCounter
+        @param generation: counter shared with the other processes using the
+        same register, or None if entries are only dropped on expiry
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._generation = generation
+        self._seen_generation = self.snapshot()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def snapshot(self):
+        """Returns the current generation. This must be read before the value
+        to be cached is read from the register, and be passed to put.
+        @rtype: int
+        @return: generation counter value
+        """
+        if self._generation is None:
+            return None
+        return self._generation.value
+
+    def get(self, key):
+        """Retrieves a cached value.
+        @type key: basestring
+        @param key: key
+        @return: value or None if there is no current entry for the key
+        """
+        with self._lock:
+            self._sync()
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires <= time.time():
+                self.misses += 1
+                return None
+            # Re-insert as most recently used.
+            self._entries[key] = entry
+            self.hits += 1
+            return value
+
+    def put(self, key, value, expires, generation):
+        """Caches a value.
+        @type key: basestring
+        @param key: key
+        @param value: value
+        @type expires: float
+        @param expires: time in seconds since the epoch after which the entry
+        must not be used
+        @type generation: int
+        @param generation: generation returned by snapshot before the value
+        was read
+        """
+        with self._lock:
+            self._sync()
+            if generation != self._seen_generation:
+                # The register has changed since the value was read.
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (value, min(expires, time.time() + self.ttl))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        """Discards cached entries in this and all other processes sharing the
+        generation counter. Call after changing the register.
+        """
+        if self._generation is None:
+            with self._lock:
+                self._entries.clear()
+                self.invalidations += 1
+            return
+        self._generation.increment()
+        with self._lock:
+            self._sync()
+
+    def stats(self):
+        """Returns counters that can be used to size the cache.
+        @rtype: dict
+        @return: counter names and values
+        """
+        with self._lock:
+            return {'size': len(self._entries),
+                    'max_size': self.max_size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
+
+    def _sync(self):
+        if self._generation is None:
+            return
+        generation = self._generation.value
+        if generation != self._seen_generation:
+            log.debug("Register generation changed from %d to %d - clearing "
+                      "%d cached entries", self._seen_generation, generation,
+                      len(self._entries))
+            self._entries.clear()
+            self._seen_generation = generation
+            self.invalidations += 1
@@ -7,33 +7,314 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 
+import threading
+import time
+
 from beaker.cache import CacheManager
 from beaker.util import parse_cache_config_options
 
+from ndg.oauth.server.lib.register.expiry_sweeper import ExpirySweeper
+from ndg.oauth.server.lib.register.serializer import get_serializer
+from ndg.oauth.server.lib.register.sqlite_store import SqliteStore
+
 class RegisterBase(object):
     """
-    Base class for persistent registers. Entries are stored in a Beaker cache.
+    Base class for persistent registers. Entries are stored in a Beaker cache,
+    or in one of the storage types in STORAGE_CLASSES. Values are serialised
+    with the configured serializer before they are passed to the storage.
     """
+    STORAGE_CLASSES = {
+        SqliteStore.STORAGE_TYPE: SqliteStore
+    }
+    DEFAULT_SWEEP_BATCH_SIZE = 500
+    DEFAULT_SWEEP_BATCH_PAUSE = 0.05
+    DEFAULT_SWEEP_FULL_INTERVAL = 3600
+    # Pickle protocol 2 decodes quickest (see benchmarks/register_records.py)
+    DEFAULT_SERIALIZER = 'pickle'
+    # Storage types that hold values in memory, which need not be serialised
+    IN_MEMORY_TYPES = ('memory',)
+
     def __init__(self, name, config):
-        cacheMgr = CacheManager(**parse_cache_config_options(config))
-        self.cache = cacheMgr.get_cache(name)
+        serializer_name = config.get('serializer')
+        if not serializer_name:
+            serializer_name = ('none'
+                               if config['cache.type'] in self.IN_MEMORY_TYPES
+                               else self.DEFAULT_SERIALIZER)
+        self.serializer = get_serializer(serializer_name)
+
+        storage_class = self.STORAGE_CLASSES.get(config['cache.type'])
+        if storage_class is not None:
+            self.cache = storage_class(name, config, self.serializer)
+        else:
+            cacheMgr = CacheManager(**parse_cache_config_options(config))
+            self.cache = cacheMgr.get_cache(name)
+        self._beaker_storage = storage_class is None
+        self._update_lock = threading.Lock()
+
+        # Optional removal of expired entries in the background.
+        sweep_interval = float(config.get('sweep.interval') or 0)
+        if sweep_interval > 0:
+            self.sweeper = ExpirySweeper(
+                self, sweep_interval,
+                int(config.get('sweep.batch_size') or
+                    self.DEFAULT_SWEEP_BATCH_SIZE),
+                float(config.get('sweep.batch_pause') or
+                      self.DEFAULT_SWEEP_BATCH_PAUSE),
+                float(config.get('sweep.full_interval') or
+                      self.DEFAULT_SWEEP_FULL_INTERVAL))
+            self.sweeper.start()
+        else:
+            self.sweeper = None
 
     def set_value(self, key, value):
+        if self._beaker_storage:
+            value = self._dumps(value)
         self.cache.put(key, value)
 
     def get_value(self, key):
-        return self.cache.get(key)
+        value = self.cache.get(key)
+        if self._beaker_storage:
+            value = self._loads(value)
+        return value
+
+    def get_values(self, keys):
+        """Retrieves a number of entries in a single storage operation where
+        the storage supports it.
+        @type keys: iterable
+        @param keys: keys
+        @rtype: dict
+        @return: values of the entries that are present, by key
+        """
+        if not self._beaker_storage:
+            return self.cache.get_values(keys)
+
+        # Read under one namespace lock, as update_values does, rather than
+        # opening the namespace for each key.
+        namespace = self.cache.namespace
+        results = {}
+        namespace.acquire_read_lock()
+        try:
+            now = time.time()
+            for key in keys:
+                try:
+                    stored, expire, value = namespace[
+                                                self._namespace_key(key)]
+                except KeyError:
+                    continue
+                if expire is None or now < stored + expire:
+                    results[key] = self._loads(value)
+        finally:
+            namespace.release_read_lock()
+        return results
 
     def has_key(self, key):
         return self.cache.has_key(key)
 
+    def keys(self):
+        """Returns the keys of the entries in the register, which may include
+        entries that have expired but not yet been removed.
+        @rtype: list
+        @return: keys
+
+        Raises NotImplementedError if the storage cannot list its entries.
+        """
+        if not self._beaker_storage:
+            return self.cache.keys()
+
+        namespace = self.cache.namespace
+        namespace.acquire_read_lock()
+        try:
+            return list(namespace.keys())
+        finally:
+            namespace.release_read_lock()
+
+    def update_value(self, key, update):
+        """Replaces an entry with a value computed from its current value.
+        Updates made with this method or update_values, in this or another
+        process sharing the storage, are applied one at a time.
+        @type key: basestring
+        @param key: key
+        @type update: callable
+        @param update: function taking the current value, or None if there is
+        no entry, and returning the new value, or None to remove the entry
+        @return: new value
+        """
+        return self.update_values({key: update}).get(key)
+
+    def update_values(self, updates):
+        """Replaces a number of entries with values computed from their current
+        values, in a single storage operation where the storage supports it.
+        @type updates: dict
+        @param updates: update functions, as for update_value, by key
+        @rtype: dict
+        @return: new values of the entries that are present after the update,
+        by key
+        """
+        if not self._beaker_storage:
+            return self.cache.update_values(updates)
+
+        # Beaker's namespace lock serialises updates between processes but,
+        # for some namespace types, not between threads.
+        namespace = self.cache.namespace
+        results = {}
+        with self._update_lock:
+            namespace.acquire_write_lock()
+            try:
+                now = time.time()
+                for key, update in updates.iteritems():
+                    namespace_key = self._namespace_key(key)
+                    try:
+                        stored, expire, value = namespace[namespace_key]
+                        if expire is not None and now >= stored + expire:
+                            value = None
+                        else:
+                            value = self._loads(value)
+                    except KeyError:
+                        value = None
+                    value = update(value)
+                    if value is not None:
+                        namespace[namespace_key] = (now,
+                                                    self.cache.expiretime,
+                                                    self._dumps(value))
+                        results[key] = value
+                    elif namespace_key in namespace:
+                        del namespace[namespace_key]
+            finally:
+                namespace.release_write_lock()
+        return results
+
+    def remove_value(self, key):
+        self.cache.remove_value(key)
+
+    def remove_values(self, keys):
+        """Removes a number of entries, in a single storage operation where the
+        storage supports it.
+        @type keys: iterable
+        @param keys: keys of entries to remove - keys not present are ignored
+        """
+        if not self._beaker_storage:
+            self.cache.remove_values(keys)
+            return
+
+        # Hold the namespace open for all the removals so that a file-based
+        # namespace is only read and written once.
+        namespace = self.cache.namespace
+        namespace.acquire_write_lock()
+        try:
+            for key in keys:
+                try:
+                    del namespace[self._namespace_key(key)]
+                except KeyError:
+                    pass
+        finally:
+            namespace.release_write_lock()
+
+    def remove_expired(self, now=None, batch_size=DEFAULT_SWEEP_BATCH_SIZE,
+                       batch_pause=0):
+        """Removes all entries that have expired, by the storage's expiry
+        time or the expires attribute of their values, whichever process
+        added them.
+        @type now: float
+        @param now: current time in seconds since the epoch
+        @type batch_size: int
+        @param batch_size: maximum number of entries checked in one storage
+        operation
+        @type batch_pause: float
+        @param batch_pause: seconds to wait between batches
+        @rtype: int
+        @return: number of entries removed
+
+        Raises NotImplementedError if the storage cannot list its entries.
+        """
+        if now is None:
+            now = time.time()
+        if not self._beaker_storage:
+            return self.cache.remove_expired(int(now))
+
+        keys = self.keys()
+        removed = 0
+        for start in xrange(0, len(keys), batch_size):
+            if start and batch_pause:
+                time.sleep(batch_pause)
+            removed += self._remove_expired_keys(
+                                    keys[start:start + batch_size], now)
+        return removed
+
+    def _remove_expired_keys(self, namespace_keys, now):
+        namespace = self.cache.namespace
+        removed = 0
+        with self._update_lock:
+            namespace.acquire_write_lock()
+            try:
+                for namespace_key in namespace_keys:
+                    try:
+                        stored, expire, value = namespace[namespace_key]
+                    except KeyError:
+                        continue
+                    if expire is None or now < stored + expire:
+                        expires = getattr(self._loads(value), 'expires', None)
+                        if expires is None or now < expires:
+                            continue
+                    del namespace[namespace_key]
+                    removed += 1
+            finally:
+                namespace.release_write_lock()
+        return removed
+
+    def _dumps(self, value):
+        if self.serializer is None:
+            return value
+        return self.serializer.dumps(value)
+
+    def _loads(self, value):
+        if self.serializer is None or not isinstance(value, str):
+            # Not serialised, or stored by an earlier version as an object.
+            return value
+        return self.serializer.loads(value)
+
+    @staticmethod
+    def _namespace_key(key):
+        """Returns the key under which Beaker holds an entry in its namespace.
+        """
+        if isinstance(key, unicode):
+            # As encoded by beaker.cache.Cache.
+            key = key.encode('ascii', 'backslashreplace')
+        return key
+
+    def schedule_removal(self, key, expires):
+        """Schedules an entry for removal by the sweeper once it expires, if
+        sweeping is enabled.
+        @type key: basestring
+        @param key: key
+        @type expires: int
+        @param expires: expiry time in seconds since the epoch
+        """
+        if self.sweeper:
+            self.sweeper.schedule(key, expires)
+
     def parse_config(self, prefix, name, config):
         base = ("%s.%s." % (prefix, name))
         cache_opts = {
             'cache.expire': config.get(base + 'expire', None),
             'cache.type': config.get(base + 'type', 'file'),
-            'cache.data_dir': config.get(base + 'data_dir', 
+            'cache.data_dir': config.get(base + 'data_dir',
                                          '/tmp/ndgoauth/cache/' + name),
             'cache.lock_dir': config.get(base + 'lock_dir', None)
             }
+        if cache_opts['cache.type'] in self.STORAGE_CLASSES:
+            # Options that only apply to storage types not provided by Beaker.
+            cache_opts['cache.pool_size'] = config.get(base + 'pool_size', None)
+            cache_opts['cache.timeout'] = config.get(base + 'timeout', None)
+            cache_opts['cache.slots'] = config.get(base + 'slots', None)
+            cache_opts['cache.cleanup_interval'] = config.get(
+                                            base + 'cleanup_interval', None)
+        # Keys outside the cache. prefix are ignored by Beaker.
+        cache_opts['serializer'] = config.get(base + 'serializer', None)
+        cache_opts['sweep.interval'] = config.get(base + 'sweep_interval', None)
+        cache_opts['sweep.batch_size'] = config.get(base + 'sweep_batch_size',
+                                                    None)
+        cache_opts['sweep.batch_pause'] = config.get(
+                                            base + 'sweep_batch_pause', None)
+        cache_opts['sweep.full_interval'] = config.get(
+                                        base + 'sweep_full_interval', None)
         return cache_opts
@@ -8,27 +8,33 @@ __contact__ = "wvengen@nikhef.nl"
 __revision__ = "$Id$"
 import logging
 from ConfigParser import SafeConfigParser
+
+from ndg.oauth.server.lib.register.config_register import (ConfigRegister,
+                                                           RegistrationBase)
 log = logging.getLogger(__name__)
 
 
-class ResourceRegistration(object):
+class ResourceRegistration(RegistrationBase):
     """
-    An entry in the resource register.
+    An immutable entry in the resource register.
     """
+    __slots__ = ('name', 'id', 'secret', 'authentication_data')
+
     def __init__(self, name, resource_id,
                  resource_secret, authentication_data):
-        self.name = name
-        self.id = resource_id
-        self.secret = resource_secret
-        self.authentication_data = authentication_data
+        self._set(name=name,
+                  id=resource_id,
+                  secret=resource_secret,
+                  authentication_data=authentication_data)
 
 
-class ResourceRegister(object):
+class ResourceRegister(ConfigRegister):
     """
-    Resource reqister read from a configuration file
+    Resource reqister read from a configuration file. Use get_shared to
+    obtain the register for a file shared in the process.
     """
-    register = {}
     def __init__(self, config_file):
+        super(ResourceRegister, self).__init__()
         config = SafeConfigParser()
         config.read(config_file)
         resource_keys = config.get('resource_register', 'resources').strip()
@@ -50,7 +56,7 @@ class ResourceRegister(object):
             resource_id,
             resource_secret,
             resource_authentication_data)
-        self.register[resource_id] = resource_registration
+        self._add(resource_registration)
 
     def is_registered_resource(self, resource_id):
         """Determines if a resource ID is in the resource register.
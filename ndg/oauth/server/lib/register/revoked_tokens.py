@@ -0,0 +1,91 @@
+"""OAuth 2.0 WSGI server middleware - register of revoked self-contained
+access tokens
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import logging
+import threading
+import time
+
+from ndg.oauth.server.lib.register.register_base import RegisterBase
+
+log = logging.getLogger(__name__)
+
+
+class RevokedTokenRegister(RegisterBase):
+    """
+    Register of the unique IDs of revoked signed access tokens, which are
+    otherwise validated without reading the access token register. The set is
+    held in a single entry mapping token IDs to their expiry times; tokens are
+    dropped from it once expired, so it stays small.
+
+    Where the register is shared, each process keeps a copy of the set, which
+    is read again only when the shared generation counter shows that it has
+    been changed.
+    """
+    KEY = 'revoked'
+
+    def __init__(self, name, config, generation=None):
+        """
+        @type name: basestring
+        @param name: register name
+        @type config: dict
+        @param config: cache options as returned by RegisterBase.parse_config
+        @type generation: ndg.oauth.server.lib.register.near_cache.GenerationCounter
+        @param generation: counter shared with the other processes using the
+        register, or None if the register is not shared
+        """
+        super(RevokedTokenRegister, self).__init__(name, config)
+        self._generation = generation
+        self._seen_generation = None
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    def add(self, tokens):
+        """Adds tokens to the set.
+        @type tokens: dict
+        @param tokens: expiry times by unique token ID
+        @rtype: list
+        @return: IDs of the tokens that were not already in the set
+        """
+        now = time.time()
+        added = []
+        def add_to_entry(entry):
+            entry = dict((token_id, expires)
+                         for token_id, expires in (entry or {}).iteritems()
+                         if expires > now)
+            for token_id, expires in tokens.iteritems():
+                if expires > now and token_id not in entry:
+                    entry[token_id] = expires
+                    added.append(token_id)
+            return entry or None
+
+        self.update_value(self.KEY, add_to_entry)
+        if added and self._generation is not None:
+            self._generation.increment()
+        log.debug("Added %d tokens to the revoked token set", len(added))
+        return added
+
+    def __contains__(self, token_id):
+        if self._generation is None:
+            # Held in the memory of this process, so read directly.
+            try:
+                return token_id in self.get_value(self.KEY)
+            except KeyError:
+                return False
+
+        generation = self._generation.value
+        if generation != self._seen_generation:
+            with self._lock:
+                try:
+                    revoked = self.get_value(self.KEY)
+                except KeyError:
+                    revoked = {}
+                self._revoked = revoked
+                self._seen_generation = generation
+        return token_id in self._revoked
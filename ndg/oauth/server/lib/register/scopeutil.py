@@ -28,9 +28,32 @@ def scopeStringToList(scope_str):
     log.debug("Converted scope string %s to %r", scope_str, result)
     return result
 
+# Scope tuples by scope string, so that tokens with the same scope share a
+# single tuple.
+_scope_tuples = {}
+MAX_SCOPE_TUPLES = 1024
+
+def scopeStringToTuple(scope_str):
+    """Converts a scope string to a tuple of scopes as scopeStringToList does,
+    returning the same tuple, of interned strings where possible, for each
+    occurrence of a scope string.
+    @type scope_str: basestring
+    @param scope_str: space separated list of scopes
+    @rtype: tuple of basestring
+    @return: tuple of scopes
+    """
+    scope = _scope_tuples.get(scope_str)
+    if scope is None:
+        scope = tuple((intern(s) if isinstance(s, str) else s)
+                      for s in scopeStringToList(scope_str))
+        if len(_scope_tuples) >= MAX_SCOPE_TUPLES:
+            _scope_tuples.clear()
+        _scope_tuples[scope_str] = scope
+    return scope
+
 def isScopeGranted(granted_scope, requested_scope):
     """Determines whether all scopes requested have been granted.
-    @type granted_scope: list of basestring
+    @type granted_scope: list or tuple of basestring
     @param granted_scope: list of granted scopes
     @type requested_scope: list of basestring
     @param requested_scope: list of requested scopes
@@ -0,0 +1,310 @@
+"""OAuth 2.0 WSGI server middleware - serialisation of register values
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import cPickle
+import logging
+import struct
+
+import ndg.oauth.server.lib.register.scopeutil as scopeutil
+
+log = logging.getLogger(__name__)
+
+
+class PickleSerializer(object):
+    """
+    Serialises values with the highest pickle protocol.
+    """
+    def dumps(self, value):
+        """Serialises a value.
+        @param value: value
+        @rtype: str
+        @return: serialised value
+        """
+        return cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        """Deserialises a value.
+        @type data: str
+        @param data: serialised value
+        @return: value
+        """
+        return cPickle.loads(data)
+
+
+class _Unencodable(Exception):
+    """Raised when a value cannot be represented in the compact encoding."""
+
+
+class CompactSerializer(object):
+    """
+    Serialises access tokens, authorization grants and token index entries in
+    a versioned binary encoding, which is smaller than a pickle and does not
+    allow arbitrary objects to be created when decoding. Decoding is done in
+    Python, and takes about twice as long as unpickling with protocol 2 (see
+    benchmarks/register_records.py), so this is not the default.
+
+    A token or grant record holds the fields of a grant, of the token issued
+    from it if any, and the grant's additional data, which must be a
+    dictionary of strings. Fixed size fields are followed by a table of
+    string types and lengths, and then the string contents.
+
+    Other values, and records that do not fit this form, are pickled if
+    pickle_fallback is set and otherwise cannot be serialised. Data that is
+    not in the compact encoding, such as values stored by an earlier version,
+    is likewise unpickled only if pickle_fallback is set.
+    """
+    MAGIC = '\xd7'
+    VERSION = 1
+    TOKEN, GRANT, INDEX_ENTRY = 'T', 'G', 'I'
+
+    # magic, record type, version
+    HEADER = struct.Struct('<ccB')
+    # token issue time, lifetime, expiry time and validity, grant issue time,
+    # expiry time and granted flag, whether the grant refers to the token,
+    # number of additional data items
+    RECORD = struct.Struct('<qiqBqqBBH')
+    # number of index entry items
+    COUNT = struct.Struct('<I')
+    NO_ADDITIONAL_DATA = 0xffff
+
+    # String types
+    NONE, BYTES, TEXT = range(3)
+    MAX_STRING_LENGTH = 0xffff
+
+    def __init__(self, pickle_fallback=True):
+        """
+        @type pickle_fallback: bool
+        @param pickle_fallback: if True, pickle values that cannot be held in
+        the compact encoding
+        """
+        # Imported here as the record modules refer to this module through
+        # the register base class.
+        from ndg.oauth.server.lib.register.access_token import AccessToken
+        from ndg.oauth.server.lib.register.authorization_grant import \
+                                                            AuthorizationGrant
+        from ndg.oauth.server.lib.register.token_index import IndexEntry
+        self._token_class = AccessToken
+        self._grant_class = AuthorizationGrant
+        self._index_entry_class = IndexEntry
+        self.pickle_fallback = pickle_fallback
+        self._string_tables = {}
+
+    def dumps(self, value):
+        try:
+            if isinstance(value, self._token_class):
+                if value.grant.token not in (None, value):
+                    raise _Unencodable("grant refers to a different token")
+                return self._encode_record(self.TOKEN, value, value.grant)
+            elif isinstance(value, self._grant_class):
+                if value.token is not None and value.token.grant is not value:
+                    raise _Unencodable("token refers to a different grant")
+                return self._encode_record(self.GRANT, value.token, value)
+            elif isinstance(value, dict):
+                return self._encode_index_entry(value)
+            else:
+                raise _Unencodable("values of type %s are not supported" %
+                                   type(value).__name__)
+        except _Unencodable, exc:
+            if not self.pickle_fallback:
+                raise ValueError("Value cannot be serialised without pickle: "
+                                 "%s" % exc)
+            log.debug("Pickling register value: %s", exc)
+            return cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        if not data.startswith(self.MAGIC):
+            if not self.pickle_fallback:
+                raise ValueError("Register value is not in the compact "
+                                 "encoding")
+            return cPickle.loads(data)
+
+        try:
+            _, record_type, version = self.HEADER.unpack_from(data)
+            if version > self.VERSION:
+                raise ValueError("Register value encoding version %d is not "
+                                 "supported" % version)
+            if record_type in (self.TOKEN, self.GRANT):
+                return self._decode_record(record_type, data)
+            elif record_type == self.INDEX_ENTRY:
+                return self._decode_index_entry(data)
+            else:
+                raise ValueError("Unknown register value type %r" %
+                                 record_type)
+        except struct.error:
+            raise ValueError("Register value is truncated")
+
+    def _encode_record(self, record_type, token, grant):
+        strings = [grant.code, grant.client_id, grant.redirect_uri,
+                   grant.scope_str]
+        if token is not None:
+            strings += [token.token_id, token.token_type]
+            token_fields = (token.issued_at, token.lifetime, token.expires,
+                            1 if token.valid else 0)
+        else:
+            token_fields = (0, 0, 0, 0)
+
+        additional_data = grant.additional_data
+        if additional_data is None:
+            additional_count = self.NO_ADDITIONAL_DATA
+        elif (isinstance(additional_data, dict) and
+              len(additional_data) < self.NO_ADDITIONAL_DATA):
+            additional_count = len(additional_data)
+            for item in additional_data.iteritems():
+                strings.extend(item)
+        else:
+            raise _Unencodable("additional grant data is not a dictionary")
+
+        linked = token is not None and grant.token is token
+        return ''.join([
+            self.HEADER.pack(self.MAGIC, record_type, self.VERSION),
+            self.RECORD.pack(*(token_fields + (
+                                grant.issued_at, grant.expires,
+                                1 if grant.granted else 0,
+                                1 if linked else 0, additional_count))),
+            self._encode_strings(strings)])
+
+    def _decode_record(self, record_type, data):
+        (token_issued_at, token_lifetime, token_expires, token_valid,
+         grant_issued_at, grant_expires, granted, linked,
+         additional_count) = self.RECORD.unpack_from(data, self.HEADER.size)
+        has_token = record_type == self.TOKEN or linked
+        string_count = 4
+        if has_token:
+            string_count += 2
+        if additional_count != self.NO_ADDITIONAL_DATA:
+            string_count += 2 * additional_count
+        strings = self._decode_strings(data,
+                                       self.HEADER.size + self.RECORD.size,
+                                       string_count)
+
+        grant = self._grant_class.__new__(self._grant_class)
+        (grant.code, grant.client_id, grant.redirect_uri,
+         grant.scope_str) = strings[:4]
+        grant.issued_at = grant_issued_at
+        grant.expires = grant_expires
+        grant.granted = bool(granted)
+        if additional_count == self.NO_ADDITIONAL_DATA:
+            grant.additional_data = None
+        else:
+            start = len(strings) - 2 * additional_count
+            grant.additional_data = dict(zip(strings[start::2],
+                                             strings[start + 1::2]))
+        grant.token = None
+        if not has_token:
+            return grant
+
+        token = self._token_class.__new__(self._token_class)
+        token.token_id, token.token_type = strings[4:6]
+        token.issued_at = token_issued_at
+        token.lifetime = token_lifetime
+        token.expires = token_expires
+        token.valid = bool(token_valid)
+        token.grant = grant
+        token.scope = scopeutil.scopeStringToTuple(grant.scope_str)
+        if linked:
+            grant.token = token
+        return token if record_type == self.TOKEN else grant
+
+    def _encode_index_entry(self, entry):
+        token_ids = entry.keys()
+        expiry_times = entry.values()
+        for expires in expiry_times:
+            if not isinstance(expires, (int, long)):
+                raise _Unencodable("index entry values must be integers")
+        return ''.join([
+            self.HEADER.pack(self.MAGIC, self.INDEX_ENTRY, self.VERSION),
+            self.COUNT.pack(len(entry)),
+            struct.pack('<%dq' % len(entry), *expiry_times),
+            self._encode_strings(token_ids)])
+
+    def _decode_index_entry(self, data):
+        offset = self.HEADER.size
+        count = self.COUNT.unpack_from(data, offset)[0]
+        offset += self.COUNT.size
+        expiry_times = struct.unpack_from('<%dq' % count, data, offset)
+        offset += 8 * count
+        return self._index_entry_class(
+                        zip(self._decode_strings(data, offset, count),
+                            expiry_times))
+
+    def _string_table(self, count):
+        """Returns the structure holding the types and lengths of a number of
+        strings.
+        """
+        table = self._string_tables.get(count)
+        if table is None:
+            table = struct.Struct('<%dB%dH' % (count, count))
+            if count < 64:
+                self._string_tables[count] = table
+        return table
+
+    def _encode_strings(self, strings):
+        string_types = []
+        contents = []
+        for value in strings:
+            if value is None:
+                string_types.append(self.NONE)
+                value = ''
+            elif isinstance(value, unicode):
+                string_types.append(self.TEXT)
+                value = value.encode('utf-8')
+            elif isinstance(value, str):
+                string_types.append(self.BYTES)
+            else:
+                raise _Unencodable("%s is not a string" % type(value).__name__)
+            if len(value) > self.MAX_STRING_LENGTH:
+                raise _Unencodable("string of %d bytes is too long" %
+                                   len(value))
+            contents.append(value)
+        header = self._string_table(len(contents)).pack(
+                                *(string_types + [len(s) for s in contents]))
+        return header + ''.join(contents)
+
+    def _decode_strings(self, data, offset, count):
+        table = self._string_table(count)
+        fields = table.unpack_from(data, offset)
+        offset += table.size
+        strings = []
+        for string_type, length in zip(fields[:count], fields[count:]):
+            if string_type == self.NONE:
+                strings.append(None)
+                continue
+            value = data[offset:offset + length]
+            offset += length
+            if string_type == self.TEXT:
+                value = value.decode('utf-8')
+            strings.append(value)
+        if offset > len(data):
+            raise ValueError("Register value is truncated")
+        return strings
+
+
+SERIALIZERS = {
+    # Compact encoding of register records, other values pickled
+    'compact': lambda: CompactSerializer(pickle_fallback=True),
+    # Compact encoding only - values are never pickled or unpickled
+    'strict': lambda: CompactSerializer(pickle_fallback=False),
+    'pickle': PickleSerializer,
+    # Values passed to the storage as they are
+    'none': lambda: None
+}
+
+def get_serializer(name):
+    """Returns a serialiser by name.
+    @type name: basestring
+    @param name: serialiser name - one of the keys of SERIALIZERS
+    @rtype: CompactSerializer, PickleSerializer or NoneType
+    @return: serialiser, or None if values are not to be serialised
+    """
+    try:
+        factory = SERIALIZERS[name]
+    except KeyError:
+        raise ValueError("Unknown register serializer %r - must be one of %s" %
+                         (name, ', '.join(sorted(SERIALIZERS))))
+    return factory()
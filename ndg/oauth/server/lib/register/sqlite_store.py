@@ -0,0 +1,303 @@
+"""OAuth 2.0 WSGI server middleware - SQLite storage for registers
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+from contextlib import contextmanager
+import logging
+import os
+import Queue
+import sqlite3
+import threading
+import time
+
+from ndg.oauth.server.lib.register.serializer import PickleSerializer
+
+log = logging.getLogger(__name__)
+
+
+class SqliteConnectionPool(object):
+    """
+    Bounded pool of connections to one SQLite database. Connections are
+    created on demand up to the pool size; callers then wait for one to be
+    returned.
+    """
+    def __init__(self, filename, size, timeout):
+        """
+        @type filename: basestring
+        @param filename: database file
+        @type size: int
+        @param size: maximum number of connections
+        @type timeout: float
+        @param timeout: seconds to wait for a connection or a database lock
+        """
+        self.filename = filename
+        self.size = size
+        self.timeout = timeout
+        self._idle = Queue.LifoQueue(size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """Context manager providing a connection for the exclusive use of
+        the caller.
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except Queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if not create:
+            try:
+                return self._idle.get(timeout=self.timeout)
+            except Queue.Empty:
+                raise sqlite3.OperationalError(
+                            "Timed out waiting for a connection to %s" %
+                            self.filename)
+
+        try:
+            return self._connect()
+        except:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _connect(self):
+        conn = sqlite3.connect(self.filename, timeout=self.timeout,
+                               isolation_level=None, check_same_thread=False)
+        # Keys may be UTF-8 encoded byte strings.
+        conn.text_factory = str
+        # Write-ahead logging lets readers proceed while a write is in
+        # progress.
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+
+# Pools are shared by all stores in a process using the same database file.
+# The process ID is part of the key so that connections are not shared with
+# a child process after a fork.
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_connection_pool(filename, size, timeout):
+    """Returns the connection pool for a database file in this process.
+    @type filename: basestring
+    @param filename: database file
+    @type size: int
+    @param size: maximum number of connections if a pool is created
+    @type timeout: float
+    @param timeout: seconds to wait for a connection if a pool is created
+    @rtype: SqliteConnectionPool
+    @return: connection pool
+    """
+    key = (os.getpid(), os.path.abspath(filename))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = SqliteConnectionPool(filename, size, timeout)
+        return pool
+
+
+class SqliteStore(object):
+    """
+    Register storage in a SQLite database, one database file per register.
+    Provides the subset of the Beaker cache interface used by RegisterBase.
+    The expiry time of each value is held in an indexed column so that expired
+    entries can be removed with a single statement. Expired entries are not
+    returned, and are removed by the first write after each cleanup interval.
+    """
+    STORAGE_TYPE = 'sqlite'
+    DEFAULT_POOL_SIZE = 4
+    DEFAULT_TIMEOUT = 10
+    DEFAULT_CLEANUP_INTERVAL = 600
+    NOT_EXPIRED = '(expires IS NULL OR expires > ?)'
+    # Keys per query, within SQLite's default limit of 999 parameters
+    MAX_QUERY_KEYS = 500
+
+    def __init__(self, name, config, serializer=None):
+        """
+        @type name: basestring
+        @param name: register name, used as the database file name
+        @type config: dict
+        @param config: cache options as returned by RegisterBase.parse_config
+        @type serializer: ndg.oauth.server.lib.register.serializer.CompactSerializer
+        @param serializer: serialiser for values - pickle is used if None
+        """
+        self.serializer = serializer or PickleSerializer()
+        data_dir = config['cache.data_dir']
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+        self.filename = os.path.join(data_dir, name + '.sqlite')
+        expire = config.get('cache.expire')
+        self.expire = int(expire) if expire else None
+        self.pool = get_connection_pool(
+            self.filename,
+            int(config.get('cache.pool_size') or self.DEFAULT_POOL_SIZE),
+            float(config.get('cache.timeout') or self.DEFAULT_TIMEOUT))
+        cleanup_interval = config.get('cache.cleanup_interval')
+        self.cleanup_interval = float(cleanup_interval
+                                      if cleanup_interval is not None
+                                      else self.DEFAULT_CLEANUP_INTERVAL)
+        self._cleanup_at = time.time() + self.cleanup_interval
+
+        with self.pool.connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS register ('
+                         'key TEXT PRIMARY KEY, '
+                         'value BLOB NOT NULL, '
+                         'expires INTEGER)')
+            conn.execute('CREATE INDEX IF NOT EXISTS register_expires '
+                         'ON register (expires)')
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """Context manager providing a connection with a transaction open,
+        which is committed on exit or rolled back if an exception is raised.
+        @type immediate: bool
+        @param immediate: if True, take the database write lock at the start
+        of the transaction rather than at the first write
+        """
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+            try:
+                yield conn
+            except:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def put(self, key, value):
+        with self.pool.connection() as conn:
+            self._put(conn, key, value)
+        self._cleanup()
+
+    def get(self, key):
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT value FROM register WHERE key = ? AND '
+                               + self.NOT_EXPIRED,
+                               (key, int(time.time()))).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self.serializer.loads(str(row[0]))
+
+    def get_values(self, keys):
+        keys = list(keys)
+        results = {}
+        now = int(time.time())
+        with self.pool.connection() as conn:
+            for start in xrange(0, len(keys), self.MAX_QUERY_KEYS):
+                batch = keys[start:start + self.MAX_QUERY_KEYS]
+                rows = conn.execute(
+                        'SELECT key, value FROM register WHERE key IN (%s) '
+                        'AND %s' % (', '.join('?' * len(batch)),
+                                    self.NOT_EXPIRED),
+                        batch + [now]).fetchall()
+                for key, value in rows:
+                    results[key] = value
+        # Keys are returned as given, which may be unicode.
+        return dict((key, self.serializer.loads(str(results[key])))
+                    for key in keys if key in results)
+
+    def has_key(self, key):
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT 1 FROM register WHERE key = ? AND '
+                               + self.NOT_EXPIRED,
+                               (key, int(time.time()))).fetchone()
+        return row is not None
+
+    def keys(self):
+        with self.pool.connection() as conn:
+            return [row[0] for row in conn.execute('SELECT key FROM register')]
+
+    def remove_value(self, key):
+        with self.pool.connection() as conn:
+            conn.execute('DELETE FROM register WHERE key = ?', (key,))
+
+    def remove_values(self, keys):
+        with self.transaction() as conn:
+            conn.executemany('DELETE FROM register WHERE key = ?',
+                             [(key,) for key in keys])
+
+    def update_values(self, updates):
+        results = {}
+        now = int(time.time())
+        # The write lock is taken before reading so that concurrent updates of
+        # the same entries are serialised.
+        with self.transaction(immediate=True) as conn:
+            for key, update in updates.iteritems():
+                row = conn.execute('SELECT value, expires FROM register '
+                                   'WHERE key = ?', (key,)).fetchone()
+                if row and (row[1] is None or row[1] > now):
+                    value = update(self.serializer.loads(str(row[0])))
+                else:
+                    # An expired entry is replaced as if it were not present.
+                    value = update(None)
+                if value is not None:
+                    self._put(conn, key, value)
+                    results[key] = value
+                elif row:
+                    conn.execute('DELETE FROM register WHERE key = ?', (key,))
+        self._cleanup()
+        return results
+
+    def remove_expired(self, now=None):
+        """Removes all entries that have expired.
+        @type now: int
+        @param now: current time in seconds since the epoch
+        @rtype: int
+        @return: number of entries removed
+        """
+        if now is None:
+            now = int(time.time())
+        with self.pool.connection() as conn:
+            cursor = conn.execute('DELETE FROM register WHERE expires <= ?',
+                                  (now,))
+            removed = cursor.rowcount
+        log.debug("Removed %d expired entries from %s", removed,
+                  self.filename)
+        return removed
+
+    def _cleanup(self):
+        """Removes expired entries if the cleanup interval has passed since
+        this store last did so.
+        """
+        if self.cleanup_interval <= 0 or self._cleanup_at > time.time():
+            return
+        self._cleanup_at = time.time() + self.cleanup_interval
+        try:
+            self.remove_expired()
+        except sqlite3.Error, exc:
+            log.warning("Removal of expired entries from %s failed: %s",
+                        self.filename, exc)
+
+    def _put(self, conn, key, value):
+        data = self.serializer.dumps(value)
+        conn.execute('INSERT OR REPLACE INTO register (key, value, expires) '
+                     'VALUES (?, ?, ?)',
+                     (key, sqlite3.Binary(data), self._expiry_of(value)))
+
+    def _expiry_of(self, value):
+        """Returns the time after which an entry may be removed, taken from
+        the value's expires attribute and the configured cache expiry.
+        """
+        expires = getattr(value, 'expires', None)
+        if self.expire:
+            limit = int(time.time()) + self.expire
+            expires = min(expires, limit) if expires is not None else limit
+        return expires
@@ -0,0 +1,310 @@
+"""OAuth 2.0 WSGI server middleware - Bloom filter of registered token IDs,
+used to reject unknown tokens without reading the register
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+_unpack_digest = struct.Struct('<QQ').unpack
+_unpack_built_at = struct.Struct('<d').unpack_from
+
+
+class TokenFilter(object):
+    """
+    Bloom filter holding the IDs of the tokens in a register. A token ID that
+    is not in the filter is certainly not registered; one that is may be, with
+    a false positive rate set by the capacity and error rate.
+
+    The filter is held in a memory-mapped file, or in anonymous memory if no
+    file name is given. All processes that map the same file share the filter,
+    so that a token added by one process is at once known to the others.
+    Lookups read the mapping directly. Additions and rebuilds are serialised
+    by a file lock.
+
+    Bits are never cleared, so revoked and expired tokens stay in the filter
+    until it is rebuilt from the register. A rebuild writes a new file and
+    renames it over the old one, which is then marked as superseded so that
+    other processes map the new file.
+    """
+    MAGIC = 'NDGOABLF'
+    VERSION = 1
+    # magic, version, superseded flag, number of hash functions, number of
+    # bits, number of keys added, time built
+    HEADER_FORMAT = '<8sIB3xIQQd'
+    HEADER_SIZE = 64
+    SUPERSEDED_OFFSET = 12
+    COUNT_OFFSET = 28
+    BUILT_AT_OFFSET = 36
+
+    def __init__(self, capacity, error_rate, filename=None):
+        """
+        @type capacity: int
+        @param capacity: number of token IDs for which the filter is sized
+        @type error_rate: float
+        @param error_rate: false positive rate when the filter holds capacity
+        token IDs
+        @type filename: basestring
+        @param filename: path of the file holding the filter, or None to hold
+        it in the memory of this process
+        """
+        if capacity <= 0:
+            raise ValueError("Token filter capacity must be positive")
+        if not 0 < error_rate < 1:
+            raise ValueError("Token filter error rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filename = filename
+
+        # Optimal size and number of hash functions for the capacity and
+        # error rate, with the size rounded up to whole bytes.
+        num_bits = -capacity * math.log(error_rate) / math.log(2) ** 2
+        self.num_bits = int(math.ceil(num_bits / 8)) * 8
+        self.num_hashes = max(1, int(round(
+                                self.num_bits / float(capacity) * math.log(2))))
+
+        self._thread_lock = threading.Lock()
+        self._fd = None
+        self._map = None
+        self._pid = None
+
+    @property
+    def size(self):
+        """Size of the filter in bytes"""
+        return self.HEADER_SIZE + self.num_bits // 8
+
+    def open(self, get_keys):
+        """Maps the filter, building it if the filter file does not exist.
+        @type get_keys: callable
+        @param get_keys: function returning the keys of the register
+        """
+        if self.filename is None:
+            self._map = mmap.mmap(-1, self.size)
+            self._map[:] = self._build(get_keys())
+            return
+
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0600)
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size == 0:
+                os.write(fd, self._build(get_keys()))
+                log.info("Created token filter %s of %d bytes with %d hash "
+                         "functions", self.filename, self.size,
+                         self.num_hashes)
+        finally:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        self._reopen()
+
+    def __contains__(self, key):
+        filter_map = self._map
+        if filter_map[self.SUPERSEDED_OFFSET] != '\0':
+            with self._thread_lock:
+                self._reopen()
+            filter_map = self._map
+        # Inlined from _positions as this is called for every token checked.
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        hash1, hash2 = _unpack_digest(hashlib.md5(key).digest())
+        num_bits = self.num_bits
+        header_size = self.HEADER_SIZE
+        for i in xrange(self.num_hashes):
+            bit = (hash1 + i * hash2) % num_bits
+            if not (ord(filter_map[header_size + (bit >> 3)]) &
+                    (1 << (bit & 7))):
+                return False
+        return True
+
+    def add(self, key):
+        """Adds a key to the filter.
+        @type key: basestring
+        @param key: token ID
+        """
+        self._lock()
+        try:
+            filter_map = self._map
+            for offset, mask in self._positions(key):
+                filter_map[offset] = chr(ord(filter_map[offset]) | mask)
+            self._set_count(self._header()[5] + 1)
+        finally:
+            self._unlock()
+
+    def rebuild_due(self, interval):
+        """Returns whether the filter was built more than a given time ago.
+        @type interval: float
+        @param interval: time in seconds between rebuilds
+        @rtype: bool
+        """
+        return (_unpack_built_at(self._map, self.BUILT_AT_OFFSET)[0] +
+                interval <= time.time())
+
+    def rebuild(self, get_keys, interval=0):
+        """Rebuilds the filter from the keys of the register, dropping keys
+        that have since been removed.
+        @type get_keys: callable
+        @param get_keys: function returning the keys of the register
+        @type interval: float
+        @param interval: if given, rebuild only if the filter was built more
+        than this many seconds ago - another process may have rebuilt it
+        @rtype: bool
+        @return: True if the filter was rebuilt
+        """
+        self._lock()
+        try:
+            if interval and not self.rebuild_due(interval):
+                return False
+            data = self._build(get_keys())
+            if self.filename is None:
+                self._map[:] = data
+                return True
+
+            new_filename = "%s.%d" % (self.filename, os.getpid())
+            fd = os.open(new_filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC,
+                         0600)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            os.rename(new_filename, self.filename)
+            self._map[self.SUPERSEDED_OFFSET] = '\1'
+        finally:
+            self._unlock()
+        log.info("Rebuilt token filter %s", self.filename)
+        return True
+
+    def stats(self):
+        """Returns counters that can be used to size the filter.
+        @rtype: dict
+        @return: counter names and values
+        """
+        count, built_at = self._header()[5:7]
+        # Expected false positive rate for the number of keys added since the
+        # filter was built.
+        fill = 1 - math.exp(-self.num_hashes * count / float(self.num_bits))
+        return {'size': self.size,
+                'hashes': self.num_hashes,
+                'count': count,
+                'capacity': self.capacity,
+                'error_rate': fill ** self.num_hashes,
+                'built_at': built_at}
+
+    def _positions(self, key):
+        """Returns the byte offsets and bit masks of the bits for a key, using
+        double hashing to derive the hash functions from one digest.
+        """
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        hash1, hash2 = _unpack_digest(hashlib.md5(key).digest())
+        num_bits = self.num_bits
+        for i in xrange(self.num_hashes):
+            bit = (hash1 + i * hash2) % num_bits
+            yield self.HEADER_SIZE + (bit >> 3), 1 << (bit & 7)
+
+    def _build(self, keys):
+        """Returns the contents of a filter holding a number of keys."""
+        data = bytearray(self.size)
+        count = 0
+        for key in keys:
+            for offset, mask in self._positions(key):
+                data[offset] |= mask
+            count += 1
+        if count > self.capacity:
+            log.warning("Token filter holds %d token IDs, more than its "
+                        "capacity of %d - the false positive rate will be "
+                        "higher than configured", count, self.capacity)
+        struct.pack_into(self.HEADER_FORMAT, data, 0, self.MAGIC, self.VERSION,
+                         0, self.num_hashes, self.num_bits, count, time.time())
+        return str(data)
+
+    def _header(self):
+        return struct.unpack_from(self.HEADER_FORMAT, self._map)
+
+    def _set_count(self, count):
+        struct.pack_into('<Q', self._map, self.COUNT_OFFSET, count)
+
+    def _reopen(self):
+        """Maps the current filter file, if this has not already been done by
+        this process. A forked process opens the file again, as file locks
+        belong to the open file and so would not exclude the process it was
+        forked from. Must be called with the thread lock held.
+        """
+        if (self._map is not None and
+            self._map[self.SUPERSEDED_OFFSET] == '\0' and
+            self._pid == os.getpid()):
+            return
+
+        fd = os.open(self.filename, os.O_RDWR)
+        try:
+            filter_map = mmap.mmap(fd, 0)
+        except:
+            os.close(fd)
+            raise
+        magic, version, _, num_hashes, num_bits = struct.unpack_from(
+                                        self.HEADER_FORMAT, filter_map)[:5]
+        if magic != self.MAGIC or version != self.VERSION:
+            filter_map.close()
+            os.close(fd)
+            raise ValueError("%s is not a version %d token filter" %
+                             (self.filename, self.VERSION))
+        if (num_hashes, num_bits) != (self.num_hashes, self.num_bits):
+            log.warning("Using existing token filter %s of %d bytes instead "
+                        "of the configured %d - remove it to resize the "
+                        "filter", self.filename,
+                        self.HEADER_SIZE + num_bits // 8, self.size)
+            self.num_hashes = num_hashes
+            self.num_bits = num_bits
+
+        # Threads checking a key may still hold the old mapping, which is
+        # unmapped when no longer referenced.
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = fd
+        self._map = filter_map
+        self._pid = os.getpid()
+
+    def _lock(self):
+        """Takes the thread lock and the lock of the current filter file."""
+        self._thread_lock.acquire()
+        if self.filename is None:
+            return
+        try:
+            while True:
+                self._reopen()
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX)
+                if self._map[self.SUPERSEDED_OFFSET] == '\0':
+                    return
+                # Superseded while waiting for the lock.
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+        except:
+            self._thread_lock.release()
+            raise
+
+    def _unlock(self):
+        if self.filename is not None and fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
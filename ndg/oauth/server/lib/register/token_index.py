@@ -0,0 +1,191 @@
+"""OAuth 2.0 WSGI server middleware - secondary indexes of the access token
+register
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import logging
+import time
+
+from ndg.oauth.server.lib.register.register_base import RegisterBase
+
+log = logging.getLogger(__name__)
+
+
+class IndexEntry(dict):
+    """
+    Entry of a token index, mapping token IDs, or bucket names, to the times
+    at which they expire. The entry expires with the last of them, so that
+    it is removed by the storage or the register's sweeper.
+    """
+    __slots__ = ()
+
+    @property
+    def expires(self):
+        return max(self.itervalues()) if self else 0
+
+
+class TokenIndexRegister(RegisterBase):
+    """
+    Register of secondary indexes of access tokens, by user, by client and by
+    the grant from which they were issued.
+
+    Tokens with a given value are kept in buckets by expiry time, each bucket
+    an entry mapping the IDs of its tokens to their expiry times. A further
+    entry for the value lists its buckets, so that finding the tokens of a
+    user, client or grant reads that list and the buckets in it. Adding a
+    token rewrites the list, which has an entry per BUCKET_SECONDS of token
+    lifetime, and one bucket, rather than every token with the value.
+
+    Tokens are added to the index when issued and removed when revoked.
+    Expired tokens are left out of lookups. Buckets are removed as a whole
+    once all their tokens have expired: by the sweeper if sweeping is
+    enabled, and from a list when it is next changed. Entries are IndexEntry
+    values, which expire with their last token or bucket, so the lists and
+    buckets of values no longer used are removed by a full sweep or the
+    storage's own expiry.
+    """
+    USER_INDEX = 'user'
+    CLIENT_INDEX = 'client'
+    GRANT_INDEX = 'grant'
+    INDEXES = (USER_INDEX, CLIENT_INDEX, GRANT_INDEX)
+    USER_IDENTIFIER_GRANT_DATA_KEY = 'user_identifier'
+    BUCKET_SECONDS = 60
+
+    def __init__(self, name, config, indexes):
+        """
+        @type name: basestring
+        @param name: register name
+        @type config: dict
+        @param config: cache options as returned by RegisterBase.parse_config
+        @type indexes: iterable
+        @param indexes: names of the indexes to maintain, from INDEXES
+        """
+        for index in indexes:
+            if index not in self.INDEXES:
+                raise ValueError("Unknown token index %r - must be one of %s" %
+                                 (index, ', '.join(self.INDEXES)))
+        self.indexes = tuple(indexes)
+        super(TokenIndexRegister, self).__init__(name, config)
+
+    def add(self, token):
+        """Adds a token to the indexes.
+        @type token: ndg.oauth.server.lib.register.access_token.AccessToken
+        @param token: access token
+        """
+        token_id = token.token_id
+        expires = token.expires
+        bucket = self._bucket(expires)
+        bucket_ends = bucket * self.BUCKET_SECONDS + self.BUCKET_SECONDS
+        now = time.time()
+        expired_buckets = []
+
+        def add_to_list(key):
+            def update(entry):
+                entry = IndexEntry(entry or {})
+                for bucket_name, ends in entry.items():
+                    if ends <= now:
+                        del entry[bucket_name]
+                        expired_buckets.append(
+                                    self._bucket_key(key, int(bucket_name)))
+                entry[str(bucket)] = bucket_ends
+                return entry
+            return update
+
+        def add_to_bucket(entry):
+            entry = IndexEntry(entry or {})
+            entry[token_id] = expires
+            return entry
+
+        updates = {}
+        for key in self._keys_of(token):
+            updates[key] = add_to_list(key)
+            updates[self._bucket_key(key, bucket)] = add_to_bucket
+        self.update_values(updates)
+        if expired_buckets:
+            self.remove_values(expired_buckets)
+        for key in self._keys_of(token):
+            # All tokens in a bucket have expired by the time it ends.
+            self.schedule_removal(self._bucket_key(key, bucket), bucket_ends)
+
+    def remove(self, tokens):
+        """Removes tokens from the indexes.
+        @type tokens: iterable
+        @param tokens: access tokens
+        """
+        token_ids_by_key = {}
+        for token in tokens:
+            bucket = self._bucket(token.expires)
+            for key in self._keys_of(token):
+                token_ids_by_key.setdefault(self._bucket_key(key, bucket),
+                                            set()).add(token.token_id)
+
+        def remove_from_bucket(token_ids):
+            def update(entry):
+                if entry is None:
+                    return None
+                entry = IndexEntry(entry)
+                for token_id in token_ids:
+                    entry.pop(token_id, None)
+                return entry or None
+            return update
+
+        self.update_values(dict((key, remove_from_bucket(token_ids))
+                                for key, token_ids in
+                                token_ids_by_key.iteritems()))
+
+    def get_token_ids(self, index, value):
+        """Returns the IDs of the unexpired tokens with a given value.
+        @type index: basestring
+        @param index: index name, from INDEXES
+        @type value: basestring
+        @param value: user ID, client ID or grant code
+        @rtype: list
+        @return: token IDs
+        """
+        if index not in self.indexes:
+            raise ValueError("Token index %r is not maintained" % index)
+        key = self._key(index, value)
+        try:
+            entry = self.get_value(key)
+        except KeyError:
+            return []
+        now = time.time()
+        buckets = self.get_values([self._bucket_key(key, int(bucket_name))
+                                   for bucket_name, ends in entry.iteritems()
+                                   if ends > now])
+        return [token_id for bucket in buckets.itervalues()
+                for token_id, expires in bucket.iteritems()
+                if expires > now]
+
+    def _keys_of(self, token):
+        grant = token.grant
+        values = {
+            self.USER_INDEX: (grant.additional_data or {}).get(
+                                        self.USER_IDENTIFIER_GRANT_DATA_KEY),
+            self.CLIENT_INDEX: grant.client_id,
+            self.GRANT_INDEX: grant.code
+        }
+        return [self._key(index, values[index]) for index in self.indexes
+                if values[index] is not None]
+
+    @staticmethod
+    def _key(index, value):
+        if isinstance(value, unicode):
+            # Storage lock file names are derived from byte string keys.
+            value = value.encode('utf-8')
+        return "%s:%s" % (index, value)
+
+    def _bucket(self, expires):
+        return int(expires // self.BUCKET_SECONDS)
+
+    @staticmethod
+    def _bucket_key(key, bucket):
+        # Index names contain neither ':' nor '@', so bucket keys cannot
+        # clash with the keys of lists, whatever the indexed value.
+        index, value = key.split(':', 1)
+        return "%s@%d:%s" % (index, bucket, value)
@@ -0,0 +1,377 @@
+"""OAuth 2.0 WSGI server middleware - renderer that compiles Genshi templates
+into literal chunks and value slots
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import ast
+import logging
+import re
+
+from genshi.core import START
+from genshi.template.base import EXEC, EXPR, SUB
+from genshi.template.directives import (ContentDirective, DefDirective,
+                                        IfDirective, ReplaceDirective,
+                                        StripDirective)
+
+from ndg.oauth.server.lib.render.genshi_renderer import GenshiRenderer
+
+log = logging.getLogger(__name__)
+
+
+def _escape_text(value):
+    return (value.replace('&', '&amp;').replace('<', '&lt;')
+            .replace('>', '&gt;'))
+
+
+def _escape_attribute(value):
+    return _escape_text(value).replace('"', '&#34;')
+
+
+def split_marked_output(output, marker_pat, names, markup_names=()):
+    """Splits a page rendered with markers in place of parameter values into
+    the literal text between them and the slots they mark.
+    @type output: basestring
+    @param output: rendered page
+    @type marker_pat: compiled pattern
+    @param marker_pat: pattern matching a marker, with the index of the
+    parameter name in names as its group
+    @type names: list
+    @param names: names of the parameters replaced by markers
+    @type markup_names: frozenset
+    @param markup_names: names of parameters inserted without escaping
+    @rtype: tuple
+    @return: (chunks, slots) where chunks is a list of literal text, one more
+    than there are slots, and slots a list of (parameter name, escape
+    function) tuples - the function is None for a parameter inserted as
+    markup, and otherwise escapes the value as Genshi does in the context
+    """
+    parts = marker_pat.split(output)
+    chunks = parts[0::2]
+    slots = []
+    in_tag = False
+    for i, chunk in enumerate(chunks[:-1]):
+        tag_start, tag_end = chunk.rfind('<'), chunk.rfind('>')
+        if tag_start != tag_end:
+            in_tag = tag_start > tag_end
+        name = names[int(parts[2 * i + 1])]
+        if name in markup_names:
+            escape = None
+        elif in_tag:
+            # An attribute value
+            escape = _escape_attribute
+        else:
+            escape = _escape_text
+        slots.append((name, escape))
+    return chunks, slots
+
+
+class _ParameterUseChecker(object):
+    """Finds the parameters of a template that are used other than by
+    inserting their values as text, or by testing whether they are set.
+
+    Parameters are the attributes of c. An expression may insert a parameter
+    in text or an attribute value, test it in py:if or py:strip, alone or
+    combined with not, and or or, pass it to a function defined by py:def,
+    whose arguments are checked by the same rules, or, for a markup
+    parameter, pass it to HTML().
+    """
+    TEXT, TEST, OTHER = 'text', 'test', 'other'
+    TEXT_DIRECTIVES = (ContentDirective, ReplaceDirective)
+    TEST_DIRECTIVES = (IfDirective, StripDirective)
+
+    def __init__(self, stream, markup_names):
+        self.markup_names = markup_names
+        self.functions = set()
+        self.arguments = set()
+        self._find_functions(stream)
+        self.found = set()
+        self._check_stream(stream)
+
+    def _find_functions(self, stream):
+        for kind, data, _ in stream:
+            if kind is SUB:
+                directives, substream = data
+                for directive in directives:
+                    if isinstance(directive, DefDirective):
+                        self.functions.add(directive.name)
+                        self.arguments.update(directive.args)
+                        self.arguments.update(
+                                    name for name in (directive.star_args,
+                                                      directive.dstar_args)
+                                    if name)
+                self._find_functions(substream)
+
+    def _check_stream(self, stream):
+        for kind, data, _ in stream:
+            if kind is EXPR:
+                self._check_expression(data, self.TEXT)
+            elif kind is EXEC:
+                # A <?python ?> block may do anything with a parameter.
+                for node in ast.iter_child_nodes(data.ast):
+                    self._check_node(node, self.OTHER)
+            elif kind is START:
+                for _, value in data[1]:
+                    if not isinstance(value, basestring):
+                        self._check_stream(value)
+            elif kind is SUB:
+                directives, substream = data
+                for directive in directives:
+                    self._check_directive(directive)
+                self._check_stream(substream)
+
+    def _check_directive(self, directive):
+        if isinstance(directive, DefDirective):
+            for default in directive.defaults.itervalues():
+                self._check_expression(default, self.OTHER)
+            return
+        if isinstance(directive, self.TEXT_DIRECTIVES):
+            context = self.TEXT
+        elif isinstance(directive, self.TEST_DIRECTIVES):
+            context = self.TEST
+        else:
+            context = self.OTHER
+        for expression in self._expressions_of(directive):
+            self._check_expression(expression, context)
+
+    @staticmethod
+    def _expressions_of(directive):
+        expression = getattr(directive, 'expr', None)
+        if expression is not None:
+            yield expression
+        for _, expression in getattr(directive, 'vars', ()):
+            yield expression
+
+    def _check_expression(self, expression, context):
+        # Expressions made by Genshi from a syntax tree have no source.
+        if expression.source != '?':
+            node = ast.parse(expression.source.strip(), mode='eval')
+        else:
+            node = expression.ast
+        self._check_node(node.body, context)
+
+    def _check_node(self, node, context):
+        name = self._parameter_name(node)
+        if name is not None:
+            if context == self.OTHER:
+                self.found.add(name)
+            return
+        if isinstance(node, ast.Name) and node.id == 'c':
+            self.found.add('c')
+        elif context == self.TEST and isinstance(node, ast.BoolOp):
+            for value in node.values:
+                self._check_node(value, self.TEST)
+        elif (context == self.TEST and isinstance(node, ast.UnaryOp) and
+              isinstance(node.op, ast.Not)):
+            self._check_node(node.operand, self.TEST)
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+              and node.func.id in self.functions):
+            for argument in node.args:
+                self._check_node(argument, self.TEXT)
+            for keyword in node.keywords:
+                self._check_node(keyword.value, self.TEXT)
+            for argument in (node.starargs, node.kwargs):
+                if argument is not None:
+                    self._check_node(argument, self.OTHER)
+        elif (context == self.TEXT and isinstance(node, ast.Call) and
+              isinstance(node.func, ast.Name) and node.func.id == 'HTML' and
+              len(node.args) == 1 and not node.keywords and
+              self._parameter_name(node.args[0]) in self.markup_names):
+            return
+        else:
+            for child in ast.iter_child_nodes(node):
+                self._check_node(child, self.OTHER)
+
+    def _parameter_name(self, node):
+        """Returns the name of the parameter, or py:def argument, that the
+        node refers to, or None.
+        """
+        if (isinstance(node, ast.Attribute) and
+            isinstance(node.value, ast.Name) and node.value.id == 'c'):
+            return node.attr
+        if isinstance(node, ast.Name) and node.id in self.arguments:
+            return node.id
+        return None
+
+
+def find_value_dependent_parameters(template, markup_names=()):
+    """Finds the parameters of a template whose values affect the output
+    other than by being inserted as text, or by whether they are set.
+    @type template: genshi.template.MarkupTemplate
+    @param template: template
+    @type markup_names: frozenset
+    @param markup_names: names of parameters that may be passed to HTML()
+    @rtype: set
+    @return: names of the parameters, and of py:def arguments, used in other
+    ways - 'c' if the parameters are used as a whole
+    """
+    return _ParameterUseChecker(template.stream, markup_names).found
+
+
+class _CompiledTemplate(object):
+    """A template rendered for one set of parameter truth values, as a list
+    of literal chunks and the parameter slots between them.
+    """
+    __slots__ = ('template', 'chunks', 'slots')
+
+    def __init__(self, template, chunks, slots):
+        """
+        @type template: genshi.template.MarkupTemplate
+        @param template: template compiled
+        @type chunks: list
+        @param chunks: literal text, one more than there are slots
+        @type slots: list
+        @param slots: (parameter name, escape function) tuples; the function
+        is None for a parameter inserted as markup
+        """
+        self.template = template
+        self.chunks = chunks
+        self.slots = slots
+
+    def render(self, parameters):
+        parts = [self.chunks[0]]
+        for (name, escape), chunk in zip(self.slots, self.chunks[1:]):
+            value = parameters[name]
+            if hasattr(value, '__html__'):
+                value = value.__html__()
+            elif escape is None:
+                value = unicode(value)
+            else:
+                value = escape(unicode(value))
+            parts.append(value)
+            parts.append(chunk)
+        return u''.join(parts)
+
+
+class CompiledRenderer(GenshiRenderer):
+    """Renderer for Genshi templates whose output depends on the parameters
+    only through their values being inserted, and through conditions on
+    whether they are set - as for the templates supplied with the examples.
+
+    The first time a template is rendered with a given set of parameters set
+    and unset, it is rendered by Genshi with a marker in place of each value
+    that is set, and the output is split at the markers into literal chunks
+    and slots. Rendering is then a join of the chunks with the escaped
+    values. The compiled template is checked against the Genshi output for
+    the parameters of that first render; if they differ, that combination is
+    always rendered by Genshi.
+
+    Templates that use a parameter in any other way - comparing it, looping
+    over it or passing it to a function - are always rendered by Genshi, as
+    the output for one value says nothing about the output for another.
+
+    Values are escaped as Genshi does for text and attribute values.
+    Parameters named in markup_parameters are inserted without escaping, for
+    templates that pass them to HTML().
+    """
+    DEFAULT_MARKUP_PARAMETERS = 'footerText'
+    MAX_COMPILED_TEMPLATES = 256
+    MARKER = u'ndgrenderslot%dx'
+    MARKER_PAT = re.compile(r'ndgrenderslot(\d+)x')
+
+    def __init__(self, markup_parameters=DEFAULT_MARKUP_PARAMETERS, **kw):
+        """
+        @type markup_parameters: basestring or iterable
+        @param markup_parameters: names of parameters inserted as markup,
+        space separated if a string
+        @type kw: dict
+        @param kw: GenshiRenderer options
+        """
+        super(CompiledRenderer, self).__init__(**kw)
+        if isinstance(markup_parameters, basestring):
+            markup_parameters = markup_parameters.split()
+        self.markup_parameters = frozenset(markup_parameters)
+        # Compiled templates, by (filename, parameter truth values); None
+        # for a combination that is rendered by Genshi
+        self._compiled = {}
+        self.compiled_renders = 0
+        self.genshi_renders = 0
+
+    def render(self, filename, parameters):
+        """Render a page from a template.
+        @type filename: basestring
+        @param filename: filename of template
+        @type parameters: dict
+        @param parameters: parameters to substitute into template
+        @rtype: basestring
+        @return: rendered template
+        """
+        key = self._get_key(filename, parameters)
+        try:
+            compiled = self._compiled[key]
+        except KeyError:
+            return self._compile(key, filename, parameters)
+        if compiled is None:
+            self.genshi_renders += 1
+            return super(CompiledRenderer, self).render(filename, parameters)
+        if self.auto_reload and self._load(filename) is not compiled.template:
+            return self._compile(key, filename, parameters)
+        self.compiled_renders += 1
+        return compiled.render(parameters)
+
+    @staticmethod
+    def _get_key(filename, parameters):
+        return (filename,
+                frozenset((name, True if value else repr(value))
+                          for name, value in parameters.iteritems()))
+
+    def _compile(self, key, filename, parameters):
+        """Compiles a template for the truth values of the parameters, and
+        returns it rendered by Genshi.
+        """
+        template = self._load(filename)
+        dependent = find_value_dependent_parameters(template,
+                                                    self.markup_parameters)
+        if dependent:
+            log.warning("Template %s uses %s other than as text or in tests "
+                        "of whether they are set - rendering it with Genshi",
+                        filename, ', '.join(sorted(dependent)))
+            self._store(key, None)
+            self.genshi_renders += 1
+            return template.generate(c=parameters).render('html')
+
+        names = []
+        marked = {}
+        for name, value in parameters.iteritems():
+            if value:
+                marked[name] = self.MARKER % len(names)
+                names.append(name)
+            else:
+                marked[name] = value
+        output = template.generate(c=marked).render('html')
+        chunks, slots = split_marked_output(output, self.MARKER_PAT, names,
+                                            self.markup_parameters)
+        compiled = _CompiledTemplate(template, chunks, slots)
+
+        response = template.generate(c=parameters).render('html')
+        if compiled.render(parameters) != response:
+            log.warning("Template %s cannot be compiled for the parameters "
+                        "set - rendering it with Genshi", filename)
+            compiled = None
+        self._store(key, compiled)
+        self.genshi_renders += 1
+        return response
+
+    def _store(self, key, compiled):
+        if len(self._compiled) >= self.MAX_COMPILED_TEMPLATES:
+            self._compiled.clear()
+        self._compiled[key] = compiled
+
+    def check_template(self, filename, parameters):
+        """Checks whether a template is rendered the same by this renderer as
+        by Genshi, for a set of parameters.
+        @type filename: basestring
+        @param filename: filename of template
+        @type parameters: dict
+        @param parameters: parameters to substitute into template
+        @rtype: bool
+        @return: True if the template can be compiled for the parameters
+        """
+        key = self._get_key(filename, parameters)
+        self._compiled.pop(key, None)
+        self._compile(key, filename, parameters)
+        return self._compiled[key] is not None
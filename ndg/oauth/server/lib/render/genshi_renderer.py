@@ -7,16 +7,76 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 
+import logging
 import os
+import threading
 
 #from genshi.template import MarkupTemplate
 from genshi.template import TemplateLoader
 
 from ndg.oauth.server.lib.render.renderer_interface import RendererInterface
 
+log = logging.getLogger(__name__)
+
+
 class GenshiRenderer(RendererInterface):
     """Implementation of the renderer interface using Genshi
+
+    Templates are loaded through a TemplateLoader per template directory that
+    is shared by all renderers in the process with the same settings, so each
+    template is parsed once and kept in the loader's cache.
     """
+    DEFAULT_MAX_CACHE_SIZE = 25
+    
+    # Shared loaders, by (template directory, auto_reload, max_cache_size)
+    _loaders = {}
+    _loaders_lock = threading.Lock()
+
+    def __init__(self, auto_reload=False, max_cache_size=DEFAULT_MAX_CACHE_SIZE):
+        """
+        @type auto_reload: bool or basestring
+        @param auto_reload: if True, templates are reloaded when their files
+        change, at the cost of checking the file on each render
+        @type max_cache_size: int or basestring
+        @param max_cache_size: maximum number of templates cached per template
+        directory
+        """
+        if isinstance(auto_reload, basestring):
+            auto_reload = auto_reload.lower() in ('true', 'yes', '1')
+        self.auto_reload = bool(auto_reload)
+        self.max_cache_size = int(max_cache_size)
+
+    def _get_loader(self, dirname):
+        key = (dirname, self.auto_reload, self.max_cache_size)
+        loader = self._loaders.get(key)
+        if loader is None:
+            with self._loaders_lock:
+                loader = self._loaders.get(key)
+                if loader is None:
+                    loader = TemplateLoader(dirname,
+                                            auto_reload=self.auto_reload,
+                                            max_cache_size=self.max_cache_size)
+                    self.__class__._loaders[key] = loader
+        return loader
+
+    def _load(self, filename):
+        return self._get_loader(os.path.dirname(filename)).load(
+                                                    os.path.basename(filename))
+
+    def preload(self, filenames):
+        """Loads templates into the cache, so that they are not parsed when
+        first rendered. Templates that fail to load are logged and skipped.
+        @type filenames: iterable
+        @param filenames: filenames of templates; None values are ignored
+        """
+        for filename in filenames:
+            if not filename:
+                continue
+            try:
+                self._load(filename)
+            except Exception, e:
+                log.warning("Error loading template %s: %s", filename, e)
+
     def render(self, filename, parameters):
         """Render a page from a template.
         @type filename: basestring
@@ -26,10 +86,7 @@ class GenshiRenderer(RendererInterface):
         @rtype: basestring
         @return: rendered template
         """
-        fname = os.path.basename(filename)
-        dirname = os.path.dirname(filename)
-        loader = TemplateLoader(dirname, auto_reload=True)
-        tmpl = loader.load(fname)
+        tmpl = self._load(filename)
         response = tmpl.generate(c=parameters).render('html')
         return response
 
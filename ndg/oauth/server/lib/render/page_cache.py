@@ -0,0 +1,193 @@
+"""OAuth 2.0 WSGI server middleware - cache of rendered pages with holes for
+the values that change with each request
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import logging
+import os
+import re
+import threading
+import time
+
+from ndg.oauth.server.lib.register.near_cache import NearCache
+from ndg.oauth.server.lib.render.compiled_renderer import split_marked_output
+
+log = logging.getLogger(__name__)
+
+
+class _CachedPage(object):
+    """A rendered page as UTF-8 encoded chunks and the holes between them."""
+    __slots__ = ('chunks', 'holes')
+
+    def __init__(self, chunks, holes):
+        self.chunks = [chunk.encode('utf-8') for chunk in chunks]
+        self.holes = holes
+
+    def render(self, parameters):
+        parts = [self.chunks[0]]
+        for (name, escape), chunk in zip(self.holes, self.chunks[1:]):
+            value = unicode(parameters[name])
+            if escape is not None:
+                value = escape(value)
+            parts.append(value.encode('utf-8'))
+            parts.append(chunk)
+        return ''.join(parts)
+
+
+class RenderedPageCache(object):
+    """
+    Caches pages rendered by a renderer, for parameters that are the same for
+    many requests - the client, scope and layout - with holes for those that
+    change with each request, such as the submit and return URLs. Pages are
+    held UTF-8 encoded.
+
+    A page is cached the first time it is rendered for a set of parameters,
+    by rendering it with a marker in place of each value that goes in a hole,
+    and is checked against the page rendered for that first request; a page
+    that differs is not cached. Cached pages are discarded when one of the
+    watched files changes, checked at most every check_interval seconds: the
+    files given, such as the client register, and if the renderer reloads
+    changed templates, the files in the template directories.
+    """
+    DEFAULT_MAX_SIZE = 1000
+    DEFAULT_CHECK_INTERVAL = 5
+    MARKER = u'ndgpageslot%dx'
+    MARKER_PAT = re.compile(r'ndgpageslot(\d+)x')
+
+    def __init__(self, renderer, hole_parameters, max_size=DEFAULT_MAX_SIZE,
+                 check_interval=DEFAULT_CHECK_INTERVAL, watch_files=()):
+        """
+        @type renderer: ndg.oauth.server.lib.render.renderer_interface.RendererInterface
+        @param renderer: renderer of the pages
+        @type hole_parameters: iterable
+        @param hole_parameters: names of the parameters that change with each
+        request
+        @type max_size: int
+        @param max_size: maximum number of pages held - 0 disables caching
+        @type check_interval: float
+        @param check_interval: minimum time in seconds between checks of the
+        watched files
+        @type watch_files: iterable
+        @param watch_files: files on which the pages depend, other than
+        templates; None values are ignored
+        """
+        self.renderer = renderer
+        self.hole_parameters = frozenset(hole_parameters)
+        self.check_interval = check_interval
+        self.watch_files = [f for f in watch_files if f]
+        self.watch_templates = getattr(renderer, 'auto_reload', True)
+        self._pages = NearCache(max_size, float('inf'), None)
+        self._template_dirs = set()
+        self._lock = threading.Lock()
+        self._checked_at = time.time()
+        self._signature = self._get_signature()
+        self.uncacheable = 0
+
+    def render(self, filename, parameters):
+        """Render a page from a template.
+        @type filename: basestring
+        @param filename: filename of template
+        @type parameters: dict
+        @param parameters: parameters to substitute into template
+        @rtype: str
+        @return: rendered page, UTF-8 encoded
+        """
+        if self._pages.max_size <= 0:
+            return self._render(filename, parameters)
+        if self._checked_at + self.check_interval <= time.time():
+            self._check_files()
+        try:
+            key = (filename,
+                   frozenset((name, (True if value else repr(value))
+                                    if name in self.hole_parameters else value)
+                             for name, value in parameters.iteritems()))
+        except TypeError:
+            # A value that cannot be part of a key
+            self.uncacheable += 1
+            return self._render(filename, parameters)
+        page = self._pages.get(key)
+        if page is not None:
+            return page.render(parameters)
+        return self._add_page(key, filename, parameters)
+
+    def _render(self, filename, parameters):
+        response = self.renderer.render(filename, parameters)
+        if isinstance(response, unicode):
+            response = response.encode('utf-8')
+        return response
+
+    def _add_page(self, key, filename, parameters):
+        """Renders a page, and caches it with holes if it can be."""
+        if self.watch_templates and filename:
+            dirname = os.path.dirname(filename)
+            if dirname not in self._template_dirs:
+                with self._lock:
+                    self._template_dirs.add(dirname)
+                    self._signature = self._get_signature()
+
+        names = []
+        marked = {}
+        for name, value in parameters.iteritems():
+            if value and name in self.hole_parameters:
+                marked[name] = self.MARKER % len(names)
+                names.append(name)
+            else:
+                marked[name] = value
+        output = self.renderer.render(filename, marked)
+        if not isinstance(output, unicode):
+            output = output.decode('utf-8')
+        chunks, holes = split_marked_output(output, self.MARKER_PAT, names)
+        page = _CachedPage(chunks, holes)
+
+        response = self._render(filename, parameters)
+        if page.render(parameters) == response:
+            self._pages.put(key, page, float('inf'), None)
+        else:
+            log.warning("Page for template %s cannot be cached for the "
+                        "parameters set", filename)
+            self.uncacheable += 1
+        return response
+
+    def _get_signature(self):
+        """Returns the modification times of the watched files."""
+        filenames = list(self.watch_files)
+        for dirname in self._template_dirs:
+            try:
+                filenames.extend(os.path.join(dirname, name)
+                                 for name in os.listdir(dirname))
+            except OSError:
+                pass
+        signature = {}
+        for filename in filenames:
+            try:
+                signature[filename] = os.stat(filename).st_mtime
+            except OSError:
+                signature[filename] = None
+        return signature
+
+    def _check_files(self):
+        with self._lock:
+            if self._checked_at + self.check_interval > time.time():
+                return
+            self._checked_at = time.time()
+            signature = self._get_signature()
+            if signature == self._signature:
+                return
+            self._signature = signature
+        log.info("Files used for cached pages have changed - discarding "
+                 "pages")
+        self._pages.invalidate()
+
+    def stats(self):
+        """Returns counters that can be used to size the cache.
+        @rtype: dict
+        @return: counter names and values
+        """
+        stats = self._pages.stats()
+        stats['uncacheable'] = self.uncacheable
+        return stats
@@ -20,3 +20,11 @@ class RendererInterface(object):
         @return: rendered template
         """
         return None
+
+    def preload(self, filenames):
+        """Prepare templates so that their first render is no slower than
+        later ones. Renderers that keep no state need not do anything.
+        @type filenames: iterable
+        @param filenames: filenames of templates; None values are ignored
+        """
+        pass
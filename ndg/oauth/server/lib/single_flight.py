@@ -0,0 +1,88 @@
+"""OAuth 2.0 WSGI server middleware - coalescing of concurrent identical calls
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import sys
+import threading
+
+
+class _Call(object):
+    """A call in progress, and its outcome once done."""
+    __slots__ = ('done', 'result', 'exc_info')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Runs at most one call at a time for each key. Threads that make a call
+    with a key for which one is already in progress wait for it and share its
+    result, or its exception, instead of making their own.
+
+    Results are not kept once the call has returned; a cache in front of this
+    is still needed for that.
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, func, *args, **kw):
+        """Calls a function, or waits for the call in progress for a key.
+        @type key: hashable
+        @param key: key identifying calls that have the same outcome
+        @type func: callable
+        @param func: function to call
+        @return: the function's return value
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.exc_info is not None:
+                raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+            return call.result
+
+        try:
+            call.result = func(*args, **kw)
+        except:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_progress(self, key):
+        """Returns whether a call for a key is in progress.
+        @type key: hashable
+        @param key: key identifying calls that have the same outcome
+        @rtype: bool
+        """
+        return key in self._calls
+
+    def stats(self):
+        """Returns counters showing how many calls were saved.
+        @rtype: dict
+        @return: counter names and values
+        """
+        with self._lock:
+            return {'calls': self.calls,
+                    'shared': self.shared,
+                    'in_progress': len(self._calls)}
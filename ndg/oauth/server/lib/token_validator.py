@@ -0,0 +1,625 @@
+"""OAuth 2.0 WSGI server middleware - validation of access tokens by an
+authorization server's check_token service, for resource servers that run
+separately from it
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import base64
+import httplib
+import json
+import logging
+import re
+import socket
+import ssl
+import threading
+import time
+import urllib
+import urlparse
+
+from webob import Request
+
+from ndg.oauth.server.lib.circuit_breaker import CircuitBreaker
+from ndg.oauth.server.lib.register.near_cache import NearCache
+from ndg.oauth.server.lib.single_flight import SingleFlight
+
+log = logging.getLogger(__name__)
+
+
+class TokenValidatorError(Exception):
+    """Raised when the check_token service cannot be reached or returns an
+    invalid response.
+    """
+
+
+class TokenValidator(object):
+    """
+    Validates the bearer tokens presented to a resource server, by calling
+    the check_token service of an authorization server, as implemented by
+    ndg.oauth.server.lib.authorization_server.AuthorizationServer.check_token,
+    or in subclasses by other means.
+
+    Verdicts are held in a cache in this process, keyed by token and scope.
+    A valid token is cached for no longer than cache_ttl, the time until it
+    expires and the max-age of the response, if any; an invalid token for no
+    longer than error_cache_ttl. A token revoked in that time is still
+    accepted by this process.
+
+    Concurrent checks of the same token and scope that miss the cache are
+    coalesced into a single call to the authorization server. Calls are made
+    through a circuit breaker, which stops them for a while once a number of
+    them in a row have failed or been slow.
+
+    A valid token whose cached verdict is out of date is still accepted for
+    up to stale_grace seconds, but never after it expires, while the breaker
+    is open, when the call to check it again fails, or while another thread
+    is checking it again. A token revoked in that time is accepted too, so
+    stale_grace is 0 unless set.
+
+    If stats_interval is set, the state of the circuit breaker and the
+    counters returned by stats are logged at most that often, on the first
+    check after each interval.
+
+    Subclasses implement _request to pass the check to the check_token
+    service, or _validate to check tokens by other means.
+    """
+    BEARER_TOK_ID = 'Bearer'
+    AUTHZ_HDR_ENV_KEYNAME = 'HTTP_AUTHORIZATION'
+    MAX_AGE_PAT = re.compile(r'max-age\s*=\s*(\d+)')
+
+    DEFAULT_CACHE_SIZE = 10000
+    DEFAULT_CACHE_TTL = 60
+    DEFAULT_ERROR_CACHE_TTL = 0
+    DEFAULT_STALE_GRACE = 0
+    DEFAULT_FAILURE_THRESHOLD = 5
+    DEFAULT_LATENCY_THRESHOLD = 2.0
+    DEFAULT_RESET_TIMEOUT = 30
+    DEFAULT_STATS_INTERVAL = 0
+
+    # Configuration options, with the types to which their values are cast
+    OPTIONS = {
+        'cache_size': int,
+        'cache_ttl': int,
+        'error_cache_ttl': int,
+        'stale_grace': int,
+        'failure_threshold': int,
+        'latency_threshold': float,
+        'reset_timeout': float,
+        'stats_interval': float
+    }
+
+    def __init__(self, resource_id=None, resource_secret=None,
+                 cache_size=DEFAULT_CACHE_SIZE, cache_ttl=DEFAULT_CACHE_TTL,
+                 error_cache_ttl=DEFAULT_ERROR_CACHE_TTL,
+                 stale_grace=DEFAULT_STALE_GRACE,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 latency_threshold=DEFAULT_LATENCY_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT,
+                 stats_interval=DEFAULT_STATS_INTERVAL):
+        """
+        @type resource_id: basestring
+        @param resource_id: ID with which this resource server authenticates
+        to the authorization server, if it uses password authentication
+        @type resource_secret: basestring
+        @param resource_secret: secret for resource_id
+        @type cache_size: int
+        @param cache_size: maximum number of verdicts held - 0 disables the
+        cache
+        @type cache_ttl: int
+        @param cache_ttl: maximum time in seconds for which a valid token is
+        accepted without checking it again
+        @type error_cache_ttl: int
+        @param error_cache_ttl: maximum time in seconds for which an invalid
+        token is rejected without checking it again
+        @type stale_grace: int
+        @param stale_grace: maximum time in seconds after cache_ttl for which
+        a valid token is accepted if it cannot be checked again
+        @type failure_threshold: int
+        @param failure_threshold: number of consecutive failed or slow calls
+        at which the circuit breaker opens - 0 disables it
+        @type latency_threshold: float
+        @param latency_threshold: time in seconds above which a call counts
+        as slow - 0 counts only failed calls
+        @type reset_timeout: float
+        @param reset_timeout: time in seconds for which the circuit breaker
+        stays open before a call is tried again
+        @type stats_interval: float
+        @param stats_interval: time in seconds between logging the counters
+        - 0 disables it
+        """
+        self.authorization = None
+        if resource_id:
+            self.authorization = 'Basic ' + base64.b64encode(
+                                    '%s:%s' % (resource_id, resource_secret))
+        self.cache_ttl = cache_ttl
+        self.error_cache_ttl = error_cache_ttl
+        self.stale_grace = stale_grace
+        max_ttl = max(cache_ttl + stale_grace, error_cache_ttl)
+        if cache_size > 0 and max_ttl > 0:
+            self.cache = NearCache(cache_size, max_ttl, None)
+        else:
+            self.cache = None
+        self.single_flight = SingleFlight()
+        self.circuit_breaker = CircuitBreaker(self.__class__.__name__,
+                                              failure_threshold,
+                                              latency_threshold or None,
+                                              reset_timeout)
+        self.stale_served = 0
+        self.stats_interval = stats_interval
+        self._stats_logged_at = time.time()
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates a validator from configuration options.
+        @type config: dict
+        @param config: option names, as in OPTIONS, and string values
+        @rtype: TokenValidator
+        @return: validator
+        """
+        kw = {}
+        for name, value in config.iteritems():
+            if name not in cls.OPTIONS:
+                raise ValueError("Unknown check_token option %r - must be one "
+                                 "of %s" % (name, ', '.join(sorted(
+                                                            cls.OPTIONS))))
+            if value not in (None, ''):
+                kw[name] = cls.OPTIONS[name](value)
+        return cls(**kw)
+
+    def get_registered_token(self, request, scope=None):
+        """Checks the bearer token in the Authorization header of a request.
+        @type request: webob.Request
+        @param request: HTTP request object
+        @type scope: str
+        @param scope: required scope
+        @rtype: tuple: (basestring, int, str)
+        @return: tuple (
+                     identifier of the user who granted the token
+                     HTTP status
+                     error, or None if the token is valid
+                 )
+        """
+        authorization_hdr = request.environ.get(self.AUTHZ_HDR_ENV_KEYNAME)
+        if authorization_hdr is None:
+            log.error('No Authorization header present for request to %r',
+                      request.path_url)
+            return None, httplib.BAD_REQUEST, 'invalid_request'
+
+        authorization_hdr_parts = authorization_hdr.split()
+        if (len(authorization_hdr_parts) < 2 or
+            authorization_hdr_parts[0] != self.BEARER_TOK_ID):
+            log.error('Expecting "Bearer" type Authorization header for '
+                      'request to %r; header is: %r', request.path_url,
+                      authorization_hdr)
+            return None, httplib.BAD_REQUEST, 'invalid_request'
+
+        return self.check_token(authorization_hdr_parts[1], scope)
+
+    def check_token(self, token_id, scope=None):
+        """Checks a token, using the cached verdict if there is one.
+        @type token_id: basestring
+        @param token_id: access token
+        @type scope: str
+        @param scope: required scope
+        @rtype: tuple: (basestring, int, str)
+        @return: tuple (user identifier, HTTP status, error) as returned by
+        get_registered_token
+        """
+        if self.stats_interval > 0:
+            self._log_stats()
+        key = (token_id, scope)
+        stale_verdict = None
+        if self.cache is not None:
+            entry = self.cache.get(key)
+            if entry is not None:
+                verdict, fresh_until = entry
+                if fresh_until > time.time():
+                    return verdict
+                stale_verdict = verdict
+                if self.single_flight.in_progress(key):
+                    return self._serve_stale(stale_verdict,
+                                             "it is being checked again")
+        try:
+            return self.single_flight.do(key, self._check_token, key,
+                                         token_id, scope)
+        except TokenValidatorError, e:
+            if stale_verdict is None:
+                raise
+            return self._serve_stale(stale_verdict, e)
+
+    def stats(self):
+        """Returns counters of the cache, coalesced calls and circuit
+        breaker.
+        @rtype: dict
+        @return: counter names and values
+        """
+        return {'cache': self.cache.stats() if self.cache else None,
+                'single_flight': self.single_flight.stats(),
+                'circuit_breaker': self.circuit_breaker.stats(),
+                'stale_served': self.stale_served}
+
+    def _log_stats(self):
+        """Logs the counters if stats_interval has passed since they were
+        last logged.
+        """
+        now = time.time()
+        with self._stats_lock:
+            if now < self._stats_logged_at + self.stats_interval:
+                return
+            self._stats_logged_at = now
+        stats = self.stats()
+        breaker = stats['circuit_breaker']
+        single_flight = stats['single_flight']
+        cache = stats['cache'] or {'hits': 0, 'misses': 0, 'size': 0}
+        log.info("%s: circuit breaker %s, opened %d times, %d checks "
+                 "rejected, %d slow; %d out of date verdicts served; cache "
+                 "%d hits, %d misses, %d entries; %d calls, %d checks "
+                 "waiting on another's call", self.__class__.__name__,
+                 breaker['state'], breaker['opened'], breaker['rejected'],
+                 breaker['slow_calls'], stats['stale_served'], cache['hits'],
+                 cache['misses'], cache['size'], single_flight['calls'],
+                 single_flight['shared'])
+
+    def _serve_stale(self, verdict, reason):
+        self.stale_served += 1
+        log.debug("Accepting token on an out of date verdict as %s", reason)
+        return verdict
+
+    def _check_token(self, key, token_id, scope):
+        """Checks a token through the circuit breaker and caches the verdict.
+        """
+        if not self.circuit_breaker.allow():
+            raise TokenValidatorError("Token checks are suspended after "
+                                      "repeated failures")
+        start_time = time.time()
+        success = False
+        try:
+            verdict, expires_at, max_age = self._validate(token_id, scope)
+            success = True
+        finally:
+            # Any error ends the call, including a half open breaker's trial.
+            now = time.time()
+            self.circuit_breaker.record(success, now - start_time)
+
+        if self.cache is None:
+            return verdict
+        if verdict[1] == httplib.OK:
+            fresh_until = min(now + self.cache_ttl, expires_at or 0)
+        elif verdict[1] == httplib.FORBIDDEN:
+            fresh_until = now + self.error_cache_ttl
+        else:
+            return verdict
+        if max_age is not None:
+            fresh_until = min(fresh_until, now + max_age)
+        # Only a valid token is accepted on an out of date verdict.
+        stale_until = fresh_until
+        if verdict[1] == httplib.OK:
+            stale_until = min(fresh_until + self.stale_grace, expires_at or 0)
+        if stale_until > now:
+            self.cache.put(key, (verdict, fresh_until), stale_until, None)
+        return verdict
+
+    def _validate(self, token_id, scope):
+        """Checks a token with the check_token service.
+        @type token_id: basestring
+        @param token_id: access token
+        @type scope: str
+        @param scope: required scope
+        @rtype: tuple: (tuple, float, int)
+        @return: tuple (
+                     verdict as returned by check_token
+                     time at which the token expires, or None if not valid
+                     maximum time for which the verdict may be cached, or
+                     None if not limited
+                 )
+        """
+        status, cache_control, body = self._request(token_id, scope)
+        try:
+            content_dict = json.loads(body)
+            verdict = (content_dict.get('user_name'),
+                       int(content_dict['status']),
+                       content_dict.get('error'))
+        except (ValueError, TypeError, KeyError, AttributeError):
+            raise TokenValidatorError("Invalid check_token response with "
+                                      "status %d: %r" % (status, body[:200]))
+
+        max_age = None
+        if cache_control:
+            match = self.MAX_AGE_PAT.search(cache_control)
+            if match:
+                max_age = int(match.group(1))
+        return verdict, content_dict.get('expires_at'), max_age
+
+    def _request(self, token_id, scope):
+        """Passes a token to the check_token service.
+        @type token_id: basestring
+        @param token_id: access token
+        @type scope: str
+        @param scope: required scope
+        @rtype: tuple: (int, str, str)
+        @return: tuple (HTTP status, Cache-Control header or None, body)
+        """
+        raise NotImplementedError()
+
+    def _request_body(self, token_id, scope):
+        params = {'access_token': token_id}
+        if scope:
+            params['scope'] = scope
+        return urllib.urlencode(params)
+
+
+class LocalTokenValidator(TokenValidator):
+    """
+    Validates tokens by reading the access token register of an
+    AuthorizationServer in this process, such as the one set in environ by
+    ndg.oauth.server.wsgi.oauth2_server.Oauth2ServerMiddleware.
+
+    By default verdicts are not cached, so that a revoked token is rejected
+    at once, and the circuit breaker is disabled, as reading the register is
+    not a call to another service.
+    """
+    ERROR_STATUS = {
+        'invalid_request': httplib.BAD_REQUEST,
+        'invalid_token': httplib.FORBIDDEN,
+        'insufficient_scope': httplib.FORBIDDEN
+    }
+
+    def __init__(self, authorization_server=None, cache_ttl=0,
+                 error_cache_ttl=0, stale_grace=0, failure_threshold=0, **kw):
+        """
+        @type authorization_server: ndg.oauth.server.lib.authorization_server.AuthorizationServer
+        @param authorization_server: authorization server, which may instead
+        be set later
+        @type kw: dict
+        @param kw: cache and circuit breaker options of TokenValidator
+        """
+        super(LocalTokenValidator, self).__init__(
+                                        cache_ttl=cache_ttl,
+                                        error_cache_ttl=error_cache_ttl,
+                                        stale_grace=stale_grace,
+                                        failure_threshold=failure_threshold,
+                                        **kw)
+        self.authorization_server = authorization_server
+
+    def _validate(self, token_id, scope):
+        if self.authorization_server is None:
+            raise TokenValidatorError("No authorization server is configured")
+        try:
+            token, error = \
+                self.authorization_server.access_token_register.get_token(
+                                                            token_id, scope)
+        except Exception, e:
+            log.exception("Error reading the access token register")
+            raise TokenValidatorError("Access token register lookup failed: "
+                                      "%s" % e)
+        if error:
+            return ((None, self.ERROR_STATUS.get(error, httplib.BAD_REQUEST),
+                     error), None, None)
+        return ((token.grant.additional_data.get('user_identifier'),
+                 httplib.OK, None), token.expires, None)
+
+
+class HTTPConnectionPool(object):
+    """
+    Pool of keep-alive connections to one HTTP or HTTPS server, shared by the
+    threads of a process. A request takes an idle connection or opens a new
+    one, and returns it to the pool when the response has been read. At most
+    max_idle connections are kept open.
+    """
+    def __init__(self, scheme, host, port=None, max_idle=10,
+                 connect_timeout=None, read_timeout=None, key_file=None,
+                 cert_file=None, ca_certs=None):
+        """
+        @type scheme: str
+        @param scheme: http or https
+        @type host: str
+        @param host: server host name
+        @type port: int
+        @param port: server port, or None for the scheme's default
+        @type max_idle: int
+        @param max_idle: maximum number of idle connections kept open
+        @type connect_timeout: float
+        @param connect_timeout: time in seconds to wait for a connection, or
+        None to use the socket default
+        @type read_timeout: float
+        @param read_timeout: time in seconds to wait for data from an open
+        connection, or None to use the socket default
+        @type key_file: str
+        @param key_file: private key file for a client certificate
+        @type cert_file: str
+        @param cert_file: client certificate file, with which the resource
+        server authenticates to the authorization server
+        @type ca_certs: str
+        @param ca_certs: file of CA certificates to verify the server with,
+        or None for the system default
+        """
+        if scheme == 'https':
+            self._connection_class = httplib.HTTPSConnection
+            if hasattr(ssl, 'create_default_context'):
+                context = ssl.create_default_context(cafile=ca_certs)
+                if cert_file:
+                    context.load_cert_chain(cert_file, key_file)
+                self._connection_args = {'context': context}
+            else:
+                # Before Python 2.7.9 server certificates are not verified.
+                log.warning("The certificate of %s cannot be verified with "
+                            "this version of Python", host)
+                self._connection_args = {'key_file': key_file,
+                                         'cert_file': cert_file}
+        elif scheme == 'http':
+            self._connection_class = httplib.HTTPConnection
+            self._connection_args = {}
+        else:
+            raise ValueError("Unsupported URL scheme %r" % scheme)
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def request(self, method, path, body=None, headers=None):
+        """Makes a request on a pooled connection. A request on an idle
+        connection that the server has meanwhile closed is retried on a new
+        one.
+        @rtype: tuple: (int, httplib.HTTPMessage, str)
+        @return: tuple (HTTP status, response headers, response body)
+        """
+        while True:
+            connection, reused = self._get()
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                    connection.sock.settimeout(self.read_timeout)
+                connection.request(method, path, body, headers or {})
+                response = connection.getresponse()
+                response_body = response.read()
+            except (socket.error, httplib.HTTPException), exc:
+                connection.close()
+                if reused and not isinstance(exc, socket.timeout):
+                    log.debug("Retrying request on closed connection to %s: "
+                              "%s", self.host, exc)
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._put(connection)
+            return response.status, response.msg, response_body
+
+    def close(self):
+        """Closes the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def _get(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connection_class(self.host, self.port,
+                                      timeout=self.connect_timeout,
+                                      **self._connection_args), False
+
+    def _put(self, connection):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+
+class RemoteTokenValidator(TokenValidator):
+    """
+    Validates tokens by calling the check_token service of an authorization
+    server in another process or on another host, over a pool of keep-alive
+    connections.
+    """
+    DEFAULT_CONNECT_TIMEOUT = 5
+    DEFAULT_READ_TIMEOUT = 10
+    DEFAULT_POOL_SIZE = 10
+
+    # Configuration options, with the types to which their values are cast
+    OPTIONS = dict(TokenValidator.OPTIONS,
+                   url=str,
+                   connect_timeout=float,
+                   read_timeout=float,
+                   pool_size=int,
+                   resource_id=str,
+                   resource_secret=str,
+                   key_file=str,
+                   cert_file=str,
+                   ca_certs=str)
+
+    def __init__(self, url, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT,
+                 pool_size=DEFAULT_POOL_SIZE, key_file=None, cert_file=None,
+                 ca_certs=None, **kw):
+        """
+        @type url: str
+        @param url: URL of the check_token service
+        @type connect_timeout: float
+        @param connect_timeout: time in seconds to wait for a connection
+        @type read_timeout: float
+        @param read_timeout: time in seconds to wait for a response
+        @type pool_size: int
+        @param pool_size: maximum number of idle connections kept open
+        @type key_file: str
+        @param key_file: private key file for cert_file
+        @type cert_file: str
+        @param cert_file: certificate with which to authenticate to the
+        authorization server, if it uses certificate authentication
+        @type ca_certs: str
+        @param ca_certs: file of CA certificates to verify the authorization
+        server with, or None for the system default
+        @type kw: dict
+        @param kw: resource authentication, cache and circuit breaker options
+        of TokenValidator
+        """
+        super(RemoteTokenValidator, self).__init__(**kw)
+        parsed_url = urlparse.urlsplit(url)
+        self.path = parsed_url.path or '/'
+        self.pool = HTTPConnectionPool(parsed_url.scheme, parsed_url.hostname,
+                                       parsed_url.port, max_idle=pool_size,
+                                       connect_timeout=connect_timeout,
+                                       read_timeout=read_timeout,
+                                       key_file=key_file, cert_file=cert_file,
+                                       ca_certs=ca_certs)
+
+    @classmethod
+    def from_config(cls, config):
+        if not config.get('url'):
+            raise ValueError("No check_token URL set")
+        return super(RemoteTokenValidator, cls).from_config(config)
+
+    def _request(self, token_id, scope):
+        headers = {'Content-Type': 'application/x-www-form-urlencoded',
+                   'Accept': 'application/json'}
+        if self.authorization:
+            headers['Authorization'] = self.authorization
+        try:
+            status, response_headers, body = self.pool.request(
+                        'POST', self.path, self._request_body(token_id, scope),
+                        headers)
+        except (socket.error, httplib.HTTPException), exc:
+            raise TokenValidatorError("check_token request to %s failed: %s" %
+                                      (self.pool.host, exc))
+        return status, response_headers.getheader('Cache-Control'), body
+
+
+class WsgiTokenValidator(TokenValidator):
+    """
+    Validates tokens by calling the check_token service of an authorization
+    server application in the same process, such as an
+    ndg.oauth.server.wsgi.oauth2_server.Oauth2ServerMiddleware. This stands
+    in for a remote authorization server in tests.
+    """
+    def __init__(self, app, path='/oauth/check_token', **kw):
+        """
+        @type app: callable
+        @param app: WSGI application serving check_token
+        @type path: str
+        @param path: path of the check_token service
+        @type kw: dict
+        @param kw: resource authentication, cache and circuit breaker options
+        of TokenValidator
+        """
+        super(WsgiTokenValidator, self).__init__(**kw)
+        self.app = app
+        self.path = path
+
+    def _request(self, token_id, scope):
+        request = Request.blank(self.path,
+                                POST=self._request_body(token_id, scope))
+        if self.authorization:
+            request.headers['Authorization'] = self.authorization
+        response = request.get_response(self.app)
+        return (response.status_int, response.headers.get('Cache-Control'),
+                response.body)
@@ -0,0 +1,79 @@
+"""OAuth 2.0 WSGI server middleware - unit tests
+
+Run with python -m unittest discover -s ndg/oauth/server/test -t .
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import fcntl
+import os
+import shutil
+import tempfile
+import unittest
+
+from ndg.oauth.server.lib.oauth.authorize import AuthorizeRequest
+from ndg.oauth.server.lib.register.access_token import AccessToken
+from ndg.oauth.server.lib.register.authorization_grant import \
+                                                        AuthorizationGrant
+
+
+def make_token(token_id, client_id='client1', user='user1', scope='read',
+               lifetime=3600, code=None):
+    """Returns an access token with its grant, as issued by the server."""
+    auth_request = AuthorizeRequest('code', client_id, None, scope, None)
+    grant = AuthorizationGrant(code or 'code-' + token_id[:16],
+                               auth_request, 600,
+                               additional_data={'user_identifier': user})
+    grant.granted = True
+    token = AccessToken(token_id, None, grant, 'bearer', lifetime)
+    grant.token = token
+    return token
+
+
+def lock_excludes_forked_process(lockable):
+    """Takes the file lock of an object, with its _lock method, in a process
+    forked from this one, and returns whether that stops this process from
+    taking the lock through the file descriptor it has open.
+    """
+    ready_read, ready_write = os.pipe()
+    done_read, done_write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(ready_read)
+            os.close(done_write)
+            lockable._lock()
+            os.write(ready_write, '1')
+            os.read(done_read, 1)
+        finally:
+            os._exit(0)
+
+    os.close(ready_write)
+    os.close(done_read)
+    try:
+        if os.read(ready_read, 1) != '1':
+            raise RuntimeError("Forked process failed to take the lock")
+        try:
+            fcntl.flock(lockable._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            return True
+        fcntl.flock(lockable._fd, fcntl.LOCK_UN)
+        return False
+    finally:
+        os.close(done_write)
+        os.close(ready_read)
+        os.waitpid(pid, 0)
+
+
+class TempDirTestCase(unittest.TestCase):
+    """Test case with a temporary directory, removed after each test."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='ndgoauthtest')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
@@ -0,0 +1,131 @@
+"""OAuth 2.0 WSGI server middleware - tests of access token checks
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import json
+import os
+
+from webob import Request
+
+from ndg.oauth.server.lib.authorization_server import AuthorizationServer
+from ndg.oauth.server.wsgi.oauth2_server import Oauth2ServerMiddleware
+from ndg.oauth.server.test import TempDirTestCase, make_token
+
+CLIENT_REGISTER = """[client_register]
+clients=
+"""
+
+RESOURCE_REGISTER = """[resource_register]
+resources=
+"""
+
+
+class CheckTokenTestCase(TempDirTestCase):
+    """Base class for tests of a server holding a token named after the
+    test.
+    """
+
+    def _make_server(self, **options):
+        local_conf = {'oauth2server.resource_authentication_method': 'none'}
+        for name, content in (('client_register', CLIENT_REGISTER),
+                              ('resource_register', RESOURCE_REGISTER)):
+            filename = os.path.join(self.tmp_dir, name + '.ini')
+            with open(filename, 'w') as config_file:
+                config_file.write(content)
+            local_conf['oauth2server.' + name] = filename
+        for register in ('accesstokenregister', 'authorizationgrantregister'):
+            local_conf['oauth2server.cache.%s.type' % register] = 'memory'
+        for name, value in options.iteritems():
+            local_conf['oauth2server.' + name] = value
+        server = Oauth2ServerMiddleware(None, {}, **local_conf)
+        self.authorization_server = server._authorizationServer
+        # Memory registers are shared by the tests in the process.
+        self.token_id = self.id().rsplit('.', 1)[-1]
+        self.authorization_server.access_token_register.add_token(
+                                                    make_token(self.token_id))
+        return server
+
+
+class BatchCheckTokenTestCase(CheckTokenTestCase):
+
+    def setUp(self):
+        super(BatchCheckTokenTestCase, self).setUp()
+        self._make_server()
+
+    def _check(self, items):
+        request = Request.blank(
+                        'https://localhost/check_token', method='POST',
+                        body=json.dumps(items),
+                        content_type=AuthorizationServer.BATCH_CONTENT_TYPE)
+        content, status = self.authorization_server.check_token(request)[:2]
+        self.assertEqual(status, 200)
+        return [(verdict['status'], verdict.get('error'))
+                for verdict in json.loads(content)]
+
+    def test_verdicts(self):
+        self.assertEqual(self._check([{'token': self.token_id},
+                                      {'token': self.token_id,
+                                       'scope': 'read'},
+                                      {'token': self.token_id,
+                                       'scope': 'write'},
+                                      {'token': 'unknown'},
+                                      {'scope': 'read'}]),
+                         [(200, None), (200, None),
+                          (400, 'insufficient_scope'), (403, 'invalid_token'),
+                          (400, 'invalid_request')])
+
+    def test_scope_must_be_a_string(self):
+        items = [{'token': self.token_id, 'scope': scope}
+                 for scope in (['read'], {}, 1)]
+        items.append({'token': self.token_id})
+        self.assertEqual(self._check(items),
+                         [(400, 'invalid_request')] * 3 + [(200, None)])
+
+
+class CheckTokenCacheTestCase(CheckTokenTestCase):
+
+    def _get(self, server, token_id):
+        return Request.blank('https://localhost/check_token?access_token=' +
+                             token_id).get_response(server)
+
+    def test_responses_are_not_stored_by_default(self):
+        server = self._make_server()
+        response = self._get(server, self.token_id)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+
+    def test_private_cache_scope(self):
+        server = self._make_server(check_token_max_age='60',
+                                   check_token_error_max_age='5')
+        response = self._get(server, self.token_id)
+        self.assertEqual(response.headers['Cache-Control'],
+                         'private, max-age=60')
+        self.assertFalse('Vary' in response.headers)
+        response = self._get(server, 'unknown')
+        self.assertEqual(response.status_int, 403)
+        self.assertEqual(response.headers['Cache-Control'],
+                         'private, max-age=5')
+
+    def test_public_cache_scope(self):
+        server = self._make_server(check_token_max_age='60',
+                                   check_token_cache_scope='public')
+        response = self._get(server, self.token_id)
+        self.assertEqual(response.headers['Cache-Control'],
+                         'public, max-age=60')
+        self.assertEqual(response.headers['Vary'], 'Authorization')
+
+        request = Request.blank(
+                    'https://localhost/check_token?access_token=' +
+                    self.token_id, if_none_match=response.headers['ETag'])
+        response = request.get_response(server)
+        self.assertEqual(response.status_int, 304)
+        self.assertEqual(response.headers['Vary'], 'Authorization')
+
+    def test_invalid_cache_scope(self):
+        self.assertRaises(ValueError, self._make_server,
+                          check_token_cache_scope='shared')
@@ -0,0 +1,112 @@
+"""OAuth 2.0 WSGI server middleware - tests of the compiled template renderer
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import glob
+import os
+
+from ndg.oauth.server.lib.render.compiled_renderer import (
+                                        CompiledRenderer,
+                                        find_value_dependent_parameters)
+from ndg.oauth.server.lib.render.genshi_renderer import GenshiRenderer
+from ndg.oauth.server.test import TempDirTestCase
+
+TEMPLATE = """<html xmlns:py="http://genshi.edgewall.org/">
+<body>%s</body>
+</html>
+"""
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                            'examples')
+
+
+class CompiledRendererTestCase(TempDirTestCase):
+
+    def _write(self, body):
+        # The loaders reload a changed template only once its modification
+        # time changes, so each template gets a file of its own.
+        filename = os.path.join(self.tmp_dir,
+                                'page%d.html' % len(os.listdir(self.tmp_dir)))
+        with open(filename, 'w') as template_file:
+            template_file.write(TEMPLATE % body)
+        return filename
+
+    def _check_renders(self, body, parameter_sets, compiled,
+                       markup_parameters=''):
+        """Renders a template with each set of parameters in turn, checking
+        the output against Genshi's, and whether pages after the first were
+        rendered from the compiled template.
+        """
+        filename = self._write(body)
+        renderer = CompiledRenderer(markup_parameters=markup_parameters)
+        genshi_renderer = GenshiRenderer()
+        for parameters in parameter_sets:
+            self.assertEqual(renderer.render(filename, parameters),
+                             genshi_renderer.render(filename, parameters))
+        self.assertEqual(renderer.compiled_renders,
+                         len(parameter_sets) - 1 if compiled else 0)
+
+    def test_values_are_inserted(self):
+        self._check_renders(
+                '<a href="${c.url}" py:if="c.name and not c.hidden">'
+                '${c.name}</a>',
+                [{'url': '/a', 'name': 'A', 'hidden': False},
+                 {'url': '/b?x=1&y="2"', 'name': u'<\xe9>', 'hidden': False}],
+                compiled=True)
+
+    def test_value_dependent_condition(self):
+        self._check_renders('<p py:if="c.x == \'y\'">yes</p><p>${c.x}</p>',
+                            [{'x': 'z'}, {'x': 'y'}, {'x': 'z'}],
+                            compiled=False)
+
+    def test_value_dependent_choice(self):
+        self._check_renders('<py:choose test="c.x">'
+                            '<p py:when="\'y\'">yes</p>'
+                            '<p py:otherwise="">no</p></py:choose>',
+                            [{'x': 'z'}, {'x': 'y'}], compiled=False)
+
+    def test_loop(self):
+        self._check_renders('<li py:for="item in c.entries">${item}</li>',
+                            [{'entries': ['a']}, {'entries': ['a', 'b']}],
+                            compiled=False)
+
+    def test_function_of_value(self):
+        self._check_renders('<p>${len(c.x)} ${c.x.upper()}</p>',
+                            [{'x': 'ab'}, {'x': 'abc'}], compiled=False)
+
+    def test_defined_function(self):
+        body = ('<a py:def="link(ref, text=None)" href="${ref}">${text}</a>'
+                '${link(c.url, text=c.name)}')
+        self._check_renders(body, [{'url': '/a', 'name': 'A'},
+                                   {'url': '/b', 'name': 'B'}],
+                            compiled=True)
+        self._check_renders(body.replace('${text}', '${text == \'A\'}'),
+                            [{'url': '/a', 'name': 'B'},
+                             {'url': '/b', 'name': 'A'}],
+                            compiled=False)
+
+    def test_markup_parameters(self):
+        body = '<?python from genshi import HTML ?><p>${HTML(c.footer)}</p>'
+        parameter_sets = [{'footer': u'<b>a</b>'}, {'footer': u'<i>b</i>'}]
+        self._check_renders(body, parameter_sets, compiled=True,
+                            markup_parameters='footer')
+        self._check_renders(body, parameter_sets, compiled=False)
+
+    def test_python_block(self):
+        self._check_renders('<?python n = len(c["x"]) ?><p>${n}</p>',
+                            [{'x': 'ab'}, {'x': 'abc'}], compiled=False)
+
+    def test_example_templates_are_compiled(self):
+        for template_dir in glob.glob(os.path.join(EXAMPLES_DIR, '*',
+                                                   'templates')):
+            renderer = CompiledRenderer()
+            for filename in glob.glob(os.path.join(template_dir, '*.html')):
+                template = renderer._load(filename)
+                self.assertEqual(find_value_dependent_parameters(
+                                        template, renderer.markup_parameters),
+                                 set(), filename)
@@ -0,0 +1,82 @@
+"""OAuth 2.0 WSGI server middleware - tests of the removal of expired entries
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import time
+import unittest
+
+from ndg.oauth.server.lib.register.expiry_sweeper import (ExpirySweeper,
+                                                          TimerWheel)
+from ndg.oauth.server.lib.register.register_base import RegisterBase
+from ndg.oauth.server.test import TempDirTestCase, make_token
+
+
+class TimerWheelTestCase(unittest.TestCase):
+
+    def test_keys_are_returned_once_due(self):
+        wheel = TimerWheel(now=1000)
+        wheel.add('a', 1005)
+        wheel.add('b', 1000 + 100000)
+        wheel.add('c', 999)
+        self.assertEqual(wheel.advance(1001), [('c', 999)])
+        self.assertEqual(wheel.advance(1004), [])
+        self.assertEqual(wheel.advance(1005), [('a', 1005)])
+        self.assertEqual(wheel.advance(1000 + 100001), [('b', 101000)])
+        self.assertEqual(wheel.size, 0)
+
+
+class RegisterExpiryTestCase(TempDirTestCase):
+
+    def _make_register(self, cache_type='file', **options):
+        config = {'cache.type': cache_type, 'cache.data_dir': self.tmp_dir}
+        config.update(options)
+        # Beaker keeps namespaces by name, including their data directory.
+        return RegisterBase(self.id().rsplit('.', 1)[-1], config)
+
+    def _add(self, register, token_id, lifetime):
+        token = make_token(token_id, lifetime=lifetime)
+        register.set_value(token_id, token)
+        return token
+
+    def _check_full_sweep(self, cache_type):
+        # Entries written by another process, which did not schedule them
+        # with this process's sweeper.
+        other = self._make_register(cache_type)
+        self._add(other, 'expired', -10)
+        self._add(other, 'valid', 3600)
+
+        register = self._make_register(cache_type)
+        sweeper = ExpirySweeper(register, 60, 1, 0)
+        self.assertEqual(sweeper.sweep(), 0)
+        self.assertEqual(sorted(register.keys()), ['expired', 'valid'])
+        self.assertEqual(sweeper.sweep_all(), 1)
+        self.assertEqual(register.keys(), ['valid'])
+        self.assertEqual(sweeper.stats()['full_sweeps'], 1)
+        self.assertEqual(sweeper.stats()['reclaimed'], 1)
+
+    def test_full_sweep_of_file_storage(self):
+        self._check_full_sweep('file')
+
+    def test_full_sweep_of_sqlite_storage(self):
+        self._check_full_sweep('sqlite')
+
+    def test_storage_expiry_is_used(self):
+        register = self._make_register(**{'cache.expire': '60'})
+        register.set_value('a', {'x': 1})
+        self.assertEqual(register.remove_expired(time.time() + 30), 0)
+        self.assertEqual(register.remove_expired(time.time() + 61), 1)
+        self.assertEqual(register.keys(), [])
+
+    def test_scheduled_entries_are_swept(self):
+        register = self._make_register()
+        sweeper = ExpirySweeper(register, 60, 500, 0)
+        token = self._add(register, 'a', 10)
+        sweeper.schedule('a', token.expires)
+        self.assertEqual(sweeper.sweep(), 0)
+        self.assertEqual(sweeper.sweep(token.expires + 1), 1)
+        self.assertEqual(register.keys(), [])
@@ -0,0 +1,84 @@
+"""OAuth 2.0 WSGI server middleware - tests of the exchange of authorization
+codes for access tokens
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+from ndg.oauth.server.lib.access_token.bearer_token_generator import \
+                                                        BearerTokenGenerator
+from ndg.oauth.server.lib.access_token.make_access_token import \
+                                                        make_access_token
+from ndg.oauth.server.lib.oauth.access_token import AccessTokenRequest
+from ndg.oauth.server.lib.oauth.authorize import AuthorizeRequest
+from ndg.oauth.server.lib.oauth.oauth_exception import OauthException
+from ndg.oauth.server.lib.register.access_token import AccessTokenRegister
+from ndg.oauth.server.lib.register.authorization_grant import (
+                                                AuthorizationGrant,
+                                                AuthorizationGrantRegister)
+from ndg.oauth.server.test import TempDirTestCase
+
+
+class _FailingGenerator(BearerTokenGenerator):
+    """Generator that fails to make the first access token requested."""
+
+    def __init__(self, *args):
+        super(_FailingGenerator, self).__init__(*args)
+        self.failed = False
+
+    def get_access_token(self, *args):
+        if not self.failed:
+            self.failed = True
+            return None
+        return super(_FailingGenerator, self).get_access_token(*args)
+
+
+class MakeAccessTokenTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super(MakeAccessTokenTestCase, self).setUp()
+        config = {}
+        for register in ('accesstokenregister', 'authorizationgrantregister'):
+            config['cache.%s.type' % register] = 'sqlite'
+            config['cache.%s.data_dir' % register] = self.tmp_dir
+        # Reused codes are revoked without the grant index.
+        config['cache.accesstokenregister.indexes'] = ''
+        self.token_register = AccessTokenRegister(config)
+        self.grant_register = AuthorizationGrantRegister(config)
+        auth_request = AuthorizeRequest('code', 'c1', None, 'read', None)
+        self.grant_register.add_grant(AuthorizationGrant('code1', auth_request,
+                                                         600))
+
+    def _request_token(self, generator=None):
+        return make_access_token(
+                    AccessTokenRequest('authorization_code', 'code1', None),
+                    'c1', self.token_register,
+                    generator or BearerTokenGenerator(3600, 'bearer'),
+                    self.grant_register, None)
+
+    def test_reused_code_revokes_token(self):
+        response = self._request_token()
+        self.assertEqual(
+                self.grant_register.get_value('code1').token.token_id,
+                response.access_token)
+        try:
+            self._request_token()
+        except OauthException, exc:
+            self.assertEqual(exc.error, 'invalid_grant')
+        else:
+            self.fail("Token issued for a reused code")
+        self.assertEqual(self.token_register.get_token(response.access_token,
+                                                       'read'),
+                         (None, 'invalid_token'))
+
+    def test_code_is_released_if_no_token_is_issued(self):
+        generator = _FailingGenerator(3600, 'bearer')
+        self.assertEqual(self._request_token(generator), None)
+        self.assertFalse(self.grant_register.get_value('code1').granted)
+        response = self._request_token(generator)
+        self.assertNotEqual(self.token_register.get_token(
+                                        response.access_token, 'read')[0],
+                            None)
@@ -0,0 +1,206 @@
+"""OAuth 2.0 WSGI server middleware - tests of memory-mapped token storage
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import time
+import uuid
+
+from ndg.oauth.server.lib.access_token.bearer_token_generator import \
+                                                        BearerTokenGenerator
+from ndg.oauth.server.lib.access_token.make_access_token import \
+                                                        make_access_token
+from ndg.oauth.server.lib.oauth.access_token import AccessTokenRequest
+from ndg.oauth.server.lib.oauth.authorize import AuthorizeRequest
+from ndg.oauth.server.lib.oauth.oauth_exception import OauthException
+from ndg.oauth.server.lib.register.access_token import AccessTokenRegister
+from ndg.oauth.server.lib.register.authorization_grant import (
+                                                AuthorizationGrant,
+                                                AuthorizationGrantRegister)
+from ndg.oauth.server.lib.register.mmap_token_store import (
+                                                MmapTokenStore,
+                                                TokenTableFullError)
+from ndg.oauth.server.test import (TempDirTestCase, make_token,
+                                   lock_excludes_forked_process)
+
+
+def _token_id():
+    return uuid.uuid4().hex
+
+
+class MmapTokenStoreTestCase(TempDirTestCase):
+    SLOTS = 16
+
+    def _make_store(self, slots=SLOTS):
+        return MmapTokenStore('test', {'cache.data_dir': self.tmp_dir,
+                                       'cache.slots': str(slots)})
+
+    def _put_tokens(self, store, count, lifetime=3600):
+        token_ids = [_token_id() for _ in xrange(count)]
+        for token_id in token_ids:
+            store.put(token_id, make_token(token_id, lifetime=lifetime))
+        return token_ids
+
+    def test_put_get(self):
+        store = self._make_store()
+        token = make_token(_token_id(), client_id='c1', user=u'\xe9',
+                           scope='read write')
+        token.valid = False
+        store.put(token.token_id, token)
+        stored = store.get(token.token_id)
+        self.assertEqual(stored.grant.client_id, 'c1')
+        self.assertEqual(stored.grant.additional_data['user_identifier'],
+                         u'\xe9')
+        self.assertEqual(stored.scope, ('read', 'write'))
+        self.assertEqual(stored.expires, token.expires)
+        self.assertFalse(stored.valid)
+        self.assertTrue(store.has_key(token.token_id))
+        self.assertEqual(store.keys(), [token.token_id])
+
+    def test_unknown_and_invalid_ids(self):
+        store = self._make_store()
+        self.assertRaises(KeyError, store.get, _token_id())
+        self.assertRaises(KeyError, store.get, 'not a token')
+        self.assertRaises(ValueError, store.put, 'x' * 32, make_token('x'))
+
+    def test_replace(self):
+        store = self._make_store()
+        token_id, = self._put_tokens(store, 1)
+        token = store.get(token_id)
+        token.valid = False
+        store.update_values({token_id: lambda value: token})
+        self.assertFalse(store.get(token_id).valid)
+        self.assertEqual(store.stats()['used'], 1)
+
+    def test_removal_leaves_deleted_slots(self):
+        store = self._make_store()
+        token_ids = self._put_tokens(store, 5)
+        store.remove_values(token_ids[:3])
+        stats = store.stats()
+        self.assertEqual((stats['used'], stats['deleted']), (2, 3))
+        for token_id in token_ids[:3]:
+            self.assertRaises(KeyError, store.get, token_id)
+        for token_id in token_ids[3:]:
+            self.assertEqual(store.get(token_id).token_id, token_id)
+
+    def test_deleted_slots_are_reclaimed(self):
+        store = self._make_store()
+        for _ in xrange(20):
+            store.remove_values(self._put_tokens(store, 5))
+        stats = store.stats()
+        self.assertTrue(stats['rebuilds'] > 0)
+        self.assertTrue(stats['used'] + stats['deleted'] <=
+                        store.rebuild_limit)
+        # A lookup of an unknown token finds an empty slot.
+        self.assertEqual(store._find('\0' * 16, store._map), None)
+
+    def test_full_table(self):
+        store = self._make_store()
+        token_ids = self._put_tokens(store, store.max_used)
+        self.assertRaises(TokenTableFullError, self._put_tokens, store, 1)
+        self.assertRaises(TokenTableFullError, self._put_tokens, store, 1)
+        for token_id in token_ids:
+            self.assertEqual(store.get(token_id).token_id, token_id)
+        # Space is made by removing tokens.
+        store.remove_values(token_ids[:2])
+        self._put_tokens(store, 2)
+
+    def test_expired_tokens_make_room(self):
+        store = self._make_store()
+        expired = self._put_tokens(store, store.max_used, lifetime=-1)
+        store._full_rebuild_at = 0
+        token_ids = self._put_tokens(store, store.max_used)
+        for token_id in expired:
+            self.assertRaises(KeyError, store.get, token_id)
+        for token_id in token_ids:
+            self.assertEqual(store.get(token_id).token_id, token_id)
+
+    def test_remove_expired(self):
+        store = self._make_store()
+        self._put_tokens(store, 3, lifetime=-1)
+        # Inserts may already have evicted expired tokens on their probe path.
+        used = store.stats()['used']
+        self.assertTrue(used >= 1)
+        self.assertEqual(store.remove_expired(), used)
+        self.assertEqual(store.stats()['used'], 0)
+        token_ids = self._put_tokens(store, 2)
+        self._put_tokens(store, 2, lifetime=-1)
+        store.remove_expired()
+        self.assertEqual(sorted(store.keys()), sorted(token_ids))
+        self.assertEqual(store.stats()['used'], 2)
+
+    def test_remove_expired_rebuilds_only_at_limit(self):
+        store = self._make_store()
+        self._put_tokens(store, 2)
+        expired = self._put_tokens(store, 2, lifetime=-1)
+        store.remove_expired()
+        stats = store.stats()
+        self.assertEqual((stats['used'], stats['rebuilds']), (2, 0))
+        self.assertRaises(KeyError, store.get, expired[0])
+        # Deleted slots reaching the limit are reclaimed.
+        self._put_tokens(store, 2, lifetime=-1)
+        stats = store.stats()
+        store.rebuild_limit = stats['used'] + stats['deleted']
+        store.remove_expired()
+        stats = store.stats()
+        self.assertEqual((stats['used'], stats['deleted'], stats['rebuilds']),
+                         (2, 0, 1))
+
+    def test_rebuild_is_seen_by_other_processes(self):
+        store1 = self._make_store()
+        store2 = self._make_store()
+        self._put_tokens(store1, 2, lifetime=-1)
+        token_ids = self._put_tokens(store1, 2)
+        store1._lock()
+        try:
+            store1._rebuild()
+        finally:
+            store1._unlock()
+        self.assertEqual(sorted(store2.keys()), sorted(token_ids))
+        token_id, = self._put_tokens(store2, 1)
+        self.assertEqual(store1.get(token_id).token_id, token_id)
+        store1.remove_values([token_id])
+        self.assertRaises(KeyError, store2.get, token_id)
+        self.assertEqual(store2.stats()['used'], 2)
+
+    def test_too_few_slots(self):
+        self.assertRaises(ValueError, self._make_store, 4)
+
+    def test_lock_excludes_forked_processes(self):
+        self.assertTrue(lock_excludes_forked_process(self._make_store()))
+
+
+class MmapTokenRegisterTestCase(TempDirTestCase):
+
+    def test_full_register_is_a_server_error(self):
+        config = {'cache.accesstokenregister.type': 'mmap',
+                  'cache.accesstokenregister.data_dir': self.tmp_dir,
+                  'cache.accesstokenregister.slots': '16',
+                  'cache.accesstokenregister.indexes': '',
+                  'cache.authorizationgrantregister.type': 'memory'}
+        token_register = AccessTokenRegister(config)
+        grant_register = AuthorizationGrantRegister(config)
+        generator = BearerTokenGenerator(3600, 'bearer')
+        auth_request = AuthorizeRequest('code', 'c1', None, 'read', None)
+
+        def request_token(code):
+            grant_register.add_grant(AuthorizationGrant(code, auth_request,
+                                                        600))
+            return make_access_token(
+                            AccessTokenRequest('authorization_code', code,
+                                               None),
+                            'c1', token_register, generator, grant_register,
+                            None)
+
+        for i in xrange(token_register.cache.max_used):
+            self.assertNotEqual(request_token('code%d' % i), None)
+        try:
+            request_token('last')
+        except OauthException, exc:
+            self.assertEqual(exc.error, 'server_error')
+        else:
+            self.fail("Token added to a full register")
@@ -0,0 +1,89 @@
+"""OAuth 2.0 WSGI server middleware - tests of the near-cache
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import os
+import time
+import unittest
+
+from ndg.oauth.server.lib.register.near_cache import (GenerationCounter,
+                                                      NearCache)
+from ndg.oauth.server.test import (TempDirTestCase,
+                                   lock_excludes_forked_process)
+
+
+class NearCacheTestCase(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = NearCache(10, 60, None)
+        self.assertEqual(cache.get('a'), None)
+        cache.put('a', 1, time.time() + 60, cache.snapshot())
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_expired_entry_is_not_returned(self):
+        cache = NearCache(10, 60, None)
+        cache.put('a', 1, time.time() - 1, cache.snapshot())
+        self.assertEqual(cache.get('a'), None)
+
+    def test_ttl_bounds_expiry(self):
+        cache = NearCache(10, 0, None)
+        cache.put('a', 1, time.time() + 60, cache.snapshot())
+        self.assertEqual(cache.get('a'), None)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = NearCache(2, 60, None)
+        expires = time.time() + 60
+        cache.put('a', 1, expires, None)
+        cache.put('b', 2, expires, None)
+        cache.get('a')
+        cache.put('c', 3, expires, None)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_invalidate(self):
+        cache = NearCache(10, 60, None)
+        cache.put('a', 1, time.time() + 60, None)
+        cache.invalidate()
+        self.assertEqual(cache.get('a'), None)
+
+
+class SharedNearCacheTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super(SharedNearCacheTestCase, self).setUp()
+        self.filename = os.path.join(self.tmp_dir, 'near_cache.generation')
+
+    def test_invalidation_is_seen_by_other_caches(self):
+        cache1 = NearCache(10, 60, GenerationCounter(self.filename))
+        cache2 = NearCache(10, 60, GenerationCounter(self.filename))
+        expires = time.time() + 60
+        cache1.put('a', 1, expires, cache1.snapshot())
+        cache2.put('a', 1, expires, cache2.snapshot())
+        cache1.invalidate()
+        self.assertEqual(cache1.get('a'), None)
+        self.assertEqual(cache2.get('a'), None)
+
+    def test_value_read_before_invalidation_is_not_cached(self):
+        cache1 = NearCache(10, 60, GenerationCounter(self.filename))
+        cache2 = NearCache(10, 60, GenerationCounter(self.filename))
+        generation = cache2.snapshot()
+        cache1.invalidate()
+        cache2.put('a', 1, time.time() + 60, generation)
+        self.assertEqual(cache2.get('a'), None)
+
+    def test_counter_is_kept_in_file(self):
+        GenerationCounter(self.filename).increment()
+        self.assertEqual(GenerationCounter(self.filename).value, 1)
+
+    def test_lock_excludes_forked_processes(self):
+        counter = GenerationCounter(self.filename)
+        self.assertTrue(lock_excludes_forked_process(counter))
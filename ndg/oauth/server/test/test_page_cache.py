@@ -0,0 +1,123 @@
+"""OAuth 2.0 WSGI server middleware - tests of the rendered page cache
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import os
+
+from ndg.oauth.server.lib.render.page_cache import RenderedPageCache
+from ndg.oauth.server.test import TempDirTestCase
+
+
+def _escape(value, quote=False):
+    value = (value.replace('&', '&amp;').replace('<', '&lt;')
+             .replace('>', '&gt;'))
+    if quote:
+        value = value.replace('"', '&#34;')
+    return value
+
+
+class _Renderer(object):
+    """Renders a form as a template for the login page would."""
+    auto_reload = False
+
+    def __init__(self):
+        self.renders = 0
+
+    def render(self, filename, parameters):
+        self.renders += 1
+        page = u'<form action="%s"><p>%s</p>' % (
+                            _escape(parameters['submit_url'], True),
+                            _escape(unicode(parameters['client_name'])))
+        if parameters.get('return_url'):
+            page += u'<input value="%s"/>' % _escape(parameters['return_url'],
+                                                     True)
+        return page + u'</form>'
+
+
+class _LengthRenderer(_Renderer):
+    """Renders a page that depends on more than the inserted values."""
+
+    def render(self, filename, parameters):
+        self.renders += 1
+        return u'<p>%d</p>' % len(parameters['submit_url'])
+
+
+class RenderedPageCacheTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super(RenderedPageCacheTestCase, self).setUp()
+        self.renderer = _Renderer()
+        self.page_cache = RenderedPageCache(self.renderer,
+                                            ['submit_url', 'return_url'])
+
+    def _parameters(self, submit_url, client_name='Client', return_url=''):
+        return {'submit_url': submit_url, 'client_name': client_name,
+                'return_url': return_url}
+
+    def _render(self, parameters):
+        return self.page_cache.render('login.html', parameters)
+
+    def test_holes_are_filled_and_escaped(self):
+        for submit_url in ('/a', '/b?x=1&y="2"', u'/\xe9<'):
+            parameters = self._parameters(submit_url, return_url='/r&')
+            self.assertEqual(
+                    self._render(parameters),
+                    _Renderer().render('login.html', parameters
+                                       ).encode('utf-8'))
+        # The page with markers, and the first page to check it against
+        self.assertEqual(self.renderer.renders, 2)
+        self.assertEqual(self.page_cache.stats()['size'], 1)
+
+    def test_other_values_are_cached_separately(self):
+        self._render(self._parameters('/a', client_name='One'))
+        self.assertEqual(self._render(self._parameters('/b',
+                                                       client_name='Two')),
+                         '<form action="/b"><p>Two</p></form>')
+        self.assertEqual(self.page_cache.stats()['size'], 2)
+
+    def test_unset_holes_are_part_of_the_key(self):
+        self._render(self._parameters('/a'))
+        self.assertEqual(self._render(self._parameters('/a', return_url='/r')),
+                         '<form action="/a"><p>Client</p>'
+                         '<input value="/r"/></form>')
+        self.assertEqual(self.page_cache.stats()['size'], 2)
+
+    def test_page_that_cannot_be_cached(self):
+        renderer = _LengthRenderer()
+        page_cache = RenderedPageCache(renderer, ['submit_url'])
+        self.assertEqual(page_cache.render('x.html', {'submit_url': '/ab'}),
+                         '<p>3</p>')
+        self.assertEqual(page_cache.render('x.html', {'submit_url': '/a'}),
+                         '<p>2</p>')
+        self.assertEqual(page_cache.stats()['uncacheable'], 2)
+
+    def test_unhashable_value_is_not_cached(self):
+        parameters = self._parameters('/a')
+        parameters['client_name'] = ['x']
+        self._render(parameters)
+        self.assertEqual(self.page_cache.stats()['uncacheable'], 1)
+
+    def test_disabled(self):
+        page_cache = RenderedPageCache(self.renderer, ['submit_url'],
+                                       max_size=0)
+        page_cache.render('login.html', self._parameters('/a'))
+        page_cache.render('login.html', self._parameters('/a'))
+        self.assertEqual(self.renderer.renders, 2)
+
+    def test_change_of_watched_file_discards_pages(self):
+        filename = os.path.join(self.tmp_dir, 'client_register.ini')
+        open(filename, 'w').close()
+        page_cache = RenderedPageCache(self.renderer, ['submit_url'],
+                                       check_interval=0,
+                                       watch_files=[filename, None])
+        page_cache.render('login.html', self._parameters('/a'))
+        self.assertEqual(page_cache.stats()['size'], 1)
+        mtime = os.stat(filename).st_mtime
+        os.utime(filename, (mtime + 10, mtime + 10))
+        page_cache.render('login.html', self._parameters('/a'))
+        self.assertEqual(page_cache.stats()['invalidations'], 1)
@@ -0,0 +1,88 @@
+"""OAuth 2.0 WSGI server middleware - tests of path matching
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import random
+import re
+import unittest
+
+from ndg.oauth.server.lib.path_matcher import PathMatcher
+
+
+def _first_match(entries, path):
+    """Matches as PathMatcher should: each pattern in turn."""
+    for entry in entries:
+        if entry[0].match(path):
+            return entry
+    return None
+
+
+class PathMatcherTestCase(unittest.TestCase):
+
+    def _check(self, patterns, paths):
+        entries = [(re.compile(pattern), i)
+                   for i, pattern in enumerate(patterns)]
+        matcher = PathMatcher(entries)
+        for path in paths:
+            self.assertEqual(matcher.match(path), _first_match(entries, path),
+                             path)
+        return matcher
+
+    def test_first_match_wins(self):
+        matcher = self._check(['/a/b', '/a', '/a/b/c', '.*', '/a/b/c/d'],
+                              ['/a/b/c/d', '/a/b', '/a/x', '/x', ''])
+        self.assertEqual(matcher.match('/a/b/c')[1], 0)
+
+    def test_later_longer_prefix_does_not_win(self):
+        matcher = self._check(['/a', '/a/b'], ['/a/b'])
+        self.assertEqual(matcher.match('/a/b')[1], 0)
+
+    def test_catch_all_first(self):
+        matcher = self._check(['.*', '/a'], ['/a', '/b'])
+        self.assertEqual(matcher.match('/a')[1], 0)
+
+    def test_no_match(self):
+        matcher = self._check(['/a', '/b/.*'], ['/c', '/b'])
+        self.assertEqual(matcher.match('/c'), None)
+
+    def test_uncombinable_patterns_keep_their_place(self):
+        self._check([r'/(x)\1', '/x', r'(?i)/A', '/a', r'/(?P<n>y)(?P=n)',
+                     '/y'],
+                    ['/xx', '/x', '/a', '/A', '/yy', '/y'])
+        entries = [(re.compile('/A', re.I), 0), (re.compile('/a'), 1)]
+        self.assertEqual(PathMatcher(entries).match('/a')[1], 0)
+
+    def test_patterns_with_groups(self):
+        self._check(['/(a|b)/(c)', '/a/(c|d)', '/(?P<x>b)/d', '/(?P<x>a)'],
+                    ['/a/c', '/a/d', '/b/d', '/a', '/b/c'])
+
+    def test_many_patterns(self):
+        patterns = ['/p/(%d)/(x)?' % i for i in xrange(150)] + ['/p/.*']
+        self._check(patterns, ['/p/%d/' % i for i in xrange(0, 160, 7)])
+
+    def test_random_patterns(self):
+        rand = random.Random(1)
+        parts = ['a', 'b', 'ab', '.*', '[ab]', 'a?', '(a|b)', '\\.', 'b+']
+        patterns = ['/' + ''.join(rand.choice(parts) for _ in xrange(3))
+                    for _ in xrange(60)]
+        paths = ['/' + ''.join(rand.choice('ab.') for _ in xrange(4))
+                 for _ in xrange(200)]
+        self._check(patterns, paths)
+
+    def test_literal_prefix(self):
+        for pattern, prefix in (('/a/b', '/a/b'),
+                                ('^/a/b', '/a/b'),
+                                ('/a/b.*', '/a/b'),
+                                ('/ab?', '/a'),
+                                ('/a\\.b', '/a.b'),
+                                ('/a\\d', '/a'),
+                                ('/a|/b', ''),
+                                ('/a{2}', '/'),
+                                ('(?i)/a', '')):
+            self.assertEqual(PathMatcher.literal_prefix(re.compile(pattern)),
+                             prefix, pattern)
@@ -0,0 +1,188 @@
+"""OAuth 2.0 WSGI server middleware - tests of the combined filter, against
+the filters it combines stacked as separate filters
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import os
+import urllib
+
+from webob import Request
+
+from ndg.oauth.server.wsgi.authentication_filter import \
+    AuthenticationFormMiddleware
+from ndg.oauth.server.wsgi.authorization_filter import \
+    Oauth2AuthorizationMiddleware
+from ndg.oauth.server.wsgi.oauth2_server import Oauth2ServerMiddleware
+from ndg.oauth.server.wsgi.pipeline import Oauth2PipelineMiddleware
+from ndg.oauth.server.wsgi.resource_server import \
+    Oauth2ResourceServerMiddleware
+from ndg.oauth.server.test import TempDirTestCase, make_token
+
+CLIENT_REGISTER = """[client_register]
+clients=test
+
+[client:test]
+name=test
+id=11
+type=confidential
+redirect_uris=https://localhost/client/redirect_target
+authentication_data=/CN=localhost
+"""
+
+RESOURCE_REGISTER = """[resource_register]
+resources=
+"""
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                             'examples', 'bearer_tok', 'templates')
+
+SESSION_KEY = 'beaker.session.oauth2authorization'
+CLIENT_AUTHORIZATIONS_KEY = 'client_authorizations'
+CLAIMED_USER_KEY = \
+    Oauth2ResourceServerMiddleware.DEFAULT_CLAIMED_USER_ID_ENVIRON_KEYNAME
+
+
+class _Session(dict):
+    """Stands in for a Beaker session."""
+
+    def save(self):
+        pass
+
+    def persist(self):
+        pass
+
+
+def _app(environ, start_response):
+    """Application showing what the filters set in environ."""
+    response = 'app'
+    start_response('200 OK', [
+        ('Content-type', 'text/plain'),
+        ('Content-length', str(len(response))),
+        ('X-Client-Authorizations',
+         str(CLIENT_AUTHORIZATIONS_KEY in environ)),
+        ('X-Claimed-User', str(environ.get(CLAIMED_USER_KEY)))
+    ])
+    return [response]
+
+
+class PipelineTestCase(TempDirTestCase):
+
+    def _make_conf(self, resource_authentication_method):
+        conf = {
+            'authenticationForm.base_url_path': '/authentication',
+            'authenticationForm.login_form':
+                os.path.join(TEMPLATES_DIR, 'login_form.html'),
+            'authenticationForm.login_cancelled':
+                os.path.join(TEMPLATES_DIR, 'login_cancelled.html'),
+            'oauth2authorization.base_url_path': '/client_authorization',
+            'oauth2authorization.client_authorization_form':
+                os.path.join(TEMPLATES_DIR, 'auth_client_form.html'),
+            'oauth2authorization.exclude_paths': '^/static/',
+            'oauth2server.base_url_path': '/oauth',
+            'oauth2server.resource_authentication_method':
+                resource_authentication_method,
+            'oauth2.resource_server.resource_uripaths': '^/resource/',
+            'oauth2.resource_server.resource_uripath_scopes':
+                '^/resource/admin admin',
+            'oauth2.resource_server.required_scope': 'read'
+        }
+        for name, content in (('client_register', CLIENT_REGISTER),
+                              ('resource_register', RESOURCE_REGISTER)):
+            filename = os.path.join(self.tmp_dir, name + '.ini')
+            with open(filename, 'w') as config_file:
+                config_file.write(content)
+            for prefix in ('authenticationForm.', 'oauth2authorization.',
+                           'oauth2server.'):
+                conf[prefix + name] = filename
+        for register in ('accesstokenregister', 'authorizationgrantregister'):
+            conf['oauth2server.cache.%s.type' % register] = 'memory'
+        return conf
+
+    def _make_apps(self, resource_authentication_method='none'):
+        """Returns the combined filter and the stacked filters, each wrapping
+        the same application."""
+        conf = self._make_conf(resource_authentication_method)
+        pipeline = Oauth2PipelineMiddleware(_app, {}, **conf)
+        stacked = Oauth2ResourceServerMiddleware.filter_app_factory(
+                                                            _app, {}, **conf)
+        stacked = Oauth2ServerMiddleware(stacked, {}, **conf)
+        stacked = Oauth2AuthorizationMiddleware(stacked, {}, **conf)
+        stacked = AuthenticationFormMiddleware(stacked, {}, **conf)
+        return pipeline, stacked
+
+    def _check_same(self, apps, path, **kw):
+        """Makes a request of both the combined and the stacked filters,
+        checking that their responses are the same, and returns the
+        response."""
+        responses = []
+        for app in apps:
+            request = Request.blank('https://localhost' + path, **kw)
+            request.environ[SESSION_KEY] = _Session()
+            responses.append(request.get_response(app))
+        pipeline_response, stacked_response = responses
+        self.assertEqual(pipeline_response.status, stacked_response.status,
+                         path)
+        self.assertEqual(sorted(pipeline_response.headerlist),
+                         sorted(stacked_response.headerlist), path)
+        self.assertEqual(pipeline_response.body, stacked_response.body, path)
+        return pipeline_response
+
+    def test_action_routes(self):
+        apps = self._make_apps()
+        token_id = self.id().rsplit('.', 1)[-1]
+        apps[0]._authorization_server.access_token_register.add_token(
+                                                        make_token(token_id))
+        authorize_params = urllib.urlencode({
+                    'response_type': 'code', 'client_id': '11',
+                    'redirect_uri': 'https://localhost/client/redirect_target',
+                    'scope': 'read'})
+        for path in ('/oauth/check_token?access_token=' + token_id,
+                     '/oauth/check_token?access_token=unknown',
+                     '/oauth/authorize?' + authorize_params,
+                     '/oauth/authorize?client_id=unknown',
+                     '/client_authorization/authorize?client_id=11&scope=read',
+                     '/client_authorization/client_auth',
+                     '/authentication/login_form?returnurl=' +
+                     urllib.quote('/oauth/authorize?' + authorize_params)):
+            self.assertNotEqual(self._check_same(apps, path).body, 'app',
+                                path)
+        # Action paths outside their filter's base path are not routed.
+        for path in ('/check_token', '/authorize', '/login_form',
+                     '/oauth/client_auth', '/oauth/check_token/'):
+            self.assertEqual(self._check_same(apps, path).body, 'app', path)
+
+    def test_exclude_paths(self):
+        apps = self._make_apps()
+        response = self._check_same(apps, '/static/style.css')
+        self.assertEqual(response.headers['X-Client-Authorizations'], 'False')
+        response = self._check_same(apps, '/page.html')
+        self.assertEqual(response.headers['X-Client-Authorizations'], 'True')
+
+    def test_resource_scopes(self):
+        apps = self._make_apps()
+        token_id = self.id().rsplit('.', 1)[-1]
+        apps[0]._authorization_server.access_token_register.add_token(
+                                        make_token(token_id, scope='read'))
+        headers = {'Authorization': 'Bearer ' + token_id}
+        response = self._check_same(apps, '/resource/a', headers=headers)
+        self.assertEqual(response.headers['X-Claimed-User'], 'user1')
+        response = self._check_same(apps, '/resource/admin', headers=headers)
+        self.assertEqual(response.json['error'], 'insufficient_scope')
+        response = self._check_same(apps, '/resource/a')
+        self.assertEqual(response.json['error'], 'invalid_request')
+        response = self._check_same(apps, '/resource/a',
+                                    headers={'Authorization': 'Bearer x'})
+        self.assertEqual(response.json['error'], 'invalid_token')
+
+    def test_revoke_needs_resource_authentication(self):
+        apps = self._make_apps('none')
+        self.assertEqual(self._check_same(apps, '/oauth/revoke',
+                                          method='POST').body, 'app')
+        apps = self._make_apps('password')
+        self.assertNotEqual(self._check_same(apps, '/oauth/revoke',
+                                             method='POST').body, 'app')
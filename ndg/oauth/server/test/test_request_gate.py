@@ -0,0 +1,94 @@
+"""OAuth 2.0 WSGI server middleware - tests of the filter rejecting malformed
+authorize and access token requests
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import logging
+import os
+
+from webob import Request
+
+from ndg.oauth.server.wsgi.request_gate import Oauth2RequestGateMiddleware
+from ndg.oauth.server.test import TempDirTestCase
+
+CLIENT_REGISTER = """[client_register]
+clients=test
+
+[client:test]
+name=test
+id=11
+type=confidential
+redirect_uris=https://localhost/client/redirect_target
+authentication_data=/CN=localhost
+"""
+
+
+def _app(environ, start_response):
+    start_response('200 OK', [('Content-type', 'text/plain')])
+    return ['app']
+
+
+class RequestGateTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super(RequestGateTestCase, self).setUp()
+        filename = os.path.join(self.tmp_dir, 'client_register.ini')
+        with open(filename, 'w') as config_file:
+            config_file.write(CLIENT_REGISTER)
+        self.gate = Oauth2RequestGateMiddleware(
+                            _app, {},
+                            **{'oauth2requestgate.base_url_path': '/oauth',
+                               'oauth2requestgate.client_register': filename})
+
+    def _access_token(self, body, url='https://localhost/oauth/access_token',
+                      method='POST'):
+        response = Request.blank(url, method=method,
+                                 body=body).get_response(self.gate)
+        if response.body == 'app':
+            return None
+        return response.json['error_description']
+
+    def test_access_token_checks(self):
+        self.assertEqual(self._access_token('grant_type=authorization_code&'
+                                            'code=c1'), None)
+        self.assertEqual(self._access_token('grant_type=authorization_code'),
+                         'Missing request parameter: code')
+        self.assertEqual(self._access_token('grant_type=authorization_code&'
+                                            'code=c1&code=c2'),
+                         'Parameter "code" is repeated.')
+        self.assertEqual(self._access_token('', method='GET'),
+                         'HTTP POST method must be used for this request.')
+        # The scheme is checked before the parameters.
+        self.assertEqual(
+                    self._access_token('code=c1&code=c2',
+                                       url='http://localhost/oauth/'
+                                           'access_token'),
+                    'Transport layer security must be used for this request.')
+        self.assertEqual(self.gate.rejected, 4)
+
+    def test_authorize_errors_are_logged_as_such(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('ndg.oauth.server.wsgi.request_gate')
+        logger.addHandler(handler)
+        level = logger.level
+        logger.setLevel(logging.DEBUG)
+        try:
+            response = Request.blank(
+                    'https://localhost/oauth/authorize?client_id=unknown'
+                    ).get_response(self.gate)
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+        self.assertEqual(response.status_int, 400)
+        self.assertEqual(
+                [record.getMessage() for record in records
+                 if record.getMessage().startswith('Rejecting')],
+                ['Rejecting authorize request: unauthorized_client - Client '
+                 'of id "unknown" is not registered.'])
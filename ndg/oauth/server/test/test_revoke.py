@@ -0,0 +1,104 @@
+"""OAuth 2.0 WSGI server middleware - tests of access token revocation
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import base64
+import json
+import os
+
+from webob import Request
+
+from ndg.oauth.server.wsgi.oauth2_server import Oauth2ServerMiddleware
+from ndg.oauth.server.test import TempDirTestCase, make_token
+
+CLIENT_REGISTER = """[client_register]
+clients=
+"""
+
+RESOURCE_REGISTER = """[resource_register]
+resources=r1
+
+[resource:r1]
+name=resource 1
+id=r1
+secret=secret1
+"""
+
+
+class RevokeTestCase(TempDirTestCase):
+
+    def _make_server(self, resource_authentication_method):
+        filenames = {}
+        for name, content in (('client_register', CLIENT_REGISTER),
+                              ('resource_register', RESOURCE_REGISTER)):
+            filenames[name] = os.path.join(self.tmp_dir, name + '.ini')
+            with open(filenames[name], 'w') as config_file:
+                config_file.write(content)
+        local_conf = {
+            'oauth2server.client_register': filenames['client_register'],
+            'oauth2server.resource_register': filenames['resource_register'],
+            'oauth2server.resource_authentication_method':
+                                            resource_authentication_method,
+            'oauth2server.cache.accesstokenregister.indexes': 'user'
+            }
+        for register in ('accesstokenregister', 'authorizationgrantregister'):
+            local_conf['oauth2server.cache.%s.type' % register] = 'memory'
+        server = Oauth2ServerMiddleware(None, {}, **local_conf)
+        self.register = server._authorizationServer.access_token_register
+        # Memory registers are shared by the tests in the process.
+        self.user = self.id().rsplit('.', 1)[-1]
+        self.token_ids = [self.user + '-1', self.user + '-2']
+        for token_id in self.token_ids:
+            self.register.add_token(make_token(token_id, user=self.user))
+        return server
+
+    @staticmethod
+    def _request(params):
+        return Request.blank('https://localhost/revoke', POST=params)
+
+    def _revoke(self, server, credentials=None, **params):
+        request = self._request(params)
+        if credentials:
+            request.headers['Authorization'] = (
+                                'Basic ' + base64.b64encode(credentials))
+        response = request.get_response(server)
+        return response.status_int, json.loads(response.body)
+
+    def _all_valid(self):
+        return all(self.register.get_token(token_id, 'read')[0] is not None
+                   for token_id in self.token_ids)
+
+    def test_authenticated_resource_revokes(self):
+        server = self._make_server('password')
+        status, content = self._revoke(server, 'r1:secret1', user=self.user)
+        self.assertEqual(status, 200)
+        self.assertEqual(content['revoked'], 2)
+        self.assertEqual(self.register.get_token(self.token_ids[0], 'read'),
+                         (None, 'invalid_token'))
+
+    def test_unauthenticated_requests_are_rejected(self):
+        server = self._make_server('password')
+        for credentials in (None, 'r1:wrong', 'other:secret1'):
+            status, content = self._revoke(server, credentials,
+                                           access_token=self.token_ids[0],
+                                           user=self.user)
+            self.assertEqual(status, 401)
+            self.assertEqual(content['error'], 'invalid_resource')
+        self.assertTrue(self._all_valid())
+
+    def test_anonymous_revocation_is_rejected(self):
+        server = self._make_server('none')
+        params = {'user': self.user}
+        self.assertEqual(self._request(params).get_response(server).status_int,
+                         404)
+        # Nor does the authorization server accept it if called directly.
+        content, status = server._authorizationServer.revoke_tokens(
+                                                    self._request(params))[:2]
+        self.assertEqual(status, 401)
+        self.assertEqual(json.loads(content)['error'], 'invalid_client')
+        self.assertTrue(self._all_valid())
@@ -0,0 +1,103 @@
+"""OAuth 2.0 WSGI server middleware - tests of signed access tokens
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import base64
+import json
+import unittest
+
+from ndg.oauth.server.lib.access_token.signed_token import SigningKeys
+from ndg.oauth.server.test import make_token
+
+OLD_SECRET = 'old secret of 16 bytes or more'
+NEW_SECRET = 'new secret of 16 bytes or more'
+
+
+class SigningKeysTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.keys = SigningKeys([('k1', OLD_SECRET)])
+        self.token = make_token('jti1', client_id='c1', user='u1',
+                                scope='read write')
+        self.signed = self.keys.encode(self.token)
+
+    def test_round_trip(self):
+        self.assertTrue(self.keys.is_signed(self.signed))
+        payload = self.keys.decode(self.signed)
+        self.assertEqual(payload['jti'], 'jti1')
+        self.assertEqual(payload['cid'], 'c1')
+        self.assertEqual(payload['sub'], 'u1')
+        self.assertEqual(payload['exp'], self.token.expires)
+        token = self.keys.make_token(self.signed, payload)
+        self.assertEqual(token.token_id, self.signed)
+        self.assertEqual(token.grant.client_id, 'c1')
+        self.assertEqual(token.grant.additional_data['user_identifier'], 'u1')
+        self.assertEqual(token.scope, ('read', 'write'))
+        self.assertEqual(token.expires, self.token.expires)
+
+    def test_unicode_token(self):
+        self.assertNotEqual(self.keys.decode(unicode(self.signed)), None)
+        self.assertEqual(self.keys.decode(u'k1.\xe9.x'), None)
+
+    def test_tampered_payload_is_rejected(self):
+        key_id, payload, signature = self.signed.split('.')
+        claims = json.loads(base64.urlsafe_b64decode(
+                                payload + '=' * (-len(payload) % 4)))
+        claims['exp'] += 3600
+        payload = base64.urlsafe_b64encode(json.dumps(claims)).rstrip('=')
+        self.assertEqual(
+                    self.keys.decode('.'.join((key_id, payload, signature))),
+                    None)
+
+    def test_tampered_signature_is_rejected(self):
+        signature = self.signed[-1]
+        tampered = self.signed[:-1] + ('A' if signature != 'A' else 'B')
+        self.assertEqual(self.keys.decode(tampered), None)
+        self.assertEqual(self.keys.decode(self.signed[:-1]), None)
+
+    def test_key_id_cannot_be_swapped(self):
+        other_keys = SigningKeys([('k2', OLD_SECRET), ('k1', NEW_SECRET)])
+        tampered = 'k2' + self.signed[2:]
+        self.assertEqual(other_keys.decode(tampered), None)
+
+    def test_malformed_tokens_are_rejected(self):
+        for token_id in ('', 'abc', 'a.b', 'a.b.c.d', 'k1..', 'k9.a.b'):
+            self.assertEqual(self.keys.decode(token_id), None)
+
+    def test_key_rotation(self):
+        rotated = SigningKeys([('k2', NEW_SECRET), ('k1', OLD_SECRET)])
+        self.assertNotEqual(rotated.decode(self.signed), None)
+        new_signed = rotated.encode(self.token)
+        self.assertTrue(new_signed.startswith('k2.'))
+        self.assertEqual(self.keys.decode(new_signed), None)
+
+        retired = SigningKeys([('k2', NEW_SECRET)])
+        self.assertEqual(retired.decode(self.signed), None)
+        self.assertNotEqual(retired.decode(new_signed), None)
+
+    def test_same_key_id_with_other_secret_is_rejected(self):
+        other_keys = SigningKeys([('k1', NEW_SECRET)])
+        self.assertEqual(other_keys.decode(self.signed), None)
+
+    def test_invalid_keys(self):
+        self.assertRaises(ValueError, SigningKeys, [])
+        self.assertRaises(ValueError, SigningKeys, [('k1', 'short')])
+        self.assertRaises(ValueError, SigningKeys, [('k.1', OLD_SECRET)])
+        self.assertRaises(ValueError, SigningKeys, [('', OLD_SECRET)])
+
+    def test_from_string(self):
+        keys = SigningKeys.from_string('k2:%s k1:%s' % (
+                                            base64.b64encode(NEW_SECRET),
+                                            base64.b64encode(OLD_SECRET)))
+        self.assertEqual(keys.current_key_id, 'k2')
+        self.assertNotEqual(keys.decode(self.signed), None)
+        self.assertRaises(ValueError, SigningKeys.from_string, 'k1')
+        self.assertRaises(ValueError, SigningKeys.from_string, 'k1:!!!')
+
+    def test_incomplete_payload(self):
+        self.assertEqual(self.keys.make_token(self.signed, {'jti': 'x'}), None)
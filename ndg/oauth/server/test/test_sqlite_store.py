@@ -0,0 +1,113 @@
+"""OAuth 2.0 WSGI server middleware - tests of SQLite register storage
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import time
+
+from ndg.oauth.server.lib.register.access_token import AccessTokenRegister
+from ndg.oauth.server.lib.register.sqlite_store import SqliteStore
+from ndg.oauth.server.test import TempDirTestCase, make_token
+
+
+class SqliteStoreTestCase(TempDirTestCase):
+
+    def _make_store(self, **options):
+        config = {'cache.data_dir': self.tmp_dir}
+        config.update(('cache.' + name, value)
+                      for name, value in options.iteritems())
+        return SqliteStore('test', config)
+
+    def _expired_token(self, token_id):
+        token = make_token(token_id)
+        token.expires = int(time.time()) - 1
+        return token
+
+    def test_put_get(self):
+        store = self._make_store()
+        store.put('a', make_token('a'))
+        self.assertEqual(store.get('a').token_id, 'a')
+        self.assertTrue(store.has_key('a'))
+        self.assertRaises(KeyError, store.get, 'b')
+        self.assertEqual(store.keys(), ['a'])
+
+    def test_expired_entries_are_not_returned(self):
+        store = self._make_store()
+        store.put('a', self._expired_token('a'))
+        store.put('b', make_token('b'))
+        self.assertRaises(KeyError, store.get, 'a')
+        self.assertFalse(store.has_key('a'))
+        self.assertEqual(store.get_values(['a', 'b', 'c']).keys(), ['b'])
+
+    def test_cache_expire_limits_expiry(self):
+        store = self._make_store(expire='1')
+        store.put('a', make_token('a'))
+        self.assertTrue(store.has_key('a'))
+        self.assertEqual(store.remove_expired(int(time.time()) + 2), 1)
+        self.assertFalse(store.has_key('a'))
+
+    def test_values_without_expiry(self):
+        store = self._make_store()
+        store.put('a', {'x': 1})
+        self.assertEqual(store.get('a'), {'x': 1})
+        self.assertEqual(store.remove_expired(), 0)
+
+    def test_update_treats_expired_entry_as_absent(self):
+        store = self._make_store()
+        store.put('a', self._expired_token('a'))
+        seen = []
+        def update(value):
+            seen.append(value)
+            return make_token('a')
+        store.update_values({'a': update})
+        self.assertEqual(seen, [None])
+        self.assertEqual(store.get('a').token_id, 'a')
+
+    def test_update_removes_entry(self):
+        store = self._make_store()
+        store.put('a', make_token('a'))
+        self.assertEqual(store.update_values({'a': lambda value: None}), {})
+        self.assertEqual(store.keys(), [])
+
+    def test_remove_values(self):
+        store = self._make_store()
+        for key in ('a', 'b', 'c'):
+            store.put(key, make_token(key))
+        store.remove_values(['a', 'c', 'd'])
+        self.assertEqual(store.keys(), ['b'])
+
+    def test_expired_entries_are_cleaned_up_on_write(self):
+        store = self._make_store(cleanup_interval='600')
+        store.put('a', self._expired_token('a'))
+        store.put('b', make_token('b'))
+        self.assertEqual(sorted(store.keys()), ['a', 'b'])
+        store._cleanup_at = time.time()
+        store.put('c', make_token('c'))
+        self.assertEqual(sorted(store.keys()), ['b', 'c'])
+
+    def test_cleanup_can_be_disabled(self):
+        store = self._make_store(cleanup_interval='0')
+        store.put('a', self._expired_token('a'))
+        store._cleanup_at = time.time()
+        store.put('b', make_token('b'))
+        self.assertEqual(sorted(store.keys()), ['a', 'b'])
+
+
+class SqliteRegisterTestCase(TempDirTestCase):
+
+    def test_token_register(self):
+        register = AccessTokenRegister(
+                    {'cache.accesstokenregister.type': 'sqlite',
+                     'cache.accesstokenregister.data_dir': self.tmp_dir})
+        token = make_token('a')
+        self.assertTrue(register.add_token(token))
+        self.assertEqual(register.get_token('a', 'read')[0].token_id, 'a')
+        self.assertEqual(register.get_token('b', 'read'), (None,
+                                                           'invalid_token'))
+        self.assertEqual(register.revoke_tokens(['a']), 1)
+        self.assertEqual(register.get_token('a', 'read'), (None,
+                                                           'invalid_token'))
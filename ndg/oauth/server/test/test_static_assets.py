@@ -0,0 +1,49 @@
+"""OAuth 2.0 WSGI server middleware - tests of the static file server
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import os
+
+from webob import Request
+
+from ndg.oauth.server.wsgi.static_assets import StaticAssetsMiddleware
+from ndg.oauth.server.test import TempDirTestCase
+
+
+class StaticAssetsTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super(StaticAssetsTestCase, self).setUp()
+        os.mkdir(os.path.join(self.tmp_dir, 'layout'))
+        for path in ('resource1.html', 'layout/style.css'):
+            with open(os.path.join(self.tmp_dir, path), 'w') as asset_file:
+                asset_file.write('x' * 1000)
+
+    def _cache_control(self, app, path):
+        response = Request.blank(path).get_response(app)
+        self.assertEqual(response.status_int, 200)
+        return response.headers['Cache-Control']
+
+    def test_cache_control(self):
+        app = StaticAssetsMiddleware.app_factory(
+                                    {}, document_root=self.tmp_dir,
+                                    max_age='60',
+                                    no_store_paths='/resource1\\.html$')
+        self.assertEqual(self._cache_control(app, '/layout/style.css'),
+                         'public, max-age=60')
+        self.assertEqual(
+                self._cache_control(app, app.url_for('/layout/style.css')),
+                'public, max-age=%d, immutable' % app.IMMUTABLE_MAX_AGE)
+        for path in ('/resource1.html', app.url_for('/resource1.html')):
+            self.assertEqual(self._cache_control(app, path), 'no-store')
+
+    def test_private_scope(self):
+        app = StaticAssetsMiddleware(None, self.tmp_dir, max_age=60,
+                                     cache_scope='private')
+        self.assertEqual(self._cache_control(app, '/resource1.html'),
+                         'private, max-age=60')
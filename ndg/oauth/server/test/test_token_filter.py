@@ -0,0 +1,89 @@
+"""OAuth 2.0 WSGI server middleware - tests of the Bloom filter of token IDs
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import os
+import unittest
+
+from ndg.oauth.server.lib.register.token_filter import TokenFilter
+from ndg.oauth.server.test import (TempDirTestCase,
+                                   lock_excludes_forked_process)
+
+
+class TokenFilterTestCase(unittest.TestCase):
+
+    def test_invalid_parameters(self):
+        self.assertRaises(ValueError, TokenFilter, 0, 0.01)
+        self.assertRaises(ValueError, TokenFilter, 100, 1)
+
+    def test_keys_are_found(self):
+        token_filter = TokenFilter(1000, 0.001)
+        token_filter.open(lambda: ['a', 'b'])
+        token_filter.add(u'c')
+        for key in ('a', 'b', 'c', u'a'):
+            self.assertTrue(key in token_filter)
+        self.assertEqual(token_filter.stats()['count'], 3)
+
+    def test_false_positive_rate(self):
+        token_filter = TokenFilter(1000, 0.01)
+        token_filter.open(lambda: ['key%d' % i for i in xrange(1000)])
+        false_positives = sum(1 for i in xrange(10000)
+                              if 'other%d' % i in token_filter)
+        self.assertTrue(false_positives < 300, false_positives)
+
+    def test_rebuild_drops_removed_keys(self):
+        keys = ['key%d' % i for i in xrange(100)]
+        token_filter = TokenFilter(1000, 0.0001)
+        token_filter.open(lambda: keys)
+        self.assertTrue(token_filter.rebuild(lambda: keys[:50]))
+        self.assertFalse(any(key in token_filter for key in keys[50:]))
+        self.assertTrue(all(key in token_filter for key in keys[:50]))
+
+    def test_rebuild_interval(self):
+        token_filter = TokenFilter(1000, 0.001)
+        token_filter.open(lambda: [])
+        self.assertFalse(token_filter.rebuild(lambda: [], interval=3600))
+
+
+class SharedTokenFilterTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super(SharedTokenFilterTestCase, self).setUp()
+        self.filename = os.path.join(self.tmp_dir, 'tokens.filter')
+
+    def test_additions_are_shared(self):
+        filter1 = TokenFilter(1000, 0.001, self.filename)
+        filter1.open(lambda: ['a'])
+        filter2 = TokenFilter(1000, 0.001, self.filename)
+        filter2.open(lambda: [])
+        self.assertTrue('a' in filter2)
+        filter2.add('b')
+        self.assertTrue('b' in filter1)
+
+    def test_rebuild_is_seen_by_other_processes(self):
+        filter1 = TokenFilter(1000, 0.0001, self.filename)
+        filter1.open(lambda: ['a', 'b'])
+        filter2 = TokenFilter(1000, 0.0001, self.filename)
+        filter2.open(lambda: [])
+        filter1.rebuild(lambda: ['a'])
+        self.assertFalse('b' in filter2)
+        filter2.add('c')
+        self.assertTrue('c' in filter1)
+
+    def test_existing_filter_size_is_used(self):
+        filter1 = TokenFilter(1000, 0.001, self.filename)
+        filter1.open(lambda: ['a'])
+        filter2 = TokenFilter(10, 0.1, self.filename)
+        filter2.open(lambda: [])
+        self.assertEqual(filter2.num_bits, filter1.num_bits)
+        self.assertTrue('a' in filter2)
+
+    def test_lock_excludes_forked_processes(self):
+        token_filter = TokenFilter(1000, 0.001, self.filename)
+        token_filter.open(lambda: ['a'])
+        self.assertTrue(lock_excludes_forked_process(token_filter))
@@ -0,0 +1,120 @@
+"""OAuth 2.0 WSGI server middleware - tests of the access token indexes
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+from ndg.oauth.server.lib.register.token_index import TokenIndexRegister
+from ndg.oauth.server.test import TempDirTestCase, make_token
+
+USER = TokenIndexRegister.USER_INDEX
+CLIENT = TokenIndexRegister.CLIENT_INDEX
+GRANT = TokenIndexRegister.GRANT_INDEX
+
+
+class TokenIndexTestCase(TempDirTestCase):
+    cache_type = 'sqlite'
+
+    def setUp(self):
+        super(TokenIndexTestCase, self).setUp()
+        self.index = self._make_index(TokenIndexRegister.INDEXES)
+
+    def _make_index(self, indexes):
+        config = {'cache.type': self.cache_type,
+                  'cache.data_dir': self.tmp_dir}
+        # Beaker keeps namespaces by name, including their data directory.
+        return TokenIndexRegister(self.id().rsplit('.', 1)[-1], config,
+                                  indexes)
+
+    def _token(self, token_id, lifetime=3600, **kwargs):
+        token = make_token(token_id, lifetime=lifetime, **kwargs)
+        self.index.add(token)
+        return token
+
+    def test_lookup(self):
+        self._token('t1', client_id='c1', user='u1')
+        self._token('t2', client_id='c1', user='u2')
+        self._token('t3', client_id='c2', user='u1', lifetime=7200)
+        self.assertEqual(sorted(self.index.get_token_ids(CLIENT, 'c1')),
+                         ['t1', 't2'])
+        self.assertEqual(sorted(self.index.get_token_ids(USER, 'u1')),
+                         ['t1', 't3'])
+        self.assertEqual(self.index.get_token_ids(GRANT, 'code-t2'), ['t2'])
+        self.assertEqual(self.index.get_token_ids(USER, 'u3'), [])
+
+    def test_expired_tokens_are_left_out(self):
+        self._token('t1', lifetime=-1)
+        self._token('t2')
+        self.assertEqual(self.index.get_token_ids(CLIENT, 'client1'), ['t2'])
+
+    def test_remove(self):
+        token = self._token('t1')
+        self._token('t2')
+        self.index.remove([token])
+        self.assertEqual(self.index.get_token_ids(USER, 'user1'), ['t2'])
+        self.assertEqual(self.index.get_token_ids(GRANT, 'code-t1'), [])
+        self.index.remove([token])
+
+    def test_add_changes_one_bucket(self):
+        width = TokenIndexRegister.BUCKET_SECONDS
+        self._token('t1', lifetime=3600)
+        self._token('t2', lifetime=3600 + 3 * width)
+        self._token('t3', lifetime=3600 + 3 * width)
+        buckets = [key for key in self.index.keys()
+                   if key.startswith(CLIENT + '@')]
+        self.assertEqual(len(buckets), 2)
+        sizes = sorted(len(self.index.get_value(key)) for key in buckets)
+        self.assertEqual(sizes, [1, 2])
+        self.assertEqual(len(self.index.get_value(CLIENT + ':client1')), 2)
+
+    def test_expired_buckets_are_removed(self):
+        self._token('t2')
+        old = self._token('t1',
+                          lifetime=-2 * TokenIndexRegister.BUCKET_SECONDS)
+        old_bucket = '@%d:' % self.index._bucket(old.expires)
+        self.assertEqual(len([key for key in self.index.keys()
+                              if old_bucket in key]), 3)
+        self._token('t3')
+        # The user and client lists are changed and drop the old bucket; the
+        # list of the old grant is not.
+        self.assertEqual([key for key in self.index.keys()
+                          if old_bucket in key],
+                         [GRANT + old_bucket + 'code-t1'])
+        self.assertEqual(len(self.index.get_value(USER + ':user1')), 1)
+        # The grant's list and bucket have expired with its token.
+        self.assertEqual(self.index.remove_expired(), 2)
+        self.assertEqual(sorted(key for key in self.index.keys()
+                                if key.startswith(GRANT)),
+                         sorted(key for token_id in ('t2', 't3')
+                                for key in self.index.keys()
+                                if key.endswith(':code-' + token_id)))
+
+    def test_entries_expire_with_their_tokens(self):
+        token = self._token('t1', lifetime=10)
+        self.assertEqual(self.index.remove_expired(token.expires - 1), 0)
+        bucket_ends = ((self.index._bucket(token.expires) + 1) *
+                       TokenIndexRegister.BUCKET_SECONDS)
+        self.assertEqual(self.index.remove_expired(bucket_ends), 6)
+        self.assertEqual(self.index.keys(), [])
+
+    def test_values_cannot_clash_with_buckets(self):
+        token = self._token('t1', user='u')
+        bucket = self.index._bucket(token.expires)
+        for user in ('u@%d' % bucket, 'u#%d' % bucket, '@%d:u' % bucket,
+                     u'u\xe9:x'):
+            self._token('t-' + user.encode('utf-8'), user=user)
+        self.assertEqual(self.index.get_token_ids(USER, 'u'), ['t1'])
+        self.assertEqual(self.index.get_token_ids(USER, u'u\xe9:x'),
+                         ['t-u\xc3\xa9:x'])
+
+    def test_index_not_maintained(self):
+        index = self._make_index([CLIENT])
+        self.assertRaises(ValueError, index.get_token_ids, USER, 'u1')
+        self.assertRaises(ValueError, self._make_index, ['other'])
+
+
+class FileTokenIndexTestCase(TokenIndexTestCase):
+    cache_type = 'file'
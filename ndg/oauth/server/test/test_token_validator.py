@@ -0,0 +1,156 @@
+"""OAuth 2.0 WSGI server middleware - tests of access token validation and
+the circuit breaker protecting it
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import httplib
+import logging
+import time
+import unittest
+
+from ndg.oauth.server.lib.circuit_breaker import CircuitBreaker
+from ndg.oauth.server.lib.token_validator import (LocalTokenValidator,
+                                                  RemoteTokenValidator,
+                                                  TokenValidator,
+                                                  TokenValidatorError)
+
+VALID = ('user1', httplib.OK, None)
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker('test', 2, reset_timeout=3600)
+        for success in (False, True, False):
+            self.assertTrue(breaker.allow())
+            breaker.record(success, 0)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+        breaker.record(False, 0)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.stats()['rejected'], 1)
+
+    def test_slow_calls_count_as_failures(self):
+        breaker = CircuitBreaker('test', 1, latency_threshold=1,
+                                 reset_timeout=3600)
+        breaker.record(True, 0.5)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record(True, 2)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_trial(self):
+        breaker = CircuitBreaker('test', 1, reset_timeout=0)
+        breaker.record(False, 0)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        # Only one trial call at a time.
+        self.assertFalse(breaker.allow())
+        breaker.record(False, 0)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(breaker.allow())
+        breaker.record(True, 0)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_disabled(self):
+        breaker = CircuitBreaker('test', 0)
+        for _ in xrange(10):
+            breaker.record(False, 0)
+        self.assertTrue(breaker.allow())
+
+
+class _TokenValidator(TokenValidator):
+    """Validator whose checks return or raise the given outcomes in turn."""
+
+    def __init__(self, outcomes, **kw):
+        super(_TokenValidator, self).__init__(**kw)
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.max_age = None
+
+    def _validate(self, token_id, scope):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome, time.time() + 3600, self.max_age
+
+
+class TokenValidatorTestCase(unittest.TestCase):
+
+    def test_breaker_defaults(self):
+        self.assertEqual(
+                LocalTokenValidator().circuit_breaker.failure_threshold, 0)
+        validator = RemoteTokenValidator('https://localhost/check_token')
+        self.assertEqual(validator.circuit_breaker.failure_threshold,
+                         TokenValidator.DEFAULT_FAILURE_THRESHOLD)
+
+    def test_out_of_date_verdicts_need_stale_grace(self):
+        for stale_grace, expected in ((None, None), (300, VALID)):
+            kw = {'stale_grace': stale_grace} if stale_grace else {}
+            validator = _TokenValidator([VALID, TokenValidatorError('down')],
+                                        cache_ttl=60, **kw)
+            # The verdict is out of date as soon as it is cached.
+            validator.max_age = 0
+            self.assertEqual(validator.check_token('t1'), VALID)
+            if expected is None:
+                self.assertRaises(TokenValidatorError, validator.check_token,
+                                  't1')
+            else:
+                self.assertEqual(validator.check_token('t1'), expected)
+                self.assertEqual(validator.stats()['stale_served'], 1)
+
+    def test_open_breaker_stops_checks(self):
+        validator = _TokenValidator([TokenValidatorError('down')],
+                                    cache_size=0, failure_threshold=1,
+                                    reset_timeout=3600)
+        for _ in xrange(2):
+            self.assertRaises(TokenValidatorError, validator.check_token, 't1')
+        self.assertEqual(validator.calls, 1)
+
+    def test_unexpected_error_ends_trial(self):
+        validator = _TokenValidator([TokenValidatorError('down'),
+                                     RuntimeError('bug'), VALID],
+                                    cache_size=0, failure_threshold=1,
+                                    reset_timeout=0)
+        self.assertRaises(TokenValidatorError, validator.check_token, 't1')
+        self.assertRaises(RuntimeError, validator.check_token, 't1')
+        # The breaker is not left waiting for the outcome of the trial.
+        self.assertEqual(validator.check_token('t1'), VALID)
+        self.assertEqual(validator.circuit_breaker.state,
+                         CircuitBreaker.CLOSED)
+
+    def test_stats_are_logged_periodically(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('ndg.oauth.server.lib.token_validator')
+        logger.addHandler(handler)
+        level = logger.level
+        logger.setLevel(logging.INFO)
+        try:
+            validator = _TokenValidator([TokenValidatorError('down')],
+                                        cache_size=0, failure_threshold=1,
+                                        reset_timeout=3600,
+                                        stats_interval=3600)
+            self.assertRaises(TokenValidatorError, validator.check_token,
+                              't1')
+            self.assertEqual(records, [])
+            validator._stats_logged_at -= 3600
+            self.assertRaises(TokenValidatorError, validator.check_token,
+                              't1')
+            self.assertRaises(TokenValidatorError, validator.check_token,
+                              't1')
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+        messages = [record.getMessage() for record in records
+                    if record.levelno == logging.INFO]
+        self.assertEqual(len(messages), 1)
+        self.assertTrue('circuit breaker open, opened 1 times, 0 checks '
+                        'rejected' in messages[0], messages[0])
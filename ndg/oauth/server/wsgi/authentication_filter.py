@@ -20,6 +20,7 @@ from ndg.oauth.server.lib.register.client_authorization import (
                             ClientAuthorization, ClientAuthorizationRegister)
 from ndg.oauth.server.lib.render.configuration import RenderingConfiguration
 from ndg.oauth.server.lib.render.factory import callModuleObject
+from ndg.oauth.server.lib.render.page_cache import RenderedPageCache
 from ndg.oauth.server.lib.render.renderer_interface import RendererInterface
 
 log = logging.getLogger(__name__)
@@ -30,12 +31,15 @@ class AuthenticationFormMiddleware(object):
     CLIENT_AUTHORIZATIONS_SESSION_KEY = 'oauth2_client_authorizations'
     PARAM_PREFIX = 'authenticationForm.'
     LAYOUT_PREFIX = 'layout.'
+    RENDERER_PREFIX = 'renderer.'
     # Configuration options
     AUTHENTICATION_CANCELLED_OPTION = 'login_cancelled'
     AUTHENTICATION_FORM_OPTION = 'login_form'
     BASE_URL_PATH_OPTION = 'base_url_path'
     CLIENT_REGISTER_OPTION = 'client_register'
     COMBINED_AUTHORIZATION_OPTION = 'combined_authorization'
+    PAGE_CACHE_CHECK_INTERVAL_OPTION = 'page_cache_check_interval'
+    PAGE_CACHE_SIZE_OPTION = 'page_cache_size'
     RENDERER_CLASS_OPTION = 'renderer_class'
     RETURN_URL_PARAM_OPTION = 'return_url_param'
     SESSION_KEY_OPTION = 'session_key_name'
@@ -47,6 +51,8 @@ class AuthenticationFormMiddleware(object):
     PROPERTY_DEFAULTS = {
         BASE_URL_PATH_OPTION: '/authentication',
         COMBINED_AUTHORIZATION_OPTION: 'True',
+        PAGE_CACHE_CHECK_INTERVAL_OPTION: RenderedPageCache.DEFAULT_CHECK_INTERVAL,
+        PAGE_CACHE_SIZE_OPTION: RenderedPageCache.DEFAULT_MAX_SIZE,
         RENDERER_CLASS_OPTION: 'ndg.oauth.server.lib.render.genshi_renderer.GenshiRenderer',
         RETURN_URL_PARAM_OPTION: 'returnurl',
         SESSION_KEY_OPTION: 'beaker.session.oauth2authorization'
@@ -93,11 +99,30 @@ class AuthenticationFormMiddleware(object):
                                                     prefix + self.LAYOUT_PREFIX,
                                                     local_conf)
         self._set_configuration(prefix, local_conf)
-        self.client_register = ClientRegister(self.client_register_file)
+        self.client_register = ClientRegister.get_shared(
+                                                    self.client_register_file)
+        # Options for the renderer, such as renderer.auto_reload for the
+        # default Genshi renderer
+        renderer_prefix = prefix + self.RENDERER_PREFIX
+        renderer_properties = dict(
+                            (k[len(renderer_prefix):], v)
+                            for k, v in local_conf.iteritems()
+                            if k.startswith(renderer_prefix))
         self.renderer = callModuleObject(self.renderer_class,
                                          objectName=None, moduleFilePath=None, 
                                          objectType=RendererInterface,
-                                         objectArgs=None, objectProperties=None)
+                                         objectArgs=None,
+                                         objectProperties=renderer_properties)
+        self.renderer.preload([self.authentication_form, self.authentication_cancelled])
+
+        # Pages are cached for each client, scope and layout, with holes for
+        # the URLs that change with each request.
+        self.page_cache = RenderedPageCache(
+                                self.renderer,
+                                ('submit_url', 'return_url', 'baseURL'),
+                                max_size=self.page_cache_size,
+                                check_interval=self.page_cache_check_interval,
+                                watch_files=[self.client_register_file])
 
     def __call__(self, environ, start_response):
         """
@@ -169,7 +194,7 @@ class AuthenticationFormMiddleware(object):
         if self.combined_authorization:
             c.update(self._parse_return_url(return_url))
 
-        response = self.renderer.render(self.authentication_form,
+        response = self.page_cache.render(self.authentication_form,
                             self._renderingConfiguration.merged_parameters(c))
         start_response(self._get_http_status_string(httplib.OK),
            [('Content-type', 'text/html'),
@@ -243,7 +268,7 @@ class AuthenticationFormMiddleware(object):
         scope = query_params.get('scope', None)
         if scope:
             scope = scope[0]
-        client = self.client_register.register.get(client_id)
+        client = self.client_register.get(client_id)
         result = None
         if client:
             result = {'client_name': client.name,
@@ -306,6 +331,14 @@ class AuthenticationFormMiddleware(object):
                                             cls.AUTHENTICATION_CANCELLED_OPTION)
         self.authentication_form = cls._get_config_option(prefix, local_conf,
                                                 cls.AUTHENTICATION_FORM_OPTION)
+        self.page_cache_size = int(cls._get_config_option(
+                                            prefix, 
+                                            local_conf, 
+                                            cls.PAGE_CACHE_SIZE_OPTION))
+        self.page_cache_check_interval = float(cls._get_config_option(
+                                            prefix, 
+                                            local_conf, 
+                                            cls.PAGE_CACHE_CHECK_INTERVAL_OPTION))
 
     @staticmethod
     def _get_http_status_string(status):
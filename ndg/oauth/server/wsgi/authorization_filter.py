@@ -9,6 +9,7 @@ __revision__ = "$Id$"
 
 import httplib
 import logging
+import re
 
 from webob import Request
 
@@ -17,11 +18,61 @@ from ndg.oauth.server.lib.register.client_authorization import (
                             ClientAuthorization, ClientAuthorizationRegister)
 from ndg.oauth.server.lib.render.configuration import RenderingConfiguration
 from ndg.oauth.server.lib.render.factory import callModuleObject
+from ndg.oauth.server.lib.render.page_cache import RenderedPageCache
 from ndg.oauth.server.lib.render.renderer_interface import RendererInterface
+from ndg.oauth.server.lib.path_matcher import PathMatcher
 
 log = logging.getLogger(__name__)
 
 
+class LazyClientAuthorizations(object):
+    """
+    Stands in for the ClientAuthorizationRegister held in a session, which is
+    only read from the session - loading the session - when it is first used.
+    The proxy is false if the session holds no authorizations.
+    """
+    __slots__ = ('_session', '_session_key', '_client_authorizations',
+                 '_loaded')
+
+    def __init__(self, session, session_key):
+        """
+        @type session: Beaker SessionObject
+        @param session: session data
+        @type session_key: str
+        @param session_key: key of the authorizations in the session
+        """
+        self._session = session
+        self._session_key = session_key
+        self._client_authorizations = None
+        self._loaded = False
+
+    def load(self):
+        """Returns the register held in the session, reading it on first use.
+        @rtype: ClientAuthorizationRegister
+        @return: register, or None if the session holds none
+        """
+        if not self._loaded:
+            self._client_authorizations = self._session.get(self._session_key)
+            self._loaded = True
+            log.debug("Loaded client authorizations from session: %r",
+                      self._client_authorizations)
+        return self._client_authorizations
+
+    def __nonzero__(self):
+        return bool(self.load())
+
+    def __getattr__(self, name):
+        client_authorizations = self.load()
+        if client_authorizations is None:
+            raise AttributeError(name)
+        return getattr(client_authorizations, name)
+
+    def __repr__(self):
+        if not self._loaded:
+            return '<%s (not loaded)>' % self.__class__.__name__
+        return repr(self._client_authorizations)
+
+
 class Oauth2AuthorizationMiddleware(object):
     """Middleware to handle user/resource owner authorization of clients within
     a session.
@@ -33,11 +84,15 @@ class Oauth2AuthorizationMiddleware(object):
     SESSION_CALL_CONTEXT_KEY = 'oauth2_client_authorizations_context'
     PARAM_PREFIX = 'oauth2authorization.'
     LAYOUT_PREFIX = 'layout.'
+    RENDERER_PREFIX = 'renderer.'
     # Configuration options
     BASE_URL_PATH_OPTION = 'base_url_path'
     CLIENT_AUTHORIZATION_FORM_OPTION = 'client_authorization_form'
     CLIENT_AUTHORIZATIONS_KEY_OPTION = 'client_authorizations_key'
     CLIENT_REGISTER_OPTION = 'client_register'
+    EXCLUDE_PATHS_OPTION = 'exclude_paths'
+    PAGE_CACHE_CHECK_INTERVAL_OPTION = 'page_cache_check_interval'
+    PAGE_CACHE_SIZE_OPTION = 'page_cache_size'
     RENDERER_CLASS_OPTION = 'renderer_class'
     SESSION_KEY_OPTION = 'session_key_name'
     USER_IDENTIFIER_KEY_OPTION = 'user_identifier_key'
@@ -48,6 +103,8 @@ class Oauth2AuthorizationMiddleware(object):
     # Configuration option defaults
     PROPERTY_DEFAULTS = {
         BASE_URL_PATH_OPTION: 'client_authorization',
+        PAGE_CACHE_CHECK_INTERVAL_OPTION: RenderedPageCache.DEFAULT_CHECK_INTERVAL,
+        PAGE_CACHE_SIZE_OPTION: RenderedPageCache.DEFAULT_MAX_SIZE,
         RENDERER_CLASS_OPTION: \
             'ndg.oauth.server.lib.render.genshi_renderer.GenshiRenderer',
         SESSION_KEY_OPTION: 'beaker.session.oauth2authorization',
@@ -93,11 +150,29 @@ class Oauth2AuthorizationMiddleware(object):
                                                     prefix + self.LAYOUT_PREFIX,
                                                     local_conf)
         self._set_configuration(prefix, local_conf)
-        self.client_register = ClientRegister(self.client_register_file)
+        self.client_register = ClientRegister.get_shared(
+                                                    self.client_register_file)
+        # Options for the renderer, such as renderer.auto_reload for the
+        # default Genshi renderer
+        renderer_prefix = prefix + self.RENDERER_PREFIX
+        renderer_properties = dict(
+                            (k[len(renderer_prefix):], v)
+                            for k, v in local_conf.iteritems()
+                            if k.startswith(renderer_prefix))
         self.renderer = callModuleObject(self.renderer_class,
                                          objectName=None, moduleFilePath=None, 
                                          objectType=RendererInterface,
-                                         objectArgs=None, objectProperties=None)
+                                         objectArgs=None,
+                                         objectProperties=renderer_properties)
+        self.renderer.preload([self.client_authorization_form])
+
+        # Pages are cached for each client, scope and layout, with holes for
+        # the URLs that change with each request.
+        self.page_cache = RenderedPageCache(
+                                self.renderer, ('submit_url', 'baseURL'),
+                                max_size=self.page_cache_size,
+                                check_interval=self.page_cache_check_interval,
+                                watch_files=[self.client_register_file])
 
     def __call__(self, environ, start_response):
         """
@@ -112,30 +187,25 @@ class Oauth2AuthorizationMiddleware(object):
         """
         log.debug("Oauth2AuthorizationMiddleware.__call__ ...")
 
-        req = Request(environ)
-
-        # Get session.
-        session = environ.get(self.session_env_key)
-        if session is None:
-            raise Exception(
-                'Oauth2AuthorizationMiddleware.__call__: No beaker session key '
-                '"%s" found in environ' % self.session_env_key)
-
         # Determine what operation the URL specifies.
+        path_info = environ.get('PATH_INFO', '')
         actionPath = None
-        log.debug("Request path_info: %s", req.path_info)
-        if req.path_info.startswith(self.base_path):
-            actionPath = req.path_info[len(self.base_path):]
+        log.debug("Request path_info: %s", path_info)
+        if path_info.startswith(self.base_path):
+            actionPath = path_info[len(self.base_path):]
             
         methodName = self.__class__.method.get(actionPath, '')
         if methodName:
             log.debug("Method: %s" % methodName)
             action = getattr(self, methodName)
-            return action(req, session, start_response)
+            return action(Request(environ), self._get_session(environ),
+                          start_response)
         
         elif self._app is not None:
             log.debug("Delegating to lower filter/application.")
-            self._set_client_authorizations_in_environ(session, environ)
+            if not self.is_excluded_path(path_info):
+                self._set_client_authorizations_in_environ(
+                                        self._get_session(environ), environ)
             return self._app(environ, start_response)
         
         else:
@@ -146,24 +216,44 @@ class Oauth2AuthorizationMiddleware(object):
                             ])
             return [response]
 
+    def _get_session(self, environ):
+        """Gets the session from environ.
+        @type environ: dict
+        @param environ: WSGI environment
+        @rtype: Beaker SessionObject
+        @return: session data
+        """
+        session = environ.get(self.session_env_key)
+        if session is None:
+            raise Exception(
+                'Oauth2AuthorizationMiddleware.__call__: No beaker session key '
+                '"%s" found in environ' % self.session_env_key)
+        return session
+
+    def is_excluded_path(self, path):
+        """Returns whether a request path is one for which client
+        authorizations are not set in environ, so that the session is not
+        used.
+        @type path: basestring
+        @param path: request path
+        @rtype: bool
+        """
+        return self._exclude_path_matcher.match(path) is not None
+
     def _set_client_authorizations_in_environ(self, session, environ):
         """
         Sets the current authorizations currently granted by the user in
-        environ,
+        environ.  They are set as a LazyClientAuthorizations, so the session is
+        only loaded if they are used.
         @type session: Beaker SessionObject
         @param session: session data
 
         @type environ: dict
         @param environ: WSGI environment
         """
-        client_authorizations = session.get(self.CLIENT_AUTHORIZATIONS_SESSION_KEY)
-        if client_authorizations:
-            log.debug("_set_client_authorizations_in_environ %r",
-                      client_authorizations)
-            environ[self.client_authorizations_env_key] = client_authorizations
-        else:
-            log.debug("%s not found in session", 
-                      self.CLIENT_AUTHORIZATIONS_SESSION_KEY)
+        environ[self.client_authorizations_env_key] = LazyClientAuthorizations(
+                                    session,
+                                    self.CLIENT_AUTHORIZATIONS_SESSION_KEY)
 
     def authorize(self, req, session, start_response):
         """
@@ -235,7 +325,7 @@ class Oauth2AuthorizationMiddleware(object):
         @rtype: iterable
         @return: WSGI response
         """
-        client = self.client_register.register.get(client_id)
+        client = self.client_register.get(client_id)
         if client is None:
             # Client ID is not registered.
             log.error("OAuth client of ID %s is not registered with the server",
@@ -251,7 +341,7 @@ class Oauth2AuthorizationMiddleware(object):
                  'scope': scope,
                  'submit_url': submit_url,
                  'baseURL': req.application_url}
-            response = self.renderer.render(self.client_authorization_form,
+            response = self.page_cache.render(self.client_authorization_form,
                             self._renderingConfiguration.merged_parameters(c))
         start_response(self._get_http_status_string(httplib.OK),
            [('Content-type', 'text/html'),
@@ -345,6 +435,14 @@ class Oauth2AuthorizationMiddleware(object):
                                             prefix, 
                                             local_conf, 
                                             cls.CLIENT_AUTHORIZATION_FORM_OPTION)
+        self.page_cache_size = int(cls._get_config_option(
+                                            prefix, 
+                                            local_conf, 
+                                            cls.PAGE_CACHE_SIZE_OPTION))
+        self.page_cache_check_interval = float(cls._get_config_option(
+                                            prefix, 
+                                            local_conf, 
+                                            cls.PAGE_CACHE_CHECK_INTERVAL_OPTION))
         self.client_authorizations_env_key = cls._get_config_option(prefix, 
                                             local_conf, 
                                             cls.CLIENT_AUTHORIZATIONS_KEY_OPTION)
@@ -352,6 +450,14 @@ class Oauth2AuthorizationMiddleware(object):
                                                 prefix, 
                                                 local_conf, 
                                                 cls.USER_IDENTIFIER_KEY_OPTION)
+        exclude_paths = cls._get_config_option(prefix, 
+                                               local_conf, 
+                                               cls.EXCLUDE_PATHS_OPTION)
+        self.exclude_paths = [re.compile(path)
+                              for path in (exclude_paths or '').split()]
+        self._exclude_path_matcher = PathMatcher(
+                                [(re_path, None)
+                                 for re_path in self.exclude_paths])
 
     @staticmethod
     def _get_http_status_string(status):
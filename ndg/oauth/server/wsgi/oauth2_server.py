@@ -10,6 +10,7 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 
+import hashlib
 import httplib
 import json
 import logging
@@ -22,6 +23,9 @@ from ndg.oauth.server.lib.access_token.bearer_token_generator import \
     BearerTokenGenerator
 from ndg.oauth.server.lib.access_token.myproxy_cert_token_generator \
     import MyProxyCertTokenGenerator
+from ndg.oauth.server.lib.access_token.signed_token import SigningKeys
+from ndg.oauth.server.lib.access_token.signed_token_generator import \
+    SignedTokenGenerator
 from ndg.oauth.server.lib.authenticate.certificate_client_authenticator \
     import CertificateAuthenticator
 from ndg.oauth.server.lib.authenticate.noop_client_authenticator import \
@@ -61,12 +65,16 @@ class Oauth2ServerMiddleware(object):
     AUTHORIZATION_GRANT_LIFETIME_OPTION = 'authorization_grant_lifetime'
     BASE_URL_PATH_OPTION = 'base_url_path'
     CERTIFICATE_REQUEST_PARAMETER_OPTION = 'certificate_request_parameter'
+    CHECK_TOKEN_CACHE_SCOPE_OPTION = 'check_token_cache_scope'
+    CHECK_TOKEN_MAX_AGE_OPTION = 'check_token_max_age'
+    CHECK_TOKEN_ERROR_MAX_AGE_OPTION = 'check_token_error_max_age'
     CLIENT_AUTHENTICATION_METHOD_OPTION = 'client_authentication_method'
     CLIENT_AUTHORIZATION_URL_OPTION = 'client_authorization_url'
     CLIENT_AUTHORIZATIONS_KEY_OPTION = 'client_authorizations_key'
     CLIENT_REGISTER_OPTION = 'client_register'
     RESOURCE_AUTHENTICATION_METHOD_OPTION = 'resource_authentication_method'
     RESOURCE_REGISTER_OPTION = 'resource_register'
+    SIGNING_KEYS_OPTION = 'signing_keys'
     MYPROXY_CLIENT_KEY_OPTION = 'myproxy_client_key'
     MYPROXY_GLOBAL_PASSWORD_OPTION = 'myproxy_global_password'
     USER_IDENTIFIER_KEY_OPTION = 'user_identifier_key'
@@ -82,6 +90,9 @@ class Oauth2ServerMiddleware(object):
         AUTHORIZATION_GRANT_LIFETIME_OPTION: 600,
         BASE_URL_PATH_OPTION: '',
         CERTIFICATE_REQUEST_PARAMETER_OPTION: 'certificate_request',
+        CHECK_TOKEN_CACHE_SCOPE_OPTION: 'private',
+        CHECK_TOKEN_MAX_AGE_OPTION: 0,
+        CHECK_TOKEN_ERROR_MAX_AGE_OPTION: 0,
         CLIENT_AUTHENTICATION_METHOD_OPTION: 'certificate',
         CLIENT_AUTHORIZATION_URL_OPTION: '/client_authorization/authorize',
         CLIENT_AUTHORIZATIONS_KEY_OPTION: 'client_authorizations',
@@ -94,7 +105,8 @@ class Oauth2ServerMiddleware(object):
         '/access_token': 'access_token',
         '/authorize': 'authorize',
         '/check_token': 'check_token',
-        '/request_certificate': 'request_certificate'
+        '/request_certificate': 'request_certificate',
+        '/revoke': 'revoke'
     }
 
     def __init__(self, app, app_conf, prefix=PARAM_PREFIX, **local_conf):
@@ -120,12 +132,37 @@ class Oauth2ServerMiddleware(object):
         self._app = app
         conf = self._set_configuration(prefix, local_conf)
 
+        # Revocation is only offered to authenticated resources.
+        self.method = dict(self.__class__.method)
+        if self.resource_authentication_method == 'none':
+            log.warning("Token revocation is disabled - set %s to enable it",
+                        self.RESOURCE_AUTHENTICATION_METHOD_OPTION)
+            del self.method['/revoke']
+
+        if self.check_token_cache_scope not in ('public', 'private'):
+            raise ValueError("Invalid configuration value %s for %s" %
+                             (self.check_token_cache_scope,
+                              self.CHECK_TOKEN_CACHE_SCOPE_OPTION))
+
         if self.access_token_type == 'bearer':
             # Simple bearer token configuration.
             access_token_generator = BearerTokenGenerator(
                                         self.access_token_lifetime_seconds, 
                                         self.access_token_type)
             
+        elif self.access_token_type == 'signed':
+            # Bearer tokens that resource servers validate from their signed
+            # contents.
+            if not self.signing_keys:
+                raise ValueError("%s must be set for access token type %s" %
+                                 (self.SIGNING_KEYS_OPTION,
+                                  self.access_token_type))
+            access_token_generator = SignedTokenGenerator(
+                                self.access_token_lifetime_seconds,
+                                'bearer',
+                                signing_keys=SigningKeys.from_string(
+                                                        self.signing_keys))
+
         elif self.access_token_type == 'slcs':
             # Configure authorization server to use MyProxy certificates as 
             # access tokens.
@@ -151,12 +188,13 @@ class Oauth2ServerMiddleware(object):
 
         # Determine client authentication type. A 'none' options is allowed so
         # that development/testing can be performed without running on Apache.
-        client_register = ClientRegister(self.client_register_file)
+        client_register = ClientRegister.get_shared(self.client_register_file)
         client_authenticator = self._get_authenticator(
             self.client_authentication_method, client_register,
             'client', self.CLIENT_AUTHENTICATION_METHOD_OPTION)
         # same for resource authentication type.
-        resource_register = ResourceRegister(self.resource_register_file)
+        resource_register = ResourceRegister.get_shared(
+                                                self.resource_register_file)
         resource_authenticator = self._get_authenticator(
             self.resource_authentication_method, resource_register,
             'resource', self.RESOURCE_AUTHENTICATION_METHOD_OPTION)
@@ -213,7 +251,7 @@ class Oauth2ServerMiddleware(object):
         actionPath = None
         if req.path_info.startswith(self.base_path):
             actionPath = req.path_info[len(self.base_path):]
-        methodName = self.__class__.method.get(actionPath, '')
+        methodName = self.method.get(actionPath, '')
         if methodName:
             log.debug("Method: %s" % methodName)
             action = getattr(self, methodName)
@@ -385,19 +423,73 @@ class Oauth2ServerMiddleware(object):
         @rtype: iterable
         @return: WSGI response
         """
-        response, error_status = self._authorizationServer.check_token(req)[0:2]
+        (response, error_status, error,
+         expires_in) = self._authorizationServer.check_token(req)
         if response is None:
             response = ''
+
+        # Responses may be cached by the caller, if so configured, for no
+        # longer than the token remains valid.  Private responses are only
+        # cached within each resource server; public ones also by a shared
+        # cache in front of this server, keyed on the resource credentials.
+        if error_status == httplib.OK and expires_in:
+            max_age = min(self.check_token_max_age, expires_in)
+        elif error_status == httplib.FORBIDDEN:
+            max_age = self.check_token_error_max_age
+        else:
+            max_age = 0
+        if max_age > 0:
+            etag = hashlib.md5(response).hexdigest()
+            cache_control = '%s, max-age=%d' % (self.check_token_cache_scope,
+                                                max_age)
+            headers = [
+                ('Content-Type', 'application/json; charset=UTF-8'),
+                ('Cache-Control', cache_control),
+                ('ETag', '"%s"' % etag)
+            ]
+            if self.check_token_cache_scope == 'public':
+                headers.append(('Vary', 'Authorization'))
+            if etag in req.if_none_match:
+                start_response(self._get_http_status_string(
+                                                httplib.NOT_MODIFIED), headers)
+                return []
+            headers.append(('Content-length', str(len(response))))
+        else:
+            headers = [
+                ('Content-Type', 'application/json; charset=UTF-8'),
+                ('Cache-Control', 'no-store'),
+                ('Content-length', str(len(response))),
+                ('Pragma', 'no-store')
+            ]
+        status_str = self._get_http_status_string(
+                                error_status if error_status else httplib.OK)
+
+        start_response(status_str, headers)
+        return [response]
+
+    def revoke(self, req, start_response):
+        """
+        Service to revoke a number of access tokens, selected by token ID,
+        user, client or authorization grant. It would be called from a
+        resource service that trusts this authorization service.
+        @type req: webob.Request
+        @param req: HTTP request object
+
+        @type start_response: 
+        @param start_response: WSGI start response function
+
+        @rtype: iterable
+        @return: WSGI response
+        """
+        log.debug("revoke called")
+        response, status = self._authorizationServer.revoke_tokens(req)[0:2]
         headers = [
             ('Content-Type', 'application/json; charset=UTF-8'),
             ('Cache-Control', 'no-store'),
             ('Content-length', str(len(response))),
             ('Pragma', 'no-store')
         ]
-        status_str = self._get_http_status_string(
-                                error_status if error_status else httplib.OK)
-
-        start_response(status_str, headers)
+        start_response(self._get_http_status_string(status), headers)
         return [response]
 
     def request_certificate(self, req, start_response):
@@ -505,6 +597,12 @@ class Oauth2ServerMiddleware(object):
                                 conf, cls.ACCESS_TOKEN_TYPE_OPTION)
         self.certificate_request_parameter = cls._get_config_option(
                                 conf, cls.CERTIFICATE_REQUEST_PARAMETER_OPTION)
+        self.check_token_cache_scope = cls._get_config_option(
+                                conf, cls.CHECK_TOKEN_CACHE_SCOPE_OPTION)
+        self.check_token_max_age = int(cls._get_config_option(
+                                conf, cls.CHECK_TOKEN_MAX_AGE_OPTION))
+        self.check_token_error_max_age = int(cls._get_config_option(
+                                conf, cls.CHECK_TOKEN_ERROR_MAX_AGE_OPTION))
         self.client_authorization_url  = cls._get_config_option(
                                 conf, cls.CLIENT_AUTHORIZATION_URL_OPTION)
         self.client_authentication_method  = cls._get_config_option(
@@ -523,6 +621,8 @@ class Oauth2ServerMiddleware(object):
                                 conf, cls.MYPROXY_GLOBAL_PASSWORD_OPTION)
         self.user_identifier_env_key = cls._get_config_option(
                                 conf, cls.USER_IDENTIFIER_KEY_OPTION)
+        # Not read with _get_config_option, which logs the value.
+        self.signing_keys = conf.pop(cls.SIGNING_KEYS_OPTION, None)
         
         # Return any options that start with the prefix but haven't been read
         # above.
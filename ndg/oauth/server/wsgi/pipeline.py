@@ -0,0 +1,143 @@
+"""OAuth 2.0 WSGI server middleware combining the authentication form,
+client authorization, OAuth server and resource server filters in one
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import httplib
+import logging
+
+from webob import Request
+
+from ndg.oauth.server.wsgi.authentication_filter import \
+    AuthenticationFormMiddleware
+from ndg.oauth.server.wsgi.authorization_filter import \
+    Oauth2AuthorizationMiddleware
+from ndg.oauth.server.wsgi.oauth2_server import Oauth2ServerMiddleware
+from ndg.oauth.server.wsgi.resource_server import \
+    Oauth2ResourceServerMiddleware
+from ndg.oauth.server.lib.token_validator import LocalTokenValidator
+
+log = logging.getLogger(__name__)
+
+
+class Oauth2PipelineMiddleware(object):
+    """
+    Runs AuthenticationFormMiddleware, Oauth2AuthorizationMiddleware,
+    Oauth2ServerMiddleware and Oauth2ResourceServerMiddleware as a single
+    WSGI filter, configured with the options of all four, each with its own
+    prefix as when they are used as separate filters.
+
+    A request is routed once, by looking its path up in a table of the
+    actions of all the filters, instead of passing through each filter in
+    turn. A webob Request is only made for a request that is handled here,
+    and the Beaker session is only fetched for the actions that use it and
+    for requests passed on to the wrapped application, which are given the
+    user's client authorizations as before - unless the path is one of the
+    authorisation filter's exclude_paths.
+    """
+    # Route kinds
+    SESSION_ACTION, SERVER_ACTION, AUTHORIZE_ACTION = range(3)
+
+    def __init__(self, app, app_conf, **local_conf):
+        """
+        @type app: WSGI application
+        @param app: wrapped application/middleware
+
+        @type app_conf: dict
+        @param app_conf: application configuration settings
+
+        @type local_conf: dict
+        @param local_conf: options of the combined filters, with their usual
+        prefixes
+        """
+        self._app = app
+        self.authentication_filter = AuthenticationFormMiddleware(
+                                                None, app_conf, **local_conf)
+        self.authorization_filter = Oauth2AuthorizationMiddleware(
+                                                None, app_conf, **local_conf)
+        self.oauth2_server = Oauth2ServerMiddleware(None, app_conf,
+                                                    **local_conf)
+        self.resource_server = Oauth2ResourceServerMiddleware.filter_app_factory(
+                                                app, app_conf, **local_conf)
+        self._authorization_server = self.oauth2_server._authorizationServer
+        token_validator = self.resource_server.token_validator
+        if isinstance(token_validator, LocalTokenValidator):
+            token_validator.authorization_server = self._authorization_server
+
+        # Action paths of the filters - where two filters have the same path,
+        # the one that comes first in the stacked pipeline handles it.
+        self._routes = {}
+        for action_path, method_name in self.oauth2_server.method.iteritems():
+            kind = (self.AUTHORIZE_ACTION if method_name == 'authorize'
+                    else self.SERVER_ACTION)
+            self._routes[self.oauth2_server.base_path + action_path] = (
+                kind, getattr(self.oauth2_server, method_name))
+        for flt in (self.authorization_filter, self.authentication_filter):
+            for action_path, method_name in flt.method.iteritems():
+                self._routes[flt.base_path + action_path] = (
+                    self.SESSION_ACTION, getattr(flt, method_name))
+        log.debug("Oauth2PipelineMiddleware routes: %s",
+                  sorted(self._routes.keys()))
+
+    def __call__(self, environ, start_response):
+        """
+        @type environ: dict
+        @param environ: WSGI environment
+
+        @type start_response:
+        @param start_response: WSGI start response function
+
+        @rtype: iterable
+        @return: WSGI response
+        """
+        # Set for downstream middleware or app, as Oauth2ServerMiddleware does
+        environ[Oauth2ServerMiddleware.AUTHORISATION_SERVER_ENVIRON_KEYNAME
+                ] = self._authorization_server
+
+        path_info = environ.get('PATH_INFO', '')
+        route = self._routes.get(path_info)
+        if route is not None:
+            kind, action = route
+            req = Request(environ)
+            if kind == self.SERVER_ACTION:
+                return action(req, start_response)
+            session = self.authorization_filter._get_session(environ)
+            if kind == self.AUTHORIZE_ACTION:
+                self.authorization_filter._set_client_authorizations_in_environ(
+                                                            session, environ)
+                return action(req, start_response)
+            return action(req, session, start_response)
+
+        match = self.resource_server.match_resource_uripath(path_info)
+        if ((match is not None or self._app is not None) and
+            not self.authorization_filter.is_excluded_path(path_info)):
+            self.authorization_filter._set_client_authorizations_in_environ(
+                        self.authorization_filter._get_session(environ),
+                        environ)
+        if match is not None:
+            return self.resource_server.request_resource(Request(environ),
+                                                         start_response,
+                                                         scope=match[1])
+        elif self._app is not None:
+            return self._app(environ, start_response)
+        else:
+            response = "OAuth 2.0 Server - Invalid URL"
+            start_response("%d %s" % (httplib.NOT_FOUND,
+                                      httplib.responses[httplib.NOT_FOUND]),
+                           [('Content-type', 'text/plain'),
+                            ('Content-length', str(len(response)))
+                            ])
+            return [response]
+
+    @classmethod
+    def filter_app_factory(cls, app, app_conf, **local_conf):
+        return cls(app, app_conf, **local_conf)
+
+    @classmethod
+    def app_factory(cls, app_conf, **local_conf):
+        return cls(None, app_conf, **local_conf)
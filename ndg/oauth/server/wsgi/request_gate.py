@@ -0,0 +1,260 @@
+"""OAuth 2.0 WSGI server middleware rejecting malformed authorize and access
+token requests before they reach the session and authentication middleware
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import httplib
+import json
+import logging
+
+from webob import Request
+
+from ndg.oauth.server.lib.authorization_server import AuthorizationServer
+from ndg.oauth.server.lib.oauth.oauth_exception import OauthException
+from ndg.oauth.server.lib.register.client import ClientRegister
+
+log = logging.getLogger(__name__)
+
+
+class Oauth2RequestGateMiddleware(object):
+    """
+    Makes the checks of authorize and access token requests that need no
+    session, user or storage - the client is registered, the request is made
+    over HTTPS, with the right method, and has its required parameters once
+    each - and responds to a request that fails them as Oauth2ServerMiddleware
+    would, without passing it on. Placed in front of the Beaker session and
+    repoze.who filters, it keeps them idle for such requests.
+
+    Client registrations are read from the client register file into memory
+    when the filter is created. Requests that pass the checks are passed on
+    unchanged, and are checked again by Oauth2ServerMiddleware.
+    """
+    PARAM_PREFIX = 'oauth2requestgate.'
+    # Configuration options
+    BASE_URL_PATH_OPTION = 'base_url_path'
+    CLIENT_REGISTER_OPTION = 'client_register'
+    # Configuration option defaults
+    PROPERTY_DEFAULTS = {
+        BASE_URL_PATH_OPTION: ''
+    }
+    method = {
+        '/access_token': '_check_access_token',
+        '/authorize': '_check_authorize'
+    }
+
+    def __init__(self, app, app_conf, prefix=PARAM_PREFIX, **local_conf):
+        """
+        @type app: WSGI application
+        @param app: wrapped application/middleware
+
+        @type app_conf: dict
+        @param app_conf: application configuration settings - ignored - this
+        method includes this arg to fit Paste middleware / app function
+        signature
+
+        @type prefix: str
+        @param prefix: optional prefix for parameter names included in the
+        local_conf dict - enables these parameters to be filtered from others
+        which don't apply to this middleware
+
+        @type local_conf: dict
+        @param local_conf: attribute settings to apply
+        """
+        self._app = app
+        cls = self.__class__
+        self.base_path = cls._get_config_option(prefix, local_conf,
+                                                cls.BASE_URL_PATH_OPTION)
+        client_register_file = cls._get_config_option(
+                                                prefix, local_conf,
+                                                cls.CLIENT_REGISTER_OPTION)
+        self.clients = ClientRegister.get_shared(client_register_file).register
+        self._checks = dict((self.base_path + action_path,
+                             getattr(self, method_name))
+                            for action_path, method_name in
+                            cls.method.iteritems())
+        self.rejected = 0
+
+    def __call__(self, environ, start_response):
+        """
+        @type environ: dict
+        @param environ: WSGI environment
+
+        @type start_response:
+        @param start_response: WSGI start response function
+
+        @rtype: iterable
+        @return: WSGI response
+        """
+        check = self._checks.get(environ.get('PATH_INFO', ''))
+        if check is not None:
+            response = check(Request(environ), start_response)
+            if response is not None:
+                self.rejected += 1
+                return response
+        return self._app(environ, start_response)
+
+    def _check_authorize(self, req, start_response):
+        """Checks an authorize request as AuthorizationServer.authorize does.
+        Errors for which the client cannot be identified are returned directly,
+        others by redirecting to the client.
+        @type req: webob.Request
+        @param req: HTTP request object
+
+        @type start_response: WSGI start response function
+        @param start_response: start response function
+
+        @rtype: iterable or NoneType
+        @return: WSGI response, or None if the request passes
+        """
+        params = req.GET
+        client_id = params.get('client_id')
+        if not client_id:
+            return self._error_response('authorize', 'invalid_request',
+                                        'Missing request parameter: client_id',
+                                        start_response)
+        client = self.clients.get(client_id)
+        if client is None:
+            return self._error_response(
+                            'authorize', 'unauthorized_client',
+                            'Client of id "%s" is not registered.' % client_id,
+                            start_response)
+
+        for key in ('client_id', 'redirect_uri'):
+            if len(params.getall(key)) > 1:
+                return self._error_response(
+                                        'authorize', 'invalid_request',
+                                        'Parameter "%s" is repeated.' % key,
+                                        start_response)
+        redirect_uri = params.get('redirect_uri')
+        if redirect_uri is None:
+            if len(client.redirect_uris) != 1:
+                return self._error_response(
+                                'authorize', 'invalid_request',
+                                'No redirect URI is registered for the client '
+                                'or specified in the request.', start_response)
+            redirect_uri = client.default_redirect_uri
+        elif redirect_uri not in client.redirect_uris:
+            return self._error_response('authorize', 'invalid_request',
+                                        'Redirect URI is not registered.',
+                                        start_response)
+
+        try:
+            self._check_request(req, params, post_only=False)
+            if 'response_type' not in params:
+                raise OauthException('invalid_request',
+                                     'Missing request parameter: '
+                                     'response_type')
+            response_type = params['response_type']
+            if response_type != 'code':
+                raise OauthException('unsupported_response_type',
+                                     "Response type %s not supported" %
+                                     response_type)
+        except OauthException, exc:
+            log.debug("Rejecting authorize request: %s - %s", exc.error,
+                      exc.error_description)
+            url = AuthorizationServer._make_combined_url(
+                        redirect_uri,
+                        [('error', exc.error),
+                         ('error_description', exc.error_description)],
+                        params.get('state'))
+            start_response(self._get_http_status_string(httplib.FOUND),
+                           [('Location', url.encode('ascii', 'ignore'))])
+            return []
+        return None
+
+    def _check_access_token(self, req, start_response):
+        """Checks an access token request as AuthorizationServer.access_token
+        does before it authenticates the client.
+        @type req: webob.Request
+        @param req: HTTP request object
+
+        @type start_response: WSGI start response function
+        @param start_response: start response function
+
+        @rtype: iterable or NoneType
+        @return: WSGI response, or None if the request passes
+        """
+        try:
+            params = req.POST
+            self._check_request(req, params, post_only=True)
+            for param in ('grant_type', 'code'):
+                if param not in params:
+                    raise OauthException('invalid_request',
+                                         "Missing request parameter: %s" %
+                                         param)
+        except OauthException, exc:
+            log.debug("Rejecting access token request: %s - %s", exc.error,
+                      exc.error_description)
+            response = json.dumps({'error': exc.error,
+                                   'error_description':
+                                        exc.error_description})
+            start_response(self._get_http_status_string(httplib.OK),
+                           [('Content-Type',
+                             'application/json; charset=UTF-8'),
+                            ('Cache-Control', 'no-store'),
+                            ('Content-length', str(len(response))),
+                            ('Pragma', 'no-store')])
+            return [response]
+        return None
+
+    @staticmethod
+    def _check_request(req, params, post_only=False):
+        """Makes the checks of AuthorizationServer.check_request.
+        @type req: webob.Request
+        @param req: HTTP request object
+
+        @type params: webob.multidict.MultiDict
+        @param params: request parameters
+
+        @type post_only: bool
+        @param post_only: True if the HTTP method must be POST, otherwise False
+        """
+        if req.scheme != 'https':
+            raise OauthException('invalid_request',
+                                 'Transport layer security must be used for '
+                                 'this request.')
+        if post_only and (req.method != 'POST'):
+            raise OauthException('invalid_request',
+                                 'HTTP POST method must be used for this '
+                                 'request.')
+        seen = set()
+        for key in params.iterkeys():
+            if key in seen:
+                raise OauthException('invalid_request',
+                                     'Parameter "%s" is repeated.' % key)
+            seen.add(key)
+
+    def _error_response(self, request_kind, error, error_description,
+                        start_response):
+        """Returns an error response as Oauth2ServerMiddleware does.
+        @type request_kind: str
+        @param request_kind: kind of request rejected, for the log
+        """
+        response = ("%s: %s" % (error, error_description)).encode('ascii',
+                                                                  'ignore')
+        log.debug("Rejecting %s request: %s - %s", request_kind, error,
+                  error_description)
+        start_response(self._get_http_status_string(httplib.BAD_REQUEST),
+                       [('Content-type', 'text/plain'),
+                        ('Content-length', str(len(response)))
+                        ])
+        return [response]
+
+    @staticmethod
+    def _get_http_status_string(status):
+        return ("%d %s" % (status, httplib.responses[status]))
+
+    @classmethod
+    def _get_config_option(cls, prefix, local_conf, key):
+        value = local_conf.get(prefix + key, cls.PROPERTY_DEFAULTS.get(key, None))
+        log.debug("Oauth2RequestGateMiddleware configuration %s=%s", key, value)
+        return value
+
+    @classmethod
+    def filter_app_factory(cls, app, app_conf, **local_conf):
+        return cls(app, app_conf, **local_conf)
@@ -15,6 +15,11 @@ from webob import Request
 
 from ndg.oauth.server.wsgi.oauth2_server import Oauth2ServerMiddleware
 from ndg.oauth.server.lib.authorization_server import AuthorizationServer
+from ndg.oauth.server.lib.path_matcher import PathMatcher
+from ndg.oauth.server.lib.token_validator import (LocalTokenValidator,
+                                                  RemoteTokenValidator,
+                                                  TokenValidator,
+                                                  TokenValidatorError)
 
 log = logging.getLogger(__name__)
 is_iterable = lambda obj: getattr(obj, '__iter__', False) 
@@ -33,12 +38,21 @@ class Oauth2ResourceServerMiddleware(object):
     '''OAuth 2.0 Resource Server implemented as a WSGI filter.  This filter 
     fronts a given applications resources in order to secure them.  Requests
     are intercepted and validated for an acceptable Access Token
+
+    Tokens are checked by the AuthorizationServer set in environ by an
+    Oauth2ServerMiddleware earlier in the same pipeline, through a
+    LocalTokenValidator, or, if a check_token_url is configured, by calling
+    the check_token service of an authorization server elsewhere, through a
+    RemoteTokenValidator.  Options of the validator are prefixed with
+    check_token_.
     '''
     CERT_DN_ENVIRON_KEY = 'SSL_CLIENT_S_DN'
     DEFAULT_PARAM_PREFIX = 'oauth2.resource_server.'
     
     MATCH_SCOPE_TO_CLIENT_DN_OPTNAME = 'match_scope_to_client_dn'
     RESOURCE_URIPATHS_OPTNAME = 'resource_uripaths'
+    RESOURCE_URIPATH_SCOPES_OPTNAME = 'resource_uripath_scopes'
+    CHECK_TOKEN_OPTION_PREFIX = 'check_token_'
     
     CLAIMED_USER_ID_ENVIRON_KEY_OPTNAME = 'claimed_userid_environ_key'
     DEFAULT_CLAIMED_USER_ID_ENVIRON_KEYNAME = \
@@ -52,7 +66,10 @@ class Oauth2ResourceServerMiddleware(object):
         '__authorization_server',
         'claimed_userid_environ_key',
         '__resource_uripaths',
-        '__required_scope'
+        '__resource_uripath_scopes',
+        '__path_matcher',
+        '__required_scope',
+        '__token_validator'
     )
     def __init__(self, app):
         self._app = app
@@ -60,10 +77,19 @@ class Oauth2ResourceServerMiddleware(object):
         self.claimed_userid_environ_key = \
             self.__class__.DEFAULT_CLAIMED_USER_ID_ENVIRON_KEYNAME
         self.__resource_uripaths = []
+
+        # Paths with a scope of their own, as (compiled pattern, scope)
+        # tuples - they are matched before resource_uripaths
+        self.__resource_uripath_scopes = []
+        self.__path_matcher = PathMatcher([])
         
         # Scope for this resource - multiple space delimited scope values may
         # be set
         self.__required_scope = None
+
+        # Checks tokens with the authorization server in this process unless
+        # configured otherwise
+        self.__token_validator = LocalTokenValidator()
         
     @classmethod
     def filter_app_factory(cls, app, global_conf, prefix=DEFAULT_PARAM_PREFIX,
@@ -89,10 +115,25 @@ class Oauth2ResourceServerMiddleware(object):
             prefix_ = prefix
             
         prefix_len = len(prefix_)
+        check_token_prefix_len = len(self.__class__.CHECK_TOKEN_OPTION_PREFIX)
+        check_token_conf = {}
             
         for optname, val in conf.items():
             if optname.startswith(prefix_):
-                setattr(self, optname[prefix_len:], val)
+                optname = optname[prefix_len:]
+                if optname.startswith(
+                                self.__class__.CHECK_TOKEN_OPTION_PREFIX):
+                    check_token_conf[optname[check_token_prefix_len:]] = val
+                else:
+                    setattr(self, optname, val)
+
+        if check_token_conf.get('url'):
+            self.token_validator = RemoteTokenValidator.from_config(
+                                                            check_token_conf)
+        elif check_token_conf:
+            check_token_conf.pop('url', None)
+            self.token_validator = LocalTokenValidator.from_config(
+                                                            check_token_conf)
         
     @property
     def resource_uripaths(self):
@@ -108,6 +149,46 @@ class Oauth2ResourceServerMiddleware(object):
         else:
             raise TypeError('Expecting single string or space-separated URI '
                             'paths or an iterable; got %r instead' % type(val))
+        self._update_path_matcher()
+
+    @property
+    def resource_uripath_scopes(self):
+        return self.__resource_uripath_scopes
+
+    @resource_uripath_scopes.setter
+    def resource_uripath_scopes(self, val):
+        '''Set URI paths with the scopes they require, which override
+        required_scope
+
+        @type val: basestring or iterable
+        @param val: lines of a URI path pattern followed by space delimited
+        scope values, or an iterable of (URI path pattern, scope) tuples
+        '''
+        if isinstance(val, basestring):
+            val = [line.split(None, 1) for line in val.splitlines()
+                   if line.strip()]
+        elif not is_iterable(val):
+            raise TypeError('Expecting lines of a URI path and scopes or an '
+                            'iterable; got %r instead' % type(val))
+        uripath_scopes = []
+        for item in val:
+            path = item[0]
+            scope = item[1] if len(item) > 1 else None
+            # Scopes are normalised so that paths requiring the same scopes
+            # share cached token checks.
+            scope_values = []
+            for scope_value in (scope or '').split():
+                if scope_value not in scope_values:
+                    scope_values.append(scope_value)
+            uripath_scopes.append((re.compile(path),
+                                   ' '.join(scope_values) or None))
+        self.__resource_uripath_scopes = uripath_scopes
+        self._update_path_matcher()
+
+    def _update_path_matcher(self):
+        self.__path_matcher = PathMatcher(
+            self.__resource_uripath_scopes +
+            [(re_path, None) for re_path in self.__resource_uripaths])
      
     @property
     def authorization_server(self):
@@ -121,6 +202,18 @@ class Oauth2ResourceServerMiddleware(object):
                                                            type(val)))
         self.__authorization_server = val
      
+    @property
+    def token_validator(self):
+        return self.__token_validator
+
+    @token_validator.setter
+    def token_validator(self, val):
+        if not isinstance(val, TokenValidator):
+            raise TypeError('Expecting %r type for "token_validator" '
+                            'attribute; got %r instead' % (TokenValidator,
+                                                           type(val)))
+        self.__token_validator = val
+
     @property
     def required_scope(self):
         return self.__required_scope
@@ -142,15 +235,20 @@ class Oauth2ResourceServerMiddleware(object):
         '''
         request = Request(environ)
         
-        self.authorization_server = environ.get(
+        if isinstance(self.__token_validator, LocalTokenValidator):
+            self.authorization_server = environ.get(
                             self.__class__.AUTHORISATION_SERVER_ENVIRON_KEYNAME)
+            self.__token_validator.authorization_server = \
+                                                    self.authorization_server
         
-        if self._match_uripath(request.path_info):
-            return self.request_resource(request, start_response)
+        match = self.match_resource_uripath(request.path_info)
+        if match is not None:
+            return self.request_resource(request, start_response,
+                                         scope=match[1])
         else:
             return self._app(environ, start_response)
     
-    def request_resource(self, request, start_response):
+    def request_resource(self, request, start_response, scope=None):
         """
         Filter a resource request checking for a valid access token.  Set an
         error response if the token is invalid, otherwise pass on the request to
@@ -162,23 +260,35 @@ class Oauth2ResourceServerMiddleware(object):
         @type start_response: 
         @param start_response: WSGI start response function
 
+        @type scope: str
+        @param scope: scope required for the path, or None for required_scope
+
         @rtype: iterable
         @return: WSGI response
         """
         log.debug("Oauth2ResourceServerMiddleware.request_resource called for "
                   "path %r", request.path_info)
+        if scope is None:
+            scope = self.required_scope
 
         # Check the token
-        token, status, error = self.authorization_server.get_registered_token(
-                                                    request, 
-                                                    scope=self.required_scope)
+        try:
+            user_id, status, error = \
+                self.__token_validator.get_registered_token(request,
+                                                            scope=scope)
+        except TokenValidatorError, e:
+            log.error("Access token check failed: %s", e)
+            user_id, error = None, 'temporarily_unavailable'
+
         if not error:
-            request.environ[self.claimed_userid_environ_key
-                    ] = token.grant.additional_data.get('user_identifier')
+            request.environ[self.claimed_userid_environ_key] = user_id
                             
             return self._app(request.environ, start_response)
         else:
-            status = httplib.OK
+            if error == 'temporarily_unavailable':
+                status = httplib.SERVICE_UNAVAILABLE
+            else:
+                status = httplib.OK
             content_dict ={}
             content_dict.setdefault('error', error)
                         
@@ -193,18 +303,14 @@ class Oauth2ResourceServerMiddleware(object):
             start_response(status_str, headers)
             return [response]
     
-    def _match_uripath(self, path):
-        '''Match the input request against a configured list of URI patterns
-        for which this OAuth middleware should be applied
-        
+    def match_resource_uripath(self, path):
+        '''Find the configured URI pattern that a request path matches
+
         @param path: URI path to match - path minus the domain name and 
         protocol specifier
         @type path: basestring
-        @return: true or false for match found
-        @rtype: bool
+        @return: (compiled pattern, scope) tuple for the path, where scope is
+        None if required_scope applies, or None if the path is not protected
+        @rtype: tuple
         '''
-        for re_path in self.__resource_uripaths:
-            if re_path.match(path):
-                return True
-        
-        return False
\ No newline at end of file
+        return self.__path_matcher.match(path)
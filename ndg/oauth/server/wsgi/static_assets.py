@@ -0,0 +1,343 @@
+"""OAuth 2.0 WSGI server middleware serving the static files used by the
+login and authorisation pages from memory
+"""
+__author__ = "W van Engen"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 FOM / Nikhef"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "wvengen@nikhef.nl"
+__revision__ = "$Id$"
+
+import gzip
+import hashlib
+import httplib
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+from cStringIO import StringIO
+from email.utils import formatdate
+
+log = logging.getLogger(__name__)
+
+
+class _Asset(object):
+    """A file served by StaticAssetsMiddleware."""
+    __slots__ = ('filename', 'content_type', 'body', 'size', 'etag',
+                 'gzip_body', 'gzip_etag', 'fingerprint', 'last_modified',
+                 'no_store')
+
+    def __init__(self, filename, content_type, body, size, digest,
+                 gzip_body, last_modified):
+        self.filename = filename
+        self.content_type = content_type
+        # None for a file too large to be held, which is read when served
+        self.body = body
+        self.size = size
+        self.fingerprint = digest[:12]
+        self.etag = '"%s"' % digest[:20]
+        self.gzip_body = gzip_body
+        self.gzip_etag = '"%s-gz"' % digest[:20]
+        self.last_modified = last_modified
+        self.no_store = False
+
+
+class StaticAssetsMiddleware(object):
+    """
+    Serves the files in a directory from memory, as loaded when it is
+    created, with strong ETags, answering If-None-Match with 304 Not Modified
+    and sending a gzip compressed copy, made at startup, to clients that
+    accept it. Files larger than file_wrapper_size are not held in memory but
+    sent with wsgi.file_wrapper.
+
+    Each file is also served at a fingerprinted path - with a hash of its
+    content before the extension, as given by url_for - with headers that
+    allow it to be cached indefinitely, since the path changes with the
+    content. Other paths are cached for max_age seconds. Files matching
+    no_store_paths, such as those protected by a resource server, are served
+    at either path with headers that stop any cache from storing them.
+
+    Requests for paths that are not files in the directory are passed to the
+    wrapped application, or answered with 404 Not Found if there is none.
+    Files are not reloaded when they change.
+    """
+    # Configuration options
+    CACHE_SCOPE_OPTION = 'cache_scope'
+    DOCUMENT_ROOT_OPTION = 'document_root'
+    FILE_WRAPPER_SIZE_OPTION = 'file_wrapper_size'
+    GZIP_MIN_SIZE_OPTION = 'gzip_min_size'
+    MAX_AGE_OPTION = 'max_age'
+    NO_STORE_PATHS_OPTION = 'no_store_paths'
+    # Configuration option defaults
+    PROPERTY_DEFAULTS = {
+        CACHE_SCOPE_OPTION: 'public',
+        FILE_WRAPPER_SIZE_OPTION: 256 * 1024,
+        GZIP_MIN_SIZE_OPTION: 256,
+        MAX_AGE_OPTION: 3600,
+        NO_STORE_PATHS_OPTION: ''
+    }
+    IMMUTABLE_MAX_AGE = 365 * 86400
+    COMPRESSIBLE_TYPES = frozenset(['application/javascript',
+                                    'application/x-javascript',
+                                    'application/json',
+                                    'image/svg+xml'])
+    IGNORED_EXTENSIONS = frozenset(['.py', '.pyc', '.pyo'])
+    READ_BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, app, document_root, max_age=3600,
+                 file_wrapper_size=256 * 1024, gzip_min_size=256,
+                 cache_scope='public', no_store_paths=''):
+        """
+        @type app: WSGI application
+        @param app: wrapped application/middleware, or None
+
+        @type document_root: basestring
+        @param document_root: directory of the files to serve
+
+        @type max_age: int
+        @param max_age: time in seconds for which clients may cache files
+        requested by their plain paths
+
+        @type file_wrapper_size: int
+        @param file_wrapper_size: size in bytes above which files are read
+        when requested rather than held in memory
+
+        @type gzip_min_size: int
+        @param gzip_min_size: size in bytes below which text files are not
+        compressed
+
+        @type cache_scope: basestring
+        @param cache_scope: 'public', or 'private' to stop shared caches from
+        storing files, for files that are only served to some users
+
+        @type no_store_paths: basestring or iterable
+        @param no_store_paths: regular expressions, space separated if a
+        string, matching the paths of files that no cache may store
+        """
+        if not document_root or not os.path.isdir(document_root):
+            raise ValueError('StaticAssetsMiddleware: document_root %r is not '
+                             'a directory' % document_root)
+        self._app = app
+        self.document_root = os.path.abspath(document_root)
+        self.max_age = int(max_age)
+        self.file_wrapper_size = int(file_wrapper_size)
+        self.gzip_min_size = int(gzip_min_size)
+        if cache_scope not in ('public', 'private'):
+            raise ValueError('StaticAssetsMiddleware: cache_scope must be '
+                             '"public" or "private"; got %r' % cache_scope)
+        self.cache_scope = cache_scope
+        if isinstance(no_store_paths, basestring):
+            no_store_paths = no_store_paths.split()
+        self.no_store_paths = [re.compile(path) for path in no_store_paths]
+        # Assets by path, and (asset, fingerprinted) tuples by request path
+        self.assets = {}
+        self._paths = {}
+        self._load()
+
+    def _load(self):
+        """Reads the files in the document root."""
+        for dirpath, dirnames, filenames in os.walk(self.document_root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for name in filenames:
+                if (name.startswith('.') or
+                    os.path.splitext(name)[1] in self.IGNORED_EXTENSIONS):
+                    continue
+                filename = os.path.join(dirpath, name)
+                path = '/' + os.path.relpath(filename, self.document_root
+                                             ).replace(os.sep, '/')
+                asset = self._load_asset(filename)
+                asset.no_store = any(re_path.match(path)
+                                     for re_path in self.no_store_paths)
+                self.assets[path] = asset
+                self._paths[path] = (asset, False)
+                self._paths[self._fingerprinted_path(path, asset)] = (asset,
+                                                                      True)
+        log.info("Loaded %d static files from %s", len(self.assets),
+                 self.document_root)
+
+    def _load_asset(self, filename):
+        content_type = (mimetypes.guess_type(filename)[0] or
+                        'application/octet-stream')
+        size = os.path.getsize(filename)
+        digest = hashlib.sha1()
+        body = []
+        with open(filename, 'rb') as asset_file:
+            for block in iter(lambda: asset_file.read(self.READ_BLOCK_SIZE),
+                              ''):
+                digest.update(block)
+                if size <= self.file_wrapper_size:
+                    body.append(block)
+        body = ''.join(body) if size <= self.file_wrapper_size else None
+
+        gzip_body = None
+        if (body is not None and size >= self.gzip_min_size and
+            (content_type.startswith('text/') or
+             content_type in self.COMPRESSIBLE_TYPES)):
+            buf = StringIO()
+            gzip_file = gzip.GzipFile(filename='', mode='wb', fileobj=buf,
+                                      mtime=0)
+            gzip_file.write(body)
+            gzip_file.close()
+            gzip_body = buf.getvalue()
+            if len(gzip_body) >= size:
+                gzip_body = None
+
+        if content_type.startswith('text/') or content_type in (
+                                                    self.COMPRESSIBLE_TYPES):
+            content_type += '; charset=utf-8'
+        return _Asset(filename, content_type, body, size, digest.hexdigest(),
+                      gzip_body, formatdate(os.path.getmtime(filename),
+                                            usegmt=True))
+
+    @staticmethod
+    def _fingerprinted_path(path, asset):
+        root, ext = posixpath.splitext(path)
+        return '%s.%s%s' % (root, asset.fingerprint, ext)
+
+    def url_for(self, path):
+        """Returns the fingerprinted path of a file, which may be cached
+        indefinitely.
+        @type path: basestring
+        @param path: path of the file relative to the document root, starting
+        with /
+        @rtype: basestring
+        @return: fingerprinted path, or the path itself if it is not a file
+        served
+        """
+        asset = self.assets.get(path)
+        if asset is None:
+            return path
+        return self._fingerprinted_path(path, asset)
+
+    def __call__(self, environ, start_response):
+        """
+        @type environ: dict
+        @param environ: WSGI environment
+
+        @type start_response:
+        @param start_response: WSGI start response function
+
+        @rtype: iterable
+        @return: WSGI response
+        """
+        entry = self._paths.get(environ.get('PATH_INFO', ''))
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if entry is None or method not in ('GET', 'HEAD'):
+            if self._app is not None:
+                return self._app(environ, start_response)
+            response = "Not Found"
+            start_response(self._get_http_status_string(httplib.NOT_FOUND),
+                           [('Content-type', 'text/plain'),
+                            ('Content-length', str(len(response)))
+                            ])
+            return [response]
+
+        asset, fingerprinted = entry
+        if asset.no_store:
+            cache_control = 'no-store'
+        elif fingerprinted:
+            cache_control = '%s, max-age=%d, immutable' % (
+                                    self.cache_scope, self.IMMUTABLE_MAX_AGE)
+        else:
+            cache_control = '%s, max-age=%d' % (self.cache_scope,
+                                                self.max_age)
+        use_gzip = (asset.gzip_body is not None and
+                    self._accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING')))
+        etag = asset.gzip_etag if use_gzip else asset.etag
+        headers = [('ETag', etag), ('Cache-Control', cache_control)]
+        if asset.gzip_body is not None:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        if self._etag_matches(environ.get('HTTP_IF_NONE_MATCH'), asset):
+            start_response(self._get_http_status_string(httplib.NOT_MODIFIED),
+                           headers)
+            return []
+
+        if use_gzip:
+            body = asset.gzip_body
+            headers.append(('Content-Encoding', 'gzip'))
+        else:
+            body = asset.body
+        headers.extend([('Content-Type', asset.content_type),
+                        ('Content-Length',
+                         str(len(body) if body is not None else asset.size)),
+                        ('Last-Modified', asset.last_modified)])
+        start_response(self._get_http_status_string(httplib.OK), headers)
+        if method == 'HEAD':
+            return []
+        if body is not None:
+            return [body]
+        asset_file = open(asset.filename, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(asset_file, self.READ_BLOCK_SIZE)
+        return self._iter_file(asset_file)
+
+    def _iter_file(self, asset_file):
+        try:
+            for block in iter(lambda: asset_file.read(self.READ_BLOCK_SIZE),
+                              ''):
+                yield block
+        finally:
+            asset_file.close()
+
+    @staticmethod
+    def _accepts_gzip(accept_encoding):
+        """Returns whether an Accept-Encoding header value allows gzip."""
+        if not accept_encoding:
+            return False
+        for coding in accept_encoding.split(','):
+            params = coding.strip().split(';')
+            if params[0].strip().lower() not in ('gzip', 'x-gzip'):
+                continue
+            for param in params[1:]:
+                name, _, value = param.partition('=')
+                if name.strip() == 'q':
+                    try:
+                        return float(value) > 0
+                    except ValueError:
+                        return False
+            return True
+        return False
+
+    @staticmethod
+    def _etag_matches(if_none_match, asset):
+        """Returns whether an If-None-Match header value matches either
+        representation of an asset, comparing weakly as for a GET request.
+        """
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        for etag in if_none_match.split(','):
+            etag = etag.strip()
+            if etag.startswith('W/'):
+                etag = etag[2:]
+            if etag == asset.etag or etag == asset.gzip_etag:
+                return True
+        return False
+
+    @staticmethod
+    def _get_http_status_string(status):
+        return ("%d %s" % (status, httplib.responses[status]))
+
+    @classmethod
+    def _get_config_option(cls, local_conf, key):
+        value = local_conf.get(key, cls.PROPERTY_DEFAULTS.get(key, None))
+        log.debug("StaticAssetsMiddleware configuration %s=%s", key, value)
+        return value
+
+    @classmethod
+    def filter_app_factory(cls, app, app_conf, **local_conf):
+        return cls(app, *[cls._get_config_option(local_conf, key)
+                          for key in (cls.DOCUMENT_ROOT_OPTION,
+                                      cls.MAX_AGE_OPTION,
+                                      cls.FILE_WRAPPER_SIZE_OPTION,
+                                      cls.GZIP_MIN_SIZE_OPTION,
+                                      cls.CACHE_SCOPE_OPTION,
+                                      cls.NO_STORE_PATHS_OPTION)])
+
+    @classmethod
+    def app_factory(cls, app_conf, **local_conf):
+        return cls.filter_app_factory(None, app_conf, **local_conf)
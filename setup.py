@@ -96,6 +96,7 @@ setup(
         ]
     },
     zip_safe = False,
+    test_suite = 'ndg.oauth.server.test',
     classifiers = [
         'Development Status :: 3 - Alpha',
         'Environment :: Console',